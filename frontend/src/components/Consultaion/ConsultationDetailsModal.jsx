@@ -320,6 +320,9 @@ const ConsultationDetailsModal = ({
                       toast.error("Error loading video. Please try again or download the file.");
                     }}
                   >
+                    {consultationData.video_manifest && (
+                      <source src={`${baseUrl}/consultations${consultationData.video_manifest}`} type="application/vnd.apple.mpegurl" />
+                    )}
                     <source src={`${baseUrl}/consultations${consultationData.video}`} type="video/mp4" />
                     <source src={`${baseUrl}/consultations${consultationData.video}`} type="video/webm" />
                     <source src={`${baseUrl}/consultations${consultationData.video}`} type="video/ogg" />
@@ -20,6 +20,8 @@ const VideoCallPermissionModal = ({ isOpen, onClose, onStartCall, doctor }) => {
   const [walletBalance, setWalletBalance] = useState(0);
   const [isProcessing, setIsProcessing] = useState(false);
   const [step, setStep] = useState(1);
+  // Reused on retries so a repeated click can't book twice
+  const [bookingKey, setBookingKey] = useState(() => crypto.randomUUID());
   
   const navigate = useNavigate();
   const userId = useSelector((state) => state.userDetails.id);
@@ -73,7 +75,7 @@ const VideoCallPermissionModal = ({ isOpen, onClose, onStartCall, doctor }) => {
     };
 
     try {
-      const response = await CreateConsultaionRoute(data);
+      const response = await CreateConsultaionRoute(data, bookingKey);
      
       const consultation_id = response.data.consultation_id;
 
@@ -94,7 +96,11 @@ const VideoCallPermissionModal = ({ isOpen, onClose, onStartCall, doctor }) => {
         });
       }, 4000);
     } catch (error) {
-      toast.error(`Unable to Start Now :${error.response.data.detail}`, { position: "bottom-center" });
+      // A finished attempt keeps answering its key with the same failure, so the next try needs a new one
+      if (error.response && error.response.data.detail !== "This booking is already being processed") {
+        setBookingKey(crypto.randomUUID());
+      }
+      toast.error(`Unable to Start Now :${error.response?.data?.detail}`, { position: "bottom-center" });
       setIsProcessing(false);
       navigate('/user_view_psychologist')
     }
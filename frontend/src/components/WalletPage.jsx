@@ -83,7 +83,7 @@ const WalletPage = () => {
       });
 
       if (!result.isConfirmed) return;
-      await fetchMoneyFromWalletRoute(userId,walletData)
+      await fetchMoneyFromWalletRoute(userId,walletData,crypto.randomUUID())
       
       toast.success("Money Withdrawn successfully", {
         position: "bottom-center",
@@ -107,7 +107,7 @@ const WalletPage = () => {
         order_id: razorpay_order_id,
         handler: async (response) => {
           try {
-            const paymentResponse = await addMoneyToWalletFromRazorpayRoute(userId,finalTotal)
+            const paymentResponse = await addMoneyToWalletFromRazorpayRoute(userId,finalTotal,response.razorpay_payment_id)
             if (paymentResponse.status === 201) {
               toast.success("Payment Successful! Money Added.", {
                 position: "bottom-center",
@@ -47,10 +47,11 @@ export const getCompliantConsultation = async (consultations_id) => {
   );
   return response.data;
 };
-export const CreateConsultaionRoute = async (data) => {
+export const CreateConsultaionRoute = async (data, idempotencyKey) => {
   const response = await axiosInstance.post(
     "/consultations/create_consultation",
-    data
+    data,
+    { headers: { "Idempotency-Key": idempotencyKey } }
   );
   return response;
 };
@@ -12,10 +12,11 @@ export const getWalletDetailsRoute = async (userId, page, limit) => {
   );
   return response;
 };
-export const fetchMoneyFromWalletRoute = async (userId, walletData) => {
+export const fetchMoneyFromWalletRoute = async (userId, walletData, idempotencyKey) => {
   const response = await axiosInstance.post(
     `/payments/fetch_money_from_wallet`,
-    { user_id: userId, psychologist_id: 1, psychologist_fee: walletData }
+    { user_id: userId, psychologist_id: 1, psychologist_fee: walletData },
+    { headers: { "Idempotency-Key": idempotencyKey } }
   );
   return response;
 };
@@ -26,12 +27,13 @@ export const createRazorpayOrderRoute = async (userId, finalTotal) => {
   });
   return response;
 };
-export const addMoneyToWalletFromRazorpayRoute = async (userId, finalTotal) => {
+export const addMoneyToWalletFromRazorpayRoute = async (userId, finalTotal, razorpayPaymentId) => {
   const response = await axiosInstance.post(
     "/payments/add_money_to_wallet_from_razorpay",
     {
       user_id: userId,
       totalAmount: finalTotal,
+      razorpay_payment_id: razorpayPaymentId,
     }
   );
   return response;
@@ -4,12 +4,19 @@ import { useNavigate } from 'react-router-dom';
 import { persistor } from '../store/store';
 import { destroyDetails } from '../store/UserDetailsSlice';
 import {  socketDisconnected } from '../store/socketSlice';
+import axiosInstance from '../axiosconfig';
 
 function useLogout() {
   const navigate = useNavigate();
   const dispatch = useDispatch();
 
-  return () => {
+  return async () => {
+    try {
+      // Revokes the access and refresh tokens server side
+      await axiosInstance.post('/users/logout', {}, { withCredentials: true });
+    } catch (e) {
+      console.error('Logout request failed:', e);
+    }
     dispatch(destroyDetails());
     dispatch(socketDisconnected());
    console.log('Before purge', localStorage.getItem('persist:root'));
@@ -0,0 +1,37 @@
+"""adding direct chat uploads
+
+Revision ID: 2d9f6b3a8e15
+Revises: e8a2c5d17f30
+Create Date: 2026-10-18 13:42:51.208734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2d9f6b3a8e15'
+down_revision: Union[str, None] = 'e8a2c5d17f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chat_attachments', sa.Column('consultation_map_id', sa.Integer(), nullable=True))
+    op.add_column('chat_attachments', sa.Column('storage_key', sa.Text(), nullable=True))
+    op.create_index(op.f('ix_chat_attachments_consultation_map_id'), 'chat_attachments', ['consultation_map_id'], unique=False)
+    op.create_foreign_key(
+        'chat_attachments_consultation_map_id_fkey', 'chat_attachments', 'consultation_mapping',
+        ['consultation_map_id'], ['id'], ondelete='CASCADE'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('chat_attachments_consultation_map_id_fkey', 'chat_attachments', type_='foreignkey')
+    op.drop_index(op.f('ix_chat_attachments_consultation_map_id'), table_name='chat_attachments')
+    op.drop_column('chat_attachments', 'storage_key')
+    op.drop_column('chat_attachments', 'consultation_map_id')
@@ -0,0 +1,43 @@
+"""adding psychologist rating summary
+
+Revision ID: 3c7e2a91f4b6
+Revises: d720cd98dce4
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7e2a91f4b6'
+down_revision: Union[str, None] = 'd720cd98dce4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('psychologist_rating',
+    sa.Column('psychologist_id', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.BigInteger(), nullable=False),
+    sa.Column('rating_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('psychologist_id')
+    )
+    # Seed the summary from the feedback already on record
+    op.execute("""
+        INSERT INTO psychologist_rating (psychologist_id, rating_sum, rating_count)
+        SELECT c.psychologist_id, SUM(f.rating), COUNT(f.id)
+        FROM feedback f
+        JOIN consultation c ON f.consultation_id = c.id
+        WHERE c.psychologist_id IS NOT NULL
+        GROUP BY c.psychologist_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('psychologist_rating')
@@ -0,0 +1,36 @@
+"""adding keyset pagination indexes
+
+Revision ID: 5e8b3d27a1c4
+Revises: 9a4d1f0c6e2b
+Create Date: 2026-10-18 11:47:05.226618
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8b3d27a1c4'
+down_revision: Union[str, None] = '9a4d1f0c6e2b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_consultation_created_at_id', 'consultation', ['created_at', 'id'], unique=False)
+    op.create_index('ix_consultation_user_id_created_at_id', 'consultation', ['user_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_consultation_psychologist_id_created_at_id', 'consultation', ['psychologist_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_notifications_created_at_id', 'notifications', ['created_at', 'id'], unique=False)
+    op.create_index('ix_complaint_created_at_id', 'complaint', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_complaint_created_at_id', table_name='complaint')
+    op.drop_index('ix_notifications_created_at_id', table_name='notifications')
+    op.drop_index('ix_consultation_psychologist_id_created_at_id', table_name='consultation')
+    op.drop_index('ix_consultation_user_id_created_at_id', table_name='consultation')
+    op.drop_index('ix_consultation_created_at_id', table_name='consultation')
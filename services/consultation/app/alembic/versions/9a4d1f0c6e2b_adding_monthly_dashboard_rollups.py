@@ -0,0 +1,49 @@
+"""adding monthly dashboard rollups
+
+Revision ID: 9a4d1f0c6e2b
+Revises: 3c7e2a91f4b6
+Create Date: 2026-10-18 11:02:17.540931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4d1f0c6e2b'
+down_revision: Union[str, None] = '3c7e2a91f4b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('psychologist_monthly_stats',
+    sa.Column('psychologist_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.Date(), nullable=False),
+    sa.Column('booked_sessions', sa.Integer(), nullable=False),
+    sa.Column('gross_fees', sa.BigInteger(), nullable=False),
+    sa.Column('platform_fees', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('completed_sessions', sa.Integer(), nullable=False),
+    sa.Column('completed_fees', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('psychologist_id', 'period')
+    )
+    op.create_index(op.f('ix_psychologist_monthly_stats_period'), 'psychologist_monthly_stats', ['period'], unique=False)
+    op.create_table('psychologist_monthly_patient',
+    sa.Column('psychologist_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('psychologist_id', 'period', 'user_id')
+    )
+    op.create_index(op.f('ix_psychologist_monthly_patient_period'), 'psychologist_monthly_patient', ['period'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_psychologist_monthly_patient_period'), table_name='psychologist_monthly_patient')
+    op.drop_table('psychologist_monthly_patient')
+    op.drop_index(op.f('ix_psychologist_monthly_stats_period'), table_name='psychologist_monthly_stats')
+    op.drop_table('psychologist_monthly_stats')
@@ -0,0 +1,28 @@
+"""adding chat history index
+
+Revision ID: c41f6e0b9d73
+Revises: 5e8b3d27a1c4
+Create Date: 2026-10-18 12:20:33.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41f6e0b9d73'
+down_revision: Union[str, None] = '5e8b3d27a1c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_chat_consultation_map_id_created_at_id', 'chat', ['consultation_map_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_consultation_map_id_created_at_id', table_name='chat')
@@ -0,0 +1,28 @@
+"""adding video manifest
+
+Revision ID: e8a2c5d17f30
+Revises: c41f6e0b9d73
+Create Date: 2026-10-18 13:05:12.417356
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a2c5d17f30'
+down_revision: Union[str, None] = 'c41f6e0b9d73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('consultation', sa.Column('video_manifest', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('consultation', 'video_manifest')
@@ -1,19 +1,18 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from dependencies.database import get_session
+from dependencies.database import get_session, async_session
 import crud.crud as crud
 from fastapi.logger import logger
 from datetime import datetime ,date
-from infra.external.user_service import (
-                    get_user_details, get_doctor_details, get_minimal_user_details, 
-                    change_doctor_availability, check_doctor_availability,fetch_fees_from_doctor
-                    )
+from infra.external.user_service import get_users_details_bulk
 from fastapi import ( 
                      UploadFile, File, Form,Request,WebSocket, 
                      WebSocketDisconnect,APIRouter, Depends, 
-                     HTTPException,status
+                     HTTPException,status,Response,Header
                      )
-from infra.external.payment_service import fetch_money_from_wallet,add_money_to_wallet
+from infra.booking import book_consultation
+from crud.booking import get_booking
+from crud.outbox import outbox_relay
 from typing import Dict
 import asyncio
 import logging
@@ -22,18 +21,21 @@ from requests.auth import HTTPBasicAuth
 import os
 import re
 from fastapi import Query
-from asyncio import gather
 
-from fastapi.responses import FileResponse,JSONResponse
+from fastapi.responses import JSONResponse
 from pathlib import Path
 from typing import Optional
-from core.redis import redis_client
+from urllib.parse import quote
+from redis.exceptions import RedisError
+from signaling.rooms import broker, chat_room_channel, signaling_channel, notification_channel
+from signaling.websocket import Connection
+from crud.chat_writer import chat_writer
+from infra.recordings import HLS_DIR, RECORDINGS_DIR, recording_jobs, recording_registry
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', default=None)
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', default=None)
 import uuid
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-import subprocess
 from pathlib import Path
 
 import json
@@ -42,102 +44,73 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 load_dotenv()
 from uuid import uuid4
-from fastapi.concurrency import run_in_threadpool
-from utils.cloudinary_utils import upload_to_cloudinary
+from utils.storage import storage
+from utils.file_scan import SNIFF_BYTES, content_matches, scan_queue
 from utils.time import utc_to_ist
+from utils.pagination import paginate
+from utils.file_response import serve_file
 from utils.zego_server_assistant import generate_token04, TokenInfo
 from schemas.consultation import (
         PaginatedConsultationResponse, CompliantSchema, ConsultationResponseUser,
         NotificationResponse, FeedbackCreationSchema, CreateConsultationSchema, 
         ConsultationResponse, ConsultationResponseUserCompliant,MappingResponse,
         MappingResponseUser, CompliantSchemaa, UpdateConsultationSchema,
-        CreateFeedbackSchema, CreateNotificationSchema,PaginatedNotificationResponse,
+        CreateFeedbackSchema, CreateNotificationSchema,PaginatedNotificationResponse,PsychologistIdsSchema,
         CompliantPaginatedResponse, UpdateComplaintSchema,UserNameWithProfileImage,
-        UserProfileImage,TokenRequest,AdminPaginatedConsultationResponse
+        UserProfileImage,TokenRequest,AdminPaginatedConsultationResponse,ChatUploadSignSchema
         )
 from crud.crud import ( 
         count_consultations, get_complaints_crud, register_complaint_crud, consultation_for_user, 
         get_all_notifications, update_consultation_status, doctor_dashboard_details_crud, 
-        admin_dashboard_details_crud, save_chat_message_with_attachments, get_doctor_fee_after_platform_fee,
-        get_psychologist_rating_crud, get_feedbacks_crud,count_consultations_by_doctor_crud, consultation_for_doctor,
-        consultation_details_with_id ,create_notification,create_consultation, get_all_consultation, 
+        admin_dashboard_details_crud, save_chat_message_with_attachments,
+        get_psychologist_rating_crud, get_psychologist_ratings_bulk_crud, get_feedbacks_crud,count_consultations_by_doctor_crud, consultation_for_doctor,
+        consultation_details_with_id ,create_notification, get_all_consultation, 
         get_doctor_consultations ,get_chat_messages_using_cons_id,get_all_mapping_for_chat_user, 
-        update_analysis_consultation,save_recording_database, create_feedback,get_all_mapping_for_chat,
+        update_analysis_consultation, create_feedback,get_all_mapping_for_chat,
         count_notifications,get_notifications_crud,count_compliants,get_compliants_crud,update_complaints_curd,
-        delete_partial_consultation, verify_user_consultation,count_all_consultation,
-        validate_both_owns_consultation,validate_user_for_consultaion_mapping,
-        validate_user_owns_consultation,validate_doctor_owns_consultation
+        verify_user_consultation,count_all_consultation,
+        validate_both_owns_consultation,
+        validate_user_owns_consultation,validate_doctor_owns_consultation,
+        create_unlinked_attachment,get_direct_attachment,complete_direct_attachment,quarantine_attachment
         )
 
 
 router = APIRouter(tags=["consultations"])
 logger = logging.getLogger("uvicorn.error")
 
+# Statuses either participant may set; 'completed' is the doctor's, through set_analysis_from_doctor
+PARTICIPANT_STATUSES = {"ended"}
+
 
 @router.post("/create_consultation")
 async def create_consultation_route(
     data: CreateConsultationSchema,
     current_user: str = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session)
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
 ):
-    doctor_locked = False
-    consultation_created = False
-    consultation_id = None
-
-    lock_key = f"lock:doctor:{data.psychologist_id}"
-    lock_token = str(uuid.uuid4())
-
+    user_id = current_user["user_id"]
+    if int(user_id) != data.user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
     try:
-        user_id = current_user["user_id"]
-        if int(user_id) != data.user_id:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
-        
-        # First acquire Redis lock — no availability check before this!
-        lock_acquired = await redis_client.set(lock_key, lock_token, ex=10, nx=True)
-        if not lock_acquired:
-            raise HTTPException(status_code=409, detail="Doctor is currently busy. Try again.")
-        # Now check availability after locking 
-        response = await check_doctor_availability(data.dict())
-        logger.info(f"[{current_user}] Attempting to acquire lock for doctor {data.psychologist_id} and doctor is {response}")
-        if response == False:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Seems like doctor is not available")
-        # Mark doctor as unavailable
-        responses = await change_doctor_availability(data.dict(), False)
-        if not responses.get("status"):
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Doctor is not available")
-        doctor_locked = True
-        # Create consultation
-        fees = await fetch_fees_from_doctor(data.psychologist_id)
-        consultation_id = await create_consultation(session, data,fees)
-        consultation_created = True
-        # Charge wallet
-        await fetch_money_from_wallet(data.dict(),fees)
-        
-        return JSONResponse(
-            content={
-                "status": "success",
-                "consultation_id":consultation_id,
-                }, status_code=201
-            )
+        return await book_consultation(data, idempotency_key or uuid.uuid4().hex)
     except HTTPException:
-        if consultation_created and consultation_id:
-            await delete_partial_consultation(session, consultation_id)
-        if doctor_locked:
-            await change_doctor_availability(data.dict(), True)
         raise
     except Exception as e:
         logger.error(f"Error creating consultation: {e}")
-        if consultation_created and consultation_id:
-            await delete_partial_consultation(session, consultation_id)
-        if doctor_locked:
-            await change_doctor_availability(data.dict(), True)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
-    finally:
-        # Release the lock only if we still own it
-        stored_token = await redis_client.get(lock_key)
-        if stored_token == lock_token:
-            await redis_client.delete(lock_key)
     
+@router.get("/bookings/{booking_id}")
+async def get_booking_status(booking_id: int, current_user: str = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    booking = await get_booking(session, booking_id)
+    if not booking or booking.user_id != int(current_user["user_id"]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Booking not found")
+    return {
+        "booking_id": booking.id,
+        "consultation_id": booking.consultation_id,
+        "booking_status": booking.status,
+        "reason": booking.failure_reason,
+    }
+
 @router.post("/register_complaint")
 async def register_complaint_route(data:CompliantSchemaa,current_user: str = Depends(get_current_user),session: AsyncSession = Depends(get_session)
 ):
@@ -207,11 +180,10 @@ async def set_analysis_from_doctor(data: UpdateConsultationSchema,current_user:
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You are not authorized"
             )
+        # The doctor's payout is queued in the same transaction
         await update_analysis_consultation(session, data)
-        income = await get_doctor_fee_after_platform_fee(session,data.consultation_id)
-        data={'user_id':current_user,'totalAmount':income}
-        await add_money_to_wallet(data)
-        
+        outbox_relay.notify()
+
     except HTTPException:
         raise
     except Exception as e:
@@ -221,13 +193,17 @@ async def set_analysis_from_doctor(data: UpdateConsultationSchema,current_user:
 @router.put("/update_consultation_status/{status}/{consultation_id}")
 async def update_consultation_status_route(status: str,consultation_id:int,current_user: str = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     try:
+        # Completion pays the doctor out, so it only happens through set_analysis_from_doctor
+        if status not in PARTICIPANT_STATUSES:
+            raise HTTPException(status_code=400, detail="Invalid consultation status")
         if not await validate_both_owns_consultation(session, consultation_id, int(current_user["user_id"])
 ):
             raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
+                status_code=403,
                 detail="You are not authorized"
             )
-        return await update_consultation_status(session,status,consultation_id)
+        await update_consultation_status(session,status,consultation_id)
+        outbox_relay.notify()
     except HTTPException:
         raise
     except Exception as e:
@@ -250,30 +226,26 @@ async def get_consultation(current_user: str = Depends(get_current_user),
     limit: int = Query(10, le=100),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    cursor: bool = Query(False),
+    include_count: bool = Query(True),
 ):
     role = current_user["role"]
     if role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
     try:
-        offset = (page - 1) * limit
-        consultation = await get_all_consultation(session,start_date,end_date,limit=limit, skip=offset)
-        if not consultation:
-            logger.info(f"No consultations found for date range: {start_date} to {end_date}")
-            return {
-                "count": 0,
-                "next": None,
-                "previous": None,
-                "results": []
-            }
-        total = await count_all_consultation(session,start_date,end_date)
-        next_url = f"/get_consultation?page={page + 1}&limit={limit}" if offset + limit < total else None
-        prev_url = f"/get_consultation?page={page - 1}&limit={limit}" if page > 1 else None
-        return {
-            "count": total,
-            "next": next_url,
-            "previous": prev_url,
-            "results": consultation
-        }
+        return await paginate(
+            lambda **page_args: get_all_consultation(session, start_date, end_date, **page_args),
+            lambda: count_all_consultation(session, start_date, end_date),
+            base_url="/get_consultation",
+            count_key=f"consultation:all:{start_date}:{end_date}",
+            page=page, limit=limit, after=after, before=before,
+            cursor=cursor, include_count=include_count,
+            params={"start_date": start_date, "end_date": end_date},
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=500, detail="Unexpected Error Occured")
@@ -290,14 +262,14 @@ async def get_consultation(doctorId:int,current_user: str = Depends(get_current_
         
         if not consultation:
             raise HTTPException(status_code=404, detail="Consultation not found")
+        user_details = await get_users_details_bulk(consult.user_id for consult in consultation)
         enriched_consultations=[]
         for consult in consultation:
-            user_data = await get_user_details(consult.user_id) 
             enriched_consultations.append(MappingResponse(
                 id=consult.id,
                 user_id=consult.user_id,
                 psychologist_id=consult.psychologist_id,
-                user=user_data  
+                user=user_details.get(consult.user_id)
             ))
 
         return enriched_consultations
@@ -318,14 +290,14 @@ async def get_consultation_mapping_for_user_chat(userId:int,current_user: str =
     
         if not consultation:
             raise HTTPException(status_code=404, detail="Consultation not found")
+        doctor_details = await get_users_details_bulk(consult.psychologist_id for consult in consultation)
         enriched_consultations=[]
         for consult in consultation:
-            user_data = await get_doctor_details(consult.psychologist_id) 
             enriched_consultations.append(MappingResponseUser(
                 id=consult.id,
                 user_id=consult.user_id,    
                 psychologist_id=consult.psychologist_id,
-                user=user_data  
+                user=doctor_details.get(consult.psychologist_id)
             ))
 
         return enriched_consultations
@@ -366,15 +338,27 @@ async def get_turn_credentials():
 
 @router.get('/get_chat_messages/{consultation_id}')
 async def get_chat_messages(
-    consultation_id: int,current_user: str = Depends(get_current_user),
+    consultation_id: int,
+    response: Response,
+    before_id: Optional[int] = Query(None, ge=1),
+    after_id: Optional[int] = Query(None, ge=1),
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    current_user: str = Depends(get_current_user),
     session: AsyncSession = Depends(get_session)
 ):
     try:
+        if before_id and after_id:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="Use either before_id or after_id")
         user_id = int(current_user["user_id"])
-        validate_user= await validate_user_for_consultaion_mapping(session,user_id)
-        if not validate_user:
+        mapping = await verify_user_consultation(session, consultation_id, user_id)
+        if not mapping:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
-        messages = await get_chat_messages_using_cons_id(session, consultation_id)
+        if (before_id or after_id) and not limit:
+            limit = 50
+        messages, has_more = await get_chat_messages_using_cons_id(
+            session, consultation_id, before_id=before_id, after_id=after_id, limit=limit
+        )
+        response.headers["X-Has-More"] = "true" if has_more else "false"
         return messages
     except HTTPException :
         raise
@@ -400,7 +384,11 @@ async def get_complaints_route(user_id:int,current_user: str = Depends(get_curre
 async def get_consultation_for_user(
     user_id: int,
     page: int = Query(1, ge=1),
-    limit: int = Query(10, le=100),current_user: str = Depends(get_current_user),
+    limit: int = Query(10, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    cursor: bool = Query(False),
+    include_count: bool = Query(True),current_user: str = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     try:
@@ -408,16 +396,18 @@ async def get_consultation_for_user(
         if int(user_id) != int(userId):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
         
-        total = await count_consultations(session, user_id)
-        offset = (page - 1) * limit
-        consultations = await consultation_for_user(session, user_id, skip=offset, limit=limit)
+        page_data = await paginate(
+            lambda **page_args: consultation_for_user(session, user_id, **page_args),
+            lambda: count_consultations(session, user_id),
+            base_url=f"/get_consultation_for_user/{user_id}",
+            count_key=f"consultation:user:{user_id}",
+            page=page, limit=limit, after=after, before=before,
+            cursor=cursor, include_count=include_count,
+        )
+        consultations = page_data["results"]
 
-        #  Parallel fetch user_data
-        user_details_tasks = [
-            get_doctor_details(consult.psychologist_id)
-            for consult in consultations
-        ]
-        user_details = await gather(*user_details_tasks)
+        # One bulk lookup for every doctor on the page
+        user_details = await get_users_details_bulk(consult.psychologist_id for consult in consultations)
 
         #  Combine consultation with corresponding user data
         enriched = [
@@ -428,20 +418,13 @@ async def get_consultation_for_user(
                 status=consult.status,
                 duration=consult.duration,
                 video=consult.video,
-                user=user_details[i]
+                video_manifest=consult.video_manifest,
+                user=user_details.get(consult.psychologist_id)
             )
-            for i, consult in enumerate(consultations)
+            for consult in consultations
         ]
 
-        next_url = f"/get_consultation_for_user/{user_id}?page={page + 1}&limit={limit}" if offset + limit < total else None
-        prev_url = f"/get_consultation_for_user/{user_id}?page={page - 1}&limit={limit}" if page > 1 else None
-
-        return {
-            "count": total,
-            "next": next_url,
-            "previous": prev_url,
-            "results": enriched
-        }
+        return {**page_data, "results": enriched}
     except HTTPException :
         raise
     except Exception as e:
@@ -467,8 +450,9 @@ async def get_compliant_consultation(
             )
 
         # Get user and doctor details
-        doctor = await get_doctor_details(consultation.psychologist_id)
-        user = await get_user_details(consultation.user_id)
+        details = await get_users_details_bulk([consultation.psychologist_id, consultation.user_id])
+        doctor = details.get(consultation.psychologist_id)
+        user = details.get(consultation.user_id)
         
         if not doctor or not user:
             raise HTTPException(
@@ -484,17 +468,18 @@ async def get_compliant_consultation(
             "status": consultation.status,
             "duration": consultation.duration,
             "video": consultation.video if consultation.video else None,
+            "video_manifest": consultation.video_manifest,
             "user": {
                 "name": user.get('name'),
                 "user_profile": {
-                    "profile_image": user.get('user_profile', {}).get('profile_image')
+                    "profile_image": (user.get('user_profile') or {}).get('profile_image')
                 }
             } if user else None,
             "doctor": {
                 "name": doctor.get('name'),
                 "psychologist_profile": {
-                    "profile_image": doctor.get('psychologist_profile', {}).get('profile_image'),
-                    "specialization": doctor.get('psychologist_profile', {}).get('specialization')
+                    "profile_image": (doctor.get('psychologist_profile') or {}).get('profile_image'),
+                    "specialization": (doctor.get('psychologist_profile') or {}).get('specialization')
                 }
             } if doctor else None
                 }
@@ -522,6 +507,10 @@ async def doctor_get_consulations_route(
     page: int = Query(1, ge=1),
     limit: int = Query(10, le=100),
     ordering: Optional[str] = Query(None, description="Sort field. Use '-' prefix for descending order"),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    cursor: bool = Query(False),
+    include_count: bool = Query(True),
     current_user: str = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
@@ -529,17 +518,22 @@ async def doctor_get_consulations_route(
         user_id = current_user["user_id"]
         if int(user_id) != int(doctor_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
+        if (cursor or after or before) and ordering not in (None, "-created_at"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="Cursor pagination only supports the default ordering")
         
-        total = await count_consultations_by_doctor_crud(session, doctor_id)
-        offset = (page - 1) * limit
-        consultations = await consultation_for_doctor(session, doctor_id, skip=offset, limit=limit, ordering=ordering)
+        page_data = await paginate(
+            lambda **page_args: consultation_for_doctor(session, doctor_id, ordering=ordering, **page_args),
+            lambda: count_consultations_by_doctor_crud(session, doctor_id),
+            base_url=f"/doctor_get_consulations/{doctor_id}",
+            count_key=f"consultation:doctor:{doctor_id}",
+            page=page, limit=limit, after=after, before=before,
+            cursor=cursor, include_count=include_count,
+            params={"ordering": ordering},
+        )
+        consultations = page_data["results"]
 
-        # Parallel fetch user_data
-        user_details_tasks = [
-            get_user_details(consult.user_id)
-            for consult in consultations
-        ]
-        user_details = await gather(*user_details_tasks)
+        # One bulk lookup for every patient on the page
+        user_details = await get_users_details_bulk(consult.user_id for consult in consultations)
 
         # Combine consultation with corresponding user data
         enriched = [
@@ -550,22 +544,13 @@ async def doctor_get_consulations_route(
                 status=consult.status,
                 duration=consult.duration,
                 video=consult.video,
-                user=user_details[i]
+                video_manifest=consult.video_manifest,
+                user=user_details.get(consult.user_id)
             )
-            for i, consult in enumerate(consultations)
+            for consult in consultations
         ]
 
-        # Build URLs with ordering parameter
-        ordering_param = f"&ordering={ordering}" if ordering else ""
-        next_url = f"/doctor_get_consulations/{doctor_id}?page={page + 1}&limit={limit}{ordering_param}" if offset + limit < total else None
-        prev_url = f"/doctor_get_consulations/{doctor_id}?page={page - 1}&limit={limit}{ordering_param}" if page > 1 else None
-
-        return {
-            "count": total,
-            "next": next_url,
-            "previous": prev_url,
-            "results": enriched
-        }
+        return {**page_data, "results": enriched}
     except HTTPException as ex:
         logger.error(ex)
         raise
@@ -576,21 +561,14 @@ async def doctor_get_consulations_route(
     
 ZEGO_APP_ID = int(os.getenv("ZEGO_APP_ID"))
 ZEGO_SERVER_SECRET = os.getenv("ZEGO_SERVER_SECRET")
-# Configuration
-RECORDINGS_DIR = "recordings"
-os.makedirs(RECORDINGS_DIR, exist_ok=True)
-
-# In-memory storage for tracking recording parts
-recording_sessions = {}
-
-
 @router.post("/recordings")
 async def upload_recording(
     file: UploadFile = File(...),
     roomId: str = Form(...),
     userId: str = Form(...),
     isFinal: str = Form(...),
-    session: AsyncSession = Depends(get_session),
+    sequence: Optional[int] = Form(None, ge=0),
+    totalChunks: Optional[int] = Form(None, ge=1),
     current_user: str = Depends(get_current_user),
 ):
     try:
@@ -598,153 +576,85 @@ async def upload_recording(
         session_id = f"{roomId}_{userId}"
         recordings_dir = Path(RECORDINGS_DIR).absolute()  # Use absolute path
 
-        # Debug info
-        print(f"\nReceived {'FINAL' if is_final else 'chunk'} recording from {userId}")
-        print(f"File size: {file.size} bytes")
-        print(f"Content type: {file.content_type}")
-        print(f"Base recordings directory: {recordings_dir}")
-
         # Validation
         if not file.content_type.startswith('video/'):
             raise HTTPException(status_code=400, detail="Only video files are accepted")
 
-        contents = await file.read()
-        if len(contents) == 0:
-            raise HTTPException(status_code=400, detail="Empty file received")
-
         # Create session-specific directory
         session_dir = recordings_dir / session_id
         session_dir.mkdir(exist_ok=True, parents=True)
-        print(f"Session directory: {session_dir}")
 
-        # Save chunk with unique name in session directory only
-        chunk_filename = f"chunk_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.webm"
-        chunk_path = session_dir / chunk_filename
-        
-        with open(chunk_path, 'wb') as f:
-            f.write(contents)
-        print(f"Saved chunk to: {chunk_path}")
-
-        # Initialize/update session tracking
-        if session_id not in recording_sessions:
-            recording_sessions[session_id] = {
-                'chunks': [],
-                'created_at': datetime.now(),
-                'session_dir': str(session_dir)  # Track the directory
-            }
-        
-        recording_sessions[session_id]['chunks'].append(str(chunk_path))
-        recording_sessions[session_id]['last_updated'] = datetime.now()
+        # Stream the chunk to disk and register it; re-sending a stored sequence is a no-op
+        chunk = await recording_registry.store_chunk(session_id, session_dir, file, sequence)
 
-        # Process final chunk
+        # Hand the final concat to the background workers
         if is_final:
-            final_filename = f"recording_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.webm"
-            final_path = recordings_dir / final_filename
-            
-            print(f"\nCombining {len(recording_sessions[session_id]['chunks'])} chunks...")
-            print(f"Final path: {final_path}")
-
-            # Create concat list file in session directory
-            concat_file = session_dir / "concat.txt"
-            with open(concat_file, 'w') as f:
-                for chunk in recording_sessions[session_id]['chunks']:
-                    f.write(f"file '{chunk}'\n")
-
-            # Combine using ffmpeg
-            try:
-                subprocess.run([
-                    'ffmpeg',
-                    '-f', 'concat',
-                    '-safe', '0',
-                    '-i', str(concat_file),
-                    '-c', 'copy',
-                    '-y',
-                    str(final_path)
-                ], check=True)
-                print("Successfully combined chunks")
-            except subprocess.CalledProcessError as e:
-                print(f"FFmpeg error: {e}")
-                raise HTTPException(status_code=500, detail="Failed to combine video chunks")
-
-            # Clean up - remove all chunks and session directory
-            print("Cleaning up temporary files...")
-            for chunk in recording_sessions[session_id]['chunks']:
-                try:
-                    Path(chunk).unlink(missing_ok=True)
-                except Exception as e:
-                    print(f"Error deleting chunk {chunk}: {e}")
-
-            try:
-                concat_file.unlink(missing_ok=True)
-                session_dir.rmdir()  # Only works if directory is empty
-            except Exception as e:
-                print(f"Error cleaning up session dir: {e}")
-
-            # Verify final file exists
-            if not final_path.exists():
-                raise HTTPException(status_code=500, detail="Final recording not created")
-
-            # Remove session tracking
-            del recording_sessions[session_id]
-
-            # Save to database
-            final_url = f"/recordings/{final_filename}"
-            
-            consultation_id=int(roomId[4:])
-            await save_recording_database(session, final_url, consultation_id)
-
+            tracked = await recording_registry.finalize(session_id, totalChunks)
+            job_id = await recording_jobs.submit(
+                session_id, tracked['chunks'], tracked['session_dir'], int(roomId[4:])
+            )
             return JSONResponse({
-                "status": "success",
-                "message": "Recording completed",
-                "finalUrl": final_url,  
-                "fileSize": final_path.stat().st_size
-            })
+                "status": "processing",
+                "message": "Recording queued for processing",
+                "jobId": job_id,
+                "statusUrl": f"/recordings/jobs/{job_id}",
+                "totalChunks": len(tracked['chunks'])
+            }, status_code=status.HTTP_202_ACCEPTED)
 
         return JSONResponse({
             "status": "success",
-            "message": "Chunk uploaded",
-            "chunkSize": len(contents),
-            "totalChunks": len(recording_sessions[session_id]['chunks'])
+            "message": "Chunk already received" if chunk['duplicate'] else "Chunk uploaded",
+            "sequence": chunk['sequence'],
+            "chunkSize": chunk['size'],
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"\nError processing recording: {str(e)}", flush=True)
+        logger.error(f"Error processing recording: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/recordings/{filename}")
-async def get_recording(filename: str):
+@router.get("/recordings/sessions/{roomId}/{userId}")
+async def get_recording_session(roomId: str, userId: str, current_user: str = Depends(get_current_user)):
+    """Chunks received so far, so an interrupted client can resume from the gaps."""
     try:
-        file_path = os.path.join(RECORDINGS_DIR, filename)
-        
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="Recording not found")
-
-      
-        from fastapi.responses import FileResponse
-        return FileResponse(
-            file_path,
-            media_type="video/webm",
-            filename=filename
-        )
+        return await recording_registry.describe(f"{roomId}_{userId}")
+    except RedisError as e:
+        logger.error(f"Error reading recording session: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Recording registry unavailable")
+
+@router.get("/recordings/jobs/{job_id}")
+async def get_recording_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = await recording_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Recording job not found")
+    return job
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@router.get("/recordings/{filename}")
+async def get_recording(filename: str, request: Request):
+    file_path = Path(RECORDINGS_DIR) / Path(filename).name
+    return serve_file(
+        request,
+        file_path,
+        accel_location="/protected/recordings",
+        media_type="video/webm",
+        filename=file_path.name,
+        not_found="Recording not found",
+    )
 
-def cleanup_old_sessions(hours_old=24):
-    now = datetime.now()
-    for session_id, session_data in list(recording_sessions.items()):
-        if (now - session_data['last_updated']).total_seconds() > hours_old * 3600:
-            print(f"Cleaning up old session: {session_id}")
-            try:
-                session_dir = os.path.join(RECORDINGS_DIR, session_id)
-                for chunk in session_data['chunks']:
-                    if os.path.exists(chunk):
-                        os.remove(chunk)
-                if os.path.exists(session_dir):
-                    os.rmdir(session_dir)
-                del recording_sessions[session_id]
-            except Exception as e:
-                print(f"Error cleaning up session {session_id}: {e}")
+HLS_MEDIA_TYPES = {".m3u8": "application/vnd.apple.mpegurl", ".m4s": "video/iso.segment", ".mp4": "video/mp4"}
+
+@router.get("/recordings/hls/{rendition}/{filename}")
+async def get_recording_rendition(rendition: str, filename: str, request: Request):
+    rendition = Path(rendition).name
+    file_path = Path(RECORDINGS_DIR) / HLS_DIR / rendition / Path(filename).name
+    return serve_file(
+        request,
+        file_path,
+        accel_location=f"/protected/recordings/{HLS_DIR}/{quote(rendition)}",
+        media_type=HLS_MEDIA_TYPES.get(file_path.suffix),
+        not_found="Recording not found",
+    )
 
 def generate_zego_token(user_id: str, room_id: str) -> dict:
     """Generate a ZEGOCLOUD token"""
@@ -793,44 +703,45 @@ async def generate_token(data :TokenRequest,current_user: str = Depends(get_curr
 async def get_notifications_route(
     page: int = Query(1, ge=1),
     limit: int = Query(10, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    cursor: bool = Query(False),
+    include_count: bool = Query(True),
     current_user: str = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     try:
-        total = await count_notifications(session)
-        offset = (page - 1) * limit
-        notifications = await get_notifications_crud(session, skip=offset, limit=limit)
-        next_url = f"/get_notifications?page={page + 1}&limit={limit}" if offset + limit < total else None
-        prev_url = f"/get_notifications?page={page - 1}&limit={limit}" if page > 1 else None
-
-        return {
-            "count": total,
-            "next": next_url,
-            "previous": prev_url,
-            "results": notifications
-        }
+        return await paginate(
+            lambda **page_args: get_notifications_crud(session, **page_args),
+            lambda: count_notifications(session),
+            base_url="/get_notifications",
+            count_key="notification:all",
+            page=page, limit=limit, after=after, before=before,
+            cursor=cursor, include_count=include_count,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.get("/get_compliants", response_model=CompliantPaginatedResponse)
-async def get_notifications_route( page: int = Query(1, ge=1),limit: int = Query(10, le=100),current_user: str = Depends(get_current_user),session: AsyncSession = Depends(get_session),
+async def get_notifications_route( page: int = Query(1, ge=1),limit: int = Query(10, le=100),
+    after: Optional[str] = Query(None),before: Optional[str] = Query(None),cursor: bool = Query(False),include_count: bool = Query(True),
+    current_user: str = Depends(get_current_user),session: AsyncSession = Depends(get_session),
 ):
     try:
         role = current_user["role"]
         if role != 'admin':
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
         
-        total = await count_compliants(session)
-        offset = (page - 1) * limit
-        compliants = await get_compliants_crud(session, skip=offset, limit=limit)
-        next_url = f"/get_compliants?page={page + 1}&limit={limit}" if offset + limit < total else None
-        prev_url = f"/get_compliants?page={page - 1}&limit={limit}" if page > 1 else None
-        return {
-            "count": total,
-            "next": next_url,
-            "previous": prev_url,
-            "results": compliants
-        }
+        return await paginate(
+            lambda **page_args: get_compliants_crud(session, **page_args),
+            lambda: count_compliants(session),
+            base_url="/get_compliants",
+            count_key="complaint:all",
+            page=page, limit=limit, after=after, before=before,
+            cursor=cursor, include_count=include_count,
+        )
     except Exception:
         raise
     except Exception as e:
@@ -885,13 +796,14 @@ async def get_feedbacks_route(psychologist_id: int, session: AsyncSession = Depe
         feedbacks = await get_feedbacks_crud(session, psychologist_id)
         
         # Get user details for all feedbacks
-        user_details = await gather(*(get_minimal_user_details(feedback.user_id) for feedback in feedbacks))
+        user_details = await get_users_details_bulk(feedback.user_id for feedback in feedbacks)
         
         enriched_feedbacks = []
-        for feedback, user_detail in zip(feedbacks, user_details):
+        for feedback in feedbacks:
+            user_detail = user_details.get(feedback.user_id)
             # Ensure user_profile is properly structured
             user_profile = None
-            if 'user_profile' in user_detail and user_detail['user_profile']:
+            if user_detail and user_detail.get('user_profile'):
                 user_profile = UserProfileImage(**user_detail['user_profile'])
             
             enriched_feedback = CreateFeedbackSchema(
@@ -904,7 +816,7 @@ async def get_feedbacks_route(psychologist_id: int, session: AsyncSession = Depe
                 user=UserNameWithProfileImage(
                     name=user_detail['name'],
                     user_profile=user_profile
-                )
+                ) if user_detail else None
             )
             enriched_feedbacks.append(enriched_feedback)
 
@@ -923,14 +835,25 @@ async def get_psychologist_rating_route(psychologist_id: int, session: AsyncSess
         return  avg_rating if avg_rating is not None else 0.0
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post('/get_psychologist_ratings')
+async def get_psychologist_ratings_route(data: PsychologistIdsSchema, session: AsyncSession = Depends(get_session)):
+    try:
+        ids = list(set(data.ids))
+        ratings = {psychologist_id: 0.0 for psychologist_id in ids}
+        if not ids:
+            return ratings
+        for summary in await get_psychologist_ratings_bulk_crud(session, ids):
+            if summary.rating_count:
+                ratings[summary.psychologist_id] = summary.rating_sum / summary.rating_count
+        return ratings
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
     
 
 # ***************************************VideocallSignaling***********************************************
 
 active_consultations: Dict[str, Dict] = {}
-# Store active connections
-active_connections: Dict[str, WebSocket] = {}
-connection_lock = asyncio.Lock()
 
 VALIDATION_RULES = {
     "call-initiate": ["offer", "senderId", "targetId","consultation_id"],
@@ -945,10 +868,11 @@ VALIDATION_RULES = {
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await websocket.accept()
     
-    # Add connection
-    async with connection_lock:
-        active_connections[user_id] = websocket
-        logger.info(f"[CONNECT] User {user_id} connected. Active connections: {list(active_connections.keys())}")
+    # Add connection, the target may live on any worker so everything goes through the broker
+    channel = signaling_channel(user_id)
+    connection = Connection(websocket, f"signaling:{user_id}").start()
+    await broker.join(channel, user_id, connection)
+    logger.info(f"[CONNECT] User {user_id} connected on worker {broker.worker_id}")
 
     try:
         while True:
@@ -959,6 +883,8 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 logger.info(f"[DISCONNECT] User {user_id} disconnected")
                 break
             except Exception as e:
+                if connection.closed:
+                    break
                 logger.info(f"[ERROR] JSON error from {user_id}: {str(e)}")
                 continue
 
@@ -970,9 +896,10 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             
              # Handle call-end message
             if msg_type == 'call-end':
+                target_id = str(data.get("targetId", ""))
                 try:
                     # Forward the call-end message to the other party
-                    await target_connection.send_json({
+                    delivered = await broker.publish(signaling_channel(target_id), {
                         "type": "call-end",
                         "senderId": data["senderId"],
                         "sender": data["sender"],
@@ -980,7 +907,10 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                         'duration': data["duration"],
                         'timestamp': data["timestamp"]
                     })
-                    logger.info(f"[CALL-END] Sent call-end to {target_id} from {data['senderId']}")
+                    if delivered:
+                        logger.info(f"[CALL-END] Sent call-end to {target_id} from {data['senderId']}")
+                    else:
+                        logger.warning(f"[ERROR] Failed to forward call-end to {target_id}: not connected")
                 except Exception as e:
                     logger.warning(f"[ERROR] Failed to forward call-end to {target_id}: {e}")
                 
@@ -1004,46 +934,32 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 logger.info(f"[ERROR] Missing targetId in message from {user_id}")
                 continue
 
-            # Get target connection - IMPORTANT: Do this WITHIN the lock
-            async with connection_lock:
-                target_connection = active_connections.get(target_id)
-                
-                if not target_connection:
+            # Try to forward message, publish reports how many workers hold the target
+            try:
+                logger.info(f"[FORWARDING] {msg_type} from {user_id} to {target_id}")
+                delivered = await broker.publish(signaling_channel(target_id), data)
+                if not delivered:
                     logger.info(f"[ERROR] Target {target_id} not found in active connections")
                     continue
-                    
-                # Verify connection is still open
-                if target_connection.client_state == "disconnected":
-                    logger.info(f"[ERROR] Target {target_id} is disconnected")
-                    continue
-
-                # Try to forward message
-                try:
-                    logger.info(f"[FORWARDING] {msg_type} from {user_id} to {target_id}")
-                    await target_connection.send_json(data)
-                    logger.info(f"[SUCCESS] Forwarded {msg_type} to {target_id}")
-                    
-                    # Send acknowledgment
-                    await websocket.send_json({
-                        "type": "message-ack",
-                        "originalType": msg_type,
-                        "status": "delivered",
-                        "to": target_id
-                    })
-                except Exception as e:
-                    logger.info(f"[FAILED] Could not forward to {target_id}: {str(e)}")
-                    # Clean up dead connection
-                    if "disconnected" in str(e).lower():
-                        active_connections.pop(target_id, None)
-                        
+                logger.info(f"[SUCCESS] Forwarded {msg_type} to {target_id}")
+                
+                # Send acknowledgment
+                connection.send({
+                    "type": "message-ack",
+                    "originalType": msg_type,
+                    "status": "delivered",
+                    "to": target_id
+                })
+            except Exception as e:
+                logger.info(f"[FAILED] Could not forward to {target_id}: {str(e)}")
             
 
     except Exception as e:
         logger.info(f"[CRASH] User {user_id} error: {str(e)}")
     finally:
-        async with connection_lock:
-            active_connections.pop(user_id, None)
-            logger.info(f"[DISCONNECTED] User {user_id} removed. Remaining: {list(active_connections.keys())}")
+        await broker.leave(channel, user_id, connection)
+        await connection.close()
+        logger.info(f"[DISCONNECTED] User {user_id} removed")
             
     
 
@@ -1067,9 +983,6 @@ ALLOWED_EXTENSIONS = {
 # Initialize rate limiter
 limiter = Limiter(key_func=get_remote_address)
 
-# Global variables for tracking active rooms and locks
-active_chat_rooms: Dict[int, List[Dict]] = {}
-room_lock = asyncio.Lock()
 
 
 # Utility functions
@@ -1092,25 +1005,52 @@ def get_file_category(file_type: str) -> str:
     else:
         return 'other'
 
-async def scan_for_viruses(file_path: Path) -> bool:
-    """Mock virus scanning function - integrate with real scanner in production"""
+async def validate_file_type(file: UploadFile, filename: str) -> bool:
+    """Check the leading magic number agrees with the file's extension"""
     try:
-        # In production: integrate with ClamAV or similar
-        return True
+        head = await file.read(SNIFF_BYTES)
+        await file.seek(0)  # Rewind for the actual upload
     except Exception:
         return False
+    extension = filename.split('.')[-1] if '.' in filename else ''
+    return content_matches(head, extension)
+
+async def quarantine_flagged_attachment(attachment_id: int, reason: str):
+    async with async_session() as session:
+        consultation_id = await quarantine_attachment(session, attachment_id)
+    if consultation_id is not None:
+        await broker.publish(chat_room_channel(consultation_id), {
+            "type": "attachment-quarantined",
+            "attachment_id": attachment_id,
+            "reason": "File failed security scan",
+        })
 
-async def validate_file_type(file: UploadFile) -> bool:
-    """Validate file type matches its content"""
-    try:
-        # Read first 261 bytes for magic number detection
-        content = await file.read(261)
-        await file.seek(0)  # Rewind for actual saving
-        
-        # In production: use a proper file type detection library
-        return True
-    except Exception:
-        return False
+def schedule_attachment_scan(attachment_id: int, file_url: str, filename: str, sniff: bool = False):
+    """Scan the stored copy in the background; flagged files are quarantined, the upload never waits."""
+    extension = filename.split('.')[-1] if '.' in filename else ''
+    scan_queue.submit(
+        attachment_id,
+        lambda: storage.stream(file_url),
+        quarantine_flagged_attachment,
+        extension=extension if sniff else None,
+    )
+
+def validate_attachment_meta(filename: str, content_type: str, size: int) -> str:
+    """Check the declared name, type and size of an attachment, returning the sanitized name."""
+    if size > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    original_filename = sanitize_filename(filename)
+    if not original_filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+
+    file_extension = original_filename.split('.')[-1].lower() if '.' in original_filename else ''
+    file_category = get_file_category(content_type)
+    if file_category != 'other':
+        allowed_exts = ALLOWED_EXTENSIONS.get(file_category, [])
+        if file_extension not in allowed_exts:
+            raise HTTPException(status_code=400, detail="File type not allowed")
+    return original_filename
 
 async def cleanup_failed_upload(file_path: Path):
     """Clean up failed uploads"""
@@ -1129,36 +1069,26 @@ async def upload_chat_file(
     consultation_id: int = Form(...),
     sender_id: int = Form(...),
     sender_type: str = Form(...),
+    current_user: str = Depends(get_current_user),
     session: AsyncSession = Depends(get_session)
 ):
     
     """Upload file for chat message"""
     file_path = None
     try:
-        # Validate file size
-        if file.size > MAX_FILE_SIZE:
-            raise HTTPException(status_code=413, detail="File too large")
-        
+        mapping = await verify_user_consultation(session, consultation_id, int(current_user["user_id"]))
+        if not mapping:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not authorized")
+
         # Validate sender type
         if sender_type not in VALID_SENDER_TYPES:
             raise HTTPException(status_code=400, detail="Invalid sender type")
         
-        # Sanitize filename
-        original_filename = sanitize_filename(file.filename)
-        if not original_filename:
-            raise HTTPException(status_code=400, detail="Invalid filename")
-        
-        # Validate file type
-        file_extension = original_filename.split('.')[-1].lower() if '.' in original_filename else ''
-        file_category = get_file_category(file.content_type)
-        
-        if file_category != 'other':
-            allowed_exts = ALLOWED_EXTENSIONS.get(file_category, [])
-            if file_extension not in allowed_exts:
-                raise HTTPException(status_code=400, detail="File type not allowed")
+        # Validate size, filename and type
+        original_filename = validate_attachment_meta(file.filename, file.content_type, file.size)
         
         # Validate file content matches type
-        if not await validate_file_type(file):
+        if not await validate_file_type(file, original_filename):
             raise HTTPException(status_code=415, detail="File content doesn't match type")
         
         # Generate unique filename
@@ -1167,18 +1097,27 @@ async def upload_chat_file(
         
         
         try:
-            file_url = await run_in_threadpool(upload_to_cloudinary, file, "chat_media")
+            file_url = await storage.upload(file, "chat_media")
             
         except Exception as e :
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY ,detail=f"Cloudinary upload failed: {str(e)}")
-       
-        
-        # Virus scan
-        if not await scan_for_viruses(file_path):
-            raise HTTPException(status_code=422, detail="File failed security scan")
-        
-       
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY ,detail=f"Media upload failed: {str(e)}")
+
+        attachment = await create_unlinked_attachment(
+            session,
+            consultation_id,
+            unique_filename,
+            original_filename,
+            file.content_type,
+            file.size,
+            file_url=file_url,
+            file_path=str(file_path),
+            upload_status='success',
+        )
+        # Virus scan runs after the response, a flagged file is quarantined
+        schedule_attachment_scan(attachment.id, file_url, original_filename)
+
         return {
+            "attachment_id": attachment.id,
             "file_id": str(uuid.uuid4()),
             "filename": unique_filename,
             "original_filename": original_filename,
@@ -1198,25 +1137,110 @@ async def upload_chat_file(
         raise HTTPException(status_code=500, detail="File upload failed")
 
 @router.get("/files/{filename}")
-async def get_chat_file(filename: str):
+async def get_chat_file(filename: str, request: Request):
     """Serve uploaded chat files"""
     try:
         sanitized = sanitize_filename(filename)
         file_path = UPLOAD_DIR / sanitized
-        
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        return FileResponse(file_path)
+        return serve_file(request, file_path, accel_location="/protected/chat_files")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"File serve error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to serve file")
 
+@router.post("/chat_uploads/sign")
+@limiter.limit("30/minute")
+async def sign_chat_upload(
+    request: Request,
+    data: ChatUploadSignSchema,
+    current_user: str = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """Signed parameters for uploading an attachment straight to storage.
+
+    The browser posts the file to ``upload_url`` with ``fields``, then calls
+    ``/chat_uploads/{attachment_id}/complete``. Only metadata passes through
+    this service.
+    """
+    mapping = await verify_user_consultation(session, data.consultation_id, int(current_user["user_id"]))
+    if not mapping:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not authorized")
+    original_filename = validate_attachment_meta(data.filename, data.content_type, data.size)
+
+    storage_key = f"chat_media/{uuid.uuid4().hex}"
+    try:
+        signed = storage.sign_upload(storage_key, data.content_type)
+    except NotImplementedError:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Direct uploads are not available, use /upload_chat_file")
+
+    attachment = await create_unlinked_attachment(
+        session,
+        data.consultation_id,
+        f"{uuid.uuid4()}_{original_filename}",
+        original_filename,
+        data.content_type,
+        data.size,
+        storage_key,
+    )
+    return {"attachment_id": attachment.id, **signed}
+
+@router.post("/chat_uploads/{attachment_id}/complete")
+async def complete_chat_upload(
+    attachment_id: int,
+    current_user: str = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """Confirm a direct upload landed and record it; the result goes into the chat message's attachments."""
+    attachment = await get_direct_attachment(session, attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    mapping = await verify_user_consultation(session, attachment.consultation_map_id, int(current_user["user_id"]))
+    if not mapping:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not authorized")
+
+    if attachment.upload_status == 'pending':
+        try:
+            stored = await storage.stat(attachment.storage_key, attachment.file_type)
+        except Exception as e:
+            logger.error(f"Failed to verify upload {attachment_id}: {e}")
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Could not verify upload")
+        if stored is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="File has not been uploaded yet")
+        if stored["size"] > MAX_FILE_SIZE:
+            await complete_direct_attachment(session, attachment, None, stored["size"], 'failed')
+            raise HTTPException(status_code=413, detail="File too large")
+        attachment = await complete_direct_attachment(session, attachment, stored["url"], stored["size"], 'success')
+        # Nothing has looked at these bytes yet, so sniff the first block as well as scanning
+        schedule_attachment_scan(attachment.id, attachment.file_url, attachment.original_filename, sniff=True)
+
+    if attachment.upload_status != 'success':
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Upload was rejected")
+    return {
+        "attachment_id": attachment.id,
+        "filename": attachment.filename,
+        "original_filename": attachment.original_filename,
+        "file_path": attachment.file_path,
+        "file_url": attachment.file_url,
+        "file_type": attachment.file_type,
+        "file_size": attachment.file_size,
+        "upload_status": attachment.upload_status,
+    }
+
+async def acknowledge_persisted(connection: Connection, persisted: asyncio.Future, chat_id: int):
+    """Tell the sender when a write-behind message is durably stored (or was lost)."""
+    try:
+        await persisted
+        connection.send({"type": "message-persisted", "id": chat_id})
+    except Exception as e:
+        logger.error(f"Write-behind save failed for message {chat_id}: {e}")
+        connection.send({"type": "message-failed", "id": chat_id, "message": "Failed to save message to database"})
+
+
 @router.websocket("/ws/chat/{consultation_id}")
 async def chat_websocket(
     websocket: WebSocket,
     consultation_id: int,
-    session: AsyncSession = Depends(get_session),
     ):
     # Constants
     VALID_SENDER_TYPES = ["doctor", "user"]
@@ -1231,7 +1255,9 @@ async def chat_websocket(
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
         
-        verify_user = await verify_user_consultation(session, consultation_id, current_user)
+        # Sessions are checked out per operation, an idle socket holds no connection
+        async with async_session() as session:
+            verify_user = await verify_user_consultation(session, consultation_id, current_user)
         if not verify_user:
                 await websocket.send_json({"error": "Invalid consultation ID"})
                 await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -1285,58 +1311,35 @@ async def chat_websocket(
         await websocket.close(code=4002)
         return
 
-    # Register client
-    client = {
-        "websocket": websocket,
+    # Register client, room membership and presence live in Redis so any worker can serve the room
+    room = chat_room_channel(consultation_id)
+    connection = Connection(websocket, f"chat:{consultation_id}:{user_id}").start()
+    await broker.join(room, user_id, connection)
+    await broker.set_presence(room, user_id, user_type)
+    logger.info(
+        f"New connection: {user_type} {user_id} in room {consultation_id}"
+    )
+
+    # Notify other participants
+    online_notification = {
+        "type": "status",
+        "status": "online",
         "user_id": user_id,
         "user_type": user_type,
+        "timestamp": datetime.utcnow().isoformat()
     }
-
-    async with room_lock:
-        # Initialize room if needed
-        active_chat_rooms.setdefault(consultation_id, [])
-        
-        # Remove any existing connection for this user
-        active_chat_rooms[consultation_id] = [
-            c for c in active_chat_rooms[consultation_id] 
-            if c["user_id"] != user_id
-        ]
-        
-        # Add new connection
-        active_chat_rooms[consultation_id].append(client)
-        logger.info(
-            f"New connection: {user_type} {user_id} in room {consultation_id}"
-        )
-
-        # Notify other participants
-        online_notification = {
-            "type": "status",
-            "status": "online",
-            "user_id": user_id,
-            "user_type": user_type,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        for participant in active_chat_rooms[consultation_id]:
-            if participant["user_id"] != user_id:
-                try:
-                    await participant["websocket"].send_json(online_notification)
-                except Exception as e:
-                    logger.warning(f"Failed to notify participant: {str(e)}")
-
-        # Send current online status to new user
-        for participant in active_chat_rooms[consultation_id]:
-            if participant["user_id"] != user_id:
-                try:
-                    await websocket.send_json({
-                        "type": "status",
-                        "status": "online",
-                        "user_id": participant["user_id"],
-                        "user_type": participant["user_type"],
-                        "timestamp": datetime.utcnow().isoformat()
-                    })
-                except Exception as e:
-                    logger.warning(f"Failed to send participant status: {str(e)}")
+    await broker.publish(room, online_notification, exclude=user_id)
+
+    # Send current online status to new user
+    for participant_id, participant_type in (await broker.presence(room)).items():
+        if participant_id != str(user_id):
+            connection.send({
+                "type": "status",
+                "status": "online",
+                "user_id": int(participant_id),
+                "user_type": participant_type,
+                "timestamp": datetime.utcnow().isoformat()
+            })
 
     # Main message loop
     try:
@@ -1349,7 +1352,7 @@ async def chat_websocket(
                 
                 # Handle ping/pong
                 if data.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
+                    connection.send({"type": "pong"})
                     continue
 
                 logger.debug(f"Received message: {data}")
@@ -1384,26 +1387,37 @@ async def chat_websocket(
 
                 except ValueError as e:
                     logger.warning(f"Invalid message format: {str(e)}")
-                    await websocket.send_json({
+                    connection.send({
                         "type": "error",
                         "message": str(e),
                         "received_data": data
                     })
                     continue
 
-                # Save to database
+                # Save to database, or queue it when write-behind is on and broadcast straight away
                 try:
-                    message_id = await save_chat_message_with_attachments(
-                        session, 
-                        message if message else None, 
-                        consultation_id, 
-                        sender_type,
-                        attachments,
-                        message_type
-                    )
+                    if chat_writer.enabled:
+                        message_id, persisted = await chat_writer.submit(
+                            message if message else None,
+                            consultation_id,
+                            sender_type,
+                            attachments,
+                            message_type
+                        )
+                        asyncio.create_task(acknowledge_persisted(connection, persisted, message_id["chat_id"]))
+                    else:
+                        async with async_session() as session:
+                            message_id = await save_chat_message_with_attachments(
+                                session, 
+                                message if message else None, 
+                                consultation_id, 
+                                sender_type,
+                                attachments,
+                                message_type
+                            )
                 except Exception as e:
                     logger.error(f"Failed to save message: {str(e)}")
-                    await websocket.send_json({
+                    connection.send({
                         "type": "error",
                         "message": "Failed to save message to database"
                     })
@@ -1422,113 +1436,67 @@ async def chat_websocket(
                     "created_at": utc_to_ist(datetime.utcnow()).isoformat() 
                 }
                 
-                async with room_lock:
-                    for participant in active_chat_rooms.get(consultation_id, []):
-                        try:
-                            await participant["websocket"].send_json(broadcast_data)
-                        except Exception as e:
-                            logger.warning(f"Failed to broadcast to {participant['user_id']}: {str(e)}")
+                await broker.publish(room, broadcast_data)
 
             except asyncio.TimeoutError:
                 # Send keepalive ping
-                try:
-                    await websocket.send_json({"type": "ping"})
-                except:
-                    break  # Connection lost
+                if not connection.send({"type": "ping"}):
+                    break  # Connection lost or dropped as too slow
 
     except WebSocketDisconnect:
         logger.info(f"User {user_id} disconnected from room {consultation_id}")
     except Exception as e:
         logger.error(f"Unexpected error in message loop: {str(e)}")
     finally:
-        # Clean up connection
-        async with room_lock:
-            if consultation_id in active_chat_rooms:
-                active_chat_rooms[consultation_id] = [
-                    c for c in active_chat_rooms[consultation_id] 
-                    if c["user_id"] != user_id
-                ]
-
-                # Notify others of disconnection
-                offline_notification = {
-                    "type": "status",
-                    "status": "offline",
-                    "user_id": user_id,
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                
-                for participant in active_chat_rooms[consultation_id]:
-                    try:
-                        await participant["websocket"].send_json(offline_notification)
-                    except Exception as e:
-                        logger.warning(f"Failed to notify of disconnect: {str(e)}")
+        # Clean up connection, unless a newer socket for this user already took its place
+        if await broker.leave(room, user_id, connection):
+            await broker.clear_presence(room, user_id)
+
+            # Notify others of disconnection
+            offline_notification = {
+                "type": "status",
+                "status": "offline",
+                "user_id": user_id,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            await broker.publish(room, offline_notification)
 
-        try:
-            await websocket.close()
-        except:
-            pass
+        await connection.close()
 
 # # ***************************************Notifications***********************************************
 
-# Global connection tracking
-# notifications/websocket.py
-
-# Global connection tracking
-active_notification_connections: Dict[int, WebSocket] = {}
-connection_lock = asyncio.Lock()
-
 class ConnectionManager:
-    def __init__(self):
-        self.active_notification_connections: Dict[int, WebSocket] = {}
+    """Per-user notification sockets, delivered through the room broker."""
 
-    async def connect(self, websocket: WebSocket, user_id: int):
+    async def connect(self, websocket: WebSocket, user_id: int) -> Connection:
         await websocket.accept()
-        async with connection_lock:
-            # Close any existing connection for this user
-            if user_id in active_notification_connections:
-                try:
-                    old_ws = active_notification_connections[user_id]
-                    if old_ws.client_state.name != "DISCONNECTED":
-                        await old_ws.close(code=1000, reason="New connection")
-                except Exception as e:
-                    logger.warning(f"Error closing old connection for user {user_id}: {e}")
-            
-            # Store the new connection
-            active_notification_connections[user_id] = websocket
-            self.active_notification_connections[user_id] = websocket
+        connection = Connection(websocket, f"notifications:{user_id}").start()
+        old_connection = await broker.join(notification_channel(user_id), user_id, connection)
+        # Close any existing connection for this user on this worker
+        if old_connection is not None:
+            await old_connection.close(code=1000, reason="New connection")
         
         logger.info(f"User {user_id} connected")
+        return connection
 
-    async def disconnect(self, user_id: int):
-        async with connection_lock:
-            # Remove from both global and instance dictionaries
-            if user_id in active_notification_connections:
-                del active_notification_connections[user_id]
-            if user_id in self.active_notification_connections:
-                del self.active_notification_connections[user_id]
-        
-        logger.info(f"User {user_id} disconnected")
+    async def disconnect(self, user_id: int, connection: Connection):
+        if await broker.leave(notification_channel(user_id), user_id, connection):
+            logger.info(f"User {user_id} disconnected")
+        await connection.close()
 
     async def send_personal_message(self, message: dict, user_id: int):
-        async with connection_lock:
-            websocket = active_notification_connections.get(user_id)
-            if websocket:
-                try:
-                    # Check if connection is still open
-                    if websocket.client_state.name == "CONNECTED":
-                        await websocket.send_json(message)
-                    else:
-                        # Connection is closed, clean it up
-                        await self.disconnect(user_id)
-                except Exception as e:
-                    logger.error(f"Error sending to {user_id}: {e}")
-                    await self.disconnect(user_id)
+        try:
+            delivered = await broker.publish(notification_channel(user_id), message)
+            if not delivered:
+                logger.info(f"User {user_id} has no open notification connection")
+        except Exception as e:
+            logger.error(f"Error sending to {user_id}: {e}")
 
 manager = ConnectionManager()
 
 @router.websocket("/ws/notifications/{user_id}")
 async def notification_websocket(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket, user_id)
+    connection = await manager.connect(websocket, user_id)
     
     last_active = datetime.utcnow()
     
@@ -1544,7 +1512,7 @@ async def notification_websocket(websocket: WebSocket, user_id: int):
                 
                 # Handle ping/pong
                 if data.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
+                    connection.send({"type": "pong"})
                     continue
                     
                 # Process other message types
@@ -1555,19 +1523,17 @@ async def notification_websocket(websocket: WebSocket, user_id: int):
                 # Check if connection is idle for too long (90 seconds)
                 if (datetime.utcnow() - last_active).total_seconds() > 90:
                     logger.info(f"Closing idle connection for user {user_id}")
-                    await websocket.close(code=1000, reason="Idle timeout")
+                    await connection.close(code=1000, reason="Idle timeout")
                     break
                     
                 # Send ping to check connection
-                try:
-                    await websocket.send_json({"type": "ping"})
-                except Exception as e:
-                    logger.error(f"Failed to send ping to user {user_id}: {e}")
+                if not connection.send({"type": "ping"}):
+                    logger.error(f"Failed to send ping to user {user_id}: connection closed")
                     break
                     
             except json.JSONDecodeError:
                 logger.warning(f"Invalid JSON from user {user_id}")
-                await websocket.send_json({
+                connection.send({
                     "type": "error", 
                     "message": "Invalid JSON format"
                 })
@@ -1577,13 +1543,10 @@ async def notification_websocket(websocket: WebSocket, user_id: int):
         logger.info(f"User {user_id} disconnected normally")
     except Exception as e:
         logger.error(f"Unexpected error for user {user_id}: {str(e)}")
-        try:
-            await websocket.close(code=1011, reason="Internal server error")
-        except:
-            pass
+        await connection.close(code=1011, reason="Internal server error")
     finally:
         # Ensure cleanup happens only once
-        await manager.disconnect(user_id)
+        await manager.disconnect(user_id, connection)
 
 async def handle_notification(data: dict, sender_id: int):
     logger.info(f"[Notficaiation] Received notification data: {data}")
@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+from core.http_client import http_pool_stats
+from core.db_engine import db_pool_stats
+from dependencies.database import engine
+from core.profile_cache import profile_lru
+from core.token_cache import token_cache
+from signaling.rooms import broker
+from crud.chat_writer import chat_writer
+from infra.recordings import recording_jobs
+from utils.file_scan import scan_queue
+from crud.outbox import outbox_relay
+from infra.booking import booking_consumer, reservation_sweeper
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "http_pools": http_pool_stats(),
+        "db_pool": db_pool_stats(engine),
+        "profile_cache": profile_lru.stats(),
+        "auth_tokens": token_cache.stats(),
+        "websocket_delivery": broker.delivery_stats(),
+        "chat_writer": chat_writer.stats(),
+        "recording_jobs": recording_jobs.stats(),
+        "upload_scans": scan_queue.stats(),
+        "outbox": outbox_relay.stats(),
+        "events": booking_consumer.stats(),
+        "stale_bookings": reservation_sweeper.stats(),
+    }
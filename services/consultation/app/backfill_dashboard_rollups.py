@@ -0,0 +1,13 @@
+import asyncio
+from dependencies.database import async_session, engine
+from crud.crud import rebuild_dashboard_rollups
+
+async def backfill():
+    # Rebuilds the monthly dashboard rollups from the consultation history
+    async with async_session() as session:
+        await rebuild_dashboard_rollups(session)
+    await engine.dispose()
+    print("Dashboard rollups rebuilt.")
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
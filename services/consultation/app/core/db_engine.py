@@ -0,0 +1,100 @@
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Dict
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger("uvicorn.error")
+
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# asyncpg's per-connection prepared statement cache; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 30000))
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+DB_SLOW_QUERY_SAMPLE = float(os.getenv("DB_SLOW_QUERY_SAMPLE", 1.0))
+
+_slow_queries: Dict[int, int] = {}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The default async queue pool, recording how long each checkout waited."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_times = deque(maxlen=1000)
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_times.append(time.perf_counter() - started)
+
+
+def _log_slow_queries(engine: AsyncEngine):
+    key = id(engine.sync_engine)
+    _slow_queries[key] = 0
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._query_started) * 1000
+        if elapsed_ms < DB_SLOW_QUERY_MS:
+            return
+        _slow_queries[key] += 1
+        if random.random() < DB_SLOW_QUERY_SAMPLE:
+            # Parameters are left out on purpose, they carry user data
+            logger.warning(f"[db] slow query {elapsed_ms:.0f} ms: {' '.join(statement.split())[:500]}")
+
+
+def make_engine(database_url: str) -> AsyncEngine:
+    """Async engine with pool, statement cache and timeouts taken from DB_* settings."""
+    engine = create_async_engine(
+        database_url,
+        echo=DB_ECHO,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+        },
+    )
+    _log_slow_queries(engine)
+    return engine
+
+
+def db_pool_stats(engine: AsyncEngine) -> Dict:
+    pool = engine.sync_engine.pool
+    waits = sorted(getattr(pool, "wait_times", ()))
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "timeouts": getattr(pool, "timeouts", 0),
+        "slow_queries": _slow_queries.get(id(engine.sync_engine), 0),
+        "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+        "wait_ms_p99": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else 0.0,
+    }
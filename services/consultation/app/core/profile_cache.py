@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+from core.redis import redis_client
+
+logger = logging.getLogger("uvicorn.error")
+
+PROFILE_LRU_SIZE = int(os.getenv("PROFILE_LRU_SIZE", 5000))
+PROFILE_LRU_TTL = float(os.getenv("PROFILE_LRU_TTL", 60))
+PROFILE_INVALIDATION_CHANNEL = "profile:invalidate"
+
+
+class ProfileLRU:
+    """Small in-process TTL LRU in front of user-service profile lookups.
+
+    Entries are dropped on TTL expiry or when user-service publishes an
+    invalidation for the user id, whichever comes first.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[float, dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, user_id: int) -> Optional[dict]:
+        key = (kind, user_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def get_many(self, kind: str, user_ids: Iterable[int]) -> Dict[int, dict]:
+        found = {}
+        for user_id in user_ids:
+            value = self.get(kind, user_id)
+            if value is not None:
+                found[user_id] = value
+        return found
+
+    def set(self, kind: str, user_id: int, value: dict):
+        key = (kind, user_id)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        for key in [key for key in self._entries if key[1] == user_id]:
+            del self._entries[key]
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+profile_lru = ProfileLRU(PROFILE_LRU_SIZE, PROFILE_LRU_TTL)
+
+_listener: Optional[asyncio.Task] = None
+
+
+async def _listen_for_invalidations():
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(PROFILE_INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    profile_lru.invalidate(int(message["data"]))
+                except (TypeError, ValueError):
+                    continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Anything cached while we were disconnected may have missed an invalidation
+            logger.warning(f"[profile-cache] invalidation listener dropped: {e}")
+            profile_lru._entries.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+async def start_profile_listener():
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.create_task(_listen_for_invalidations())
+
+
+async def stop_profile_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
@@ -0,0 +1,161 @@
+from datetime import timedelta
+from typing import Optional
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from crud.crud import add_booked_consultation, announce_completion, delete_partial_consultation, lock_consultation
+from crud.outbox import add_outbox_event
+from models.consultation import BookingSaga, Payments
+from schemas.consultation import CreateConsultationSchema
+
+PAYMENT_REQUESTED = "booking.payment_requested"
+PAYMENT_SUCCEEDED = "booking.payment_succeeded"
+PAYMENT_FAILED = "booking.payment_failed"
+DOCTOR_RELEASE = "booking.doctor_release"
+
+
+async def claim_booking(session: AsyncSession, data: CreateConsultationSchema, idempotency_key: str):
+    """Start a saga for the key, or return the one a previous attempt with the same key started.
+
+    Returns (saga, created).
+    """
+    saga_id = await session.scalar(
+        pg_insert(BookingSaga)
+        .values(
+            idempotency_key=idempotency_key,
+            user_id=data.user_id,
+            psychologist_id=data.psychologist_id,
+            status="reserving",
+        )
+        .on_conflict_do_nothing(constraint="uq_booking_saga_user_id_idempotency_key")
+        .returning(BookingSaga.id)
+    )
+    await session.commit()
+    if saga_id is not None:
+        return await session.get(BookingSaga, saga_id), True
+    saga = await session.scalar(
+        select(BookingSaga).where(
+            BookingSaga.user_id == data.user_id,
+            BookingSaga.idempotency_key == idempotency_key,
+        )
+    )
+    return saga, False
+
+
+async def get_booking(session: AsyncSession, booking_id: int) -> Optional[BookingSaga]:
+    return await session.get(BookingSaga, booking_id)
+
+
+async def reject_booking(session: AsyncSession, saga_id: int, reason: str):
+    await session.execute(
+        update(BookingSaga)
+        .where(BookingSaga.id == saga_id, BookingSaga.status == "reserving")
+        .values(status="rejected", failure_reason=reason)
+    )
+    await session.commit()
+
+
+async def place_booking(session: AsyncSession, saga_id: int, data: CreateConsultationSchema, fee: int) -> int:
+    """Record the reserved booking and ask payment-service for the debit, in one transaction.
+
+    A free consultation has nothing to collect and is confirmed right away.
+    Fails if the saga stopped being "reserving" meanwhile, e.g. because the
+    sweeper released it.
+    """
+    free = not fee
+    consultation = await add_booked_consultation(session, data, fee, payment_status="paid" if free else "pending")
+    placed = await session.scalar(
+        update(BookingSaga)
+        .where(BookingSaga.id == saga_id, BookingSaga.status == "reserving")
+        .values(consultation_id=consultation.id, fee=fee, status="confirmed" if free else "pending_payment")
+        .returning(BookingSaga.id)
+    )
+    if placed is None:
+        raise RuntimeError(f"booking {saga_id} is no longer reserving")
+    if not free:
+        add_outbox_event(session, PAYMENT_REQUESTED, {
+            "booking_id": saga_id,
+            "user_id": data.user_id,
+            "psychologist_id": data.psychologist_id,
+            "amount": fee,
+        })
+    await session.commit()
+    return consultation.id
+
+
+async def release_failed_reservation(session: AsyncSession, saga_id: int, psychologist_id: int, reason: str):
+    """The doctor was reserved but the booking could not be written; hand them back."""
+    await session.execute(
+        update(BookingSaga)
+        .where(BookingSaga.id == saga_id, BookingSaga.status == "reserving")
+        .values(status="rejected", failure_reason=reason)
+    )
+    add_outbox_event(session, DOCTOR_RELEASE, {"booking_id": saga_id, "psychologist_id": psychologist_id})
+    await session.commit()
+
+
+async def release_stale_reservations(session: AsyncSession, older_than: float, limit: int) -> int:
+    """Reject sagas left in "reserving" by a crashed request and release their doctors."""
+    stale = (
+        select(BookingSaga.id)
+        .where(
+            BookingSaga.status == "reserving",
+            BookingSaga.created_at < func.now() - timedelta(seconds=older_than),
+        )
+        .order_by(BookingSaga.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    released = (await session.execute(
+        update(BookingSaga)
+        .where(BookingSaga.id.in_(stale), BookingSaga.status == "reserving")
+        .values(status="rejected", failure_reason="Booking timed out")
+        .returning(BookingSaga.id, BookingSaga.psychologist_id)
+        .execution_options(synchronize_session=False)
+    )).all()
+    for saga_id, psychologist_id in released:
+        add_outbox_event(session, DOCTOR_RELEASE, {"booking_id": saga_id, "psychologist_id": psychologist_id})
+    await session.commit()
+    return len(released)
+
+
+async def confirm_booking(session: AsyncSession, saga_id: int) -> Optional[int]:
+    consultation_id = await session.scalar(
+        update(BookingSaga)
+        .where(BookingSaga.id == saga_id, BookingSaga.status == "pending_payment")
+        .values(status="confirmed")
+        .returning(BookingSaga.consultation_id)
+    )
+    if consultation_id is not None:
+        # Serialises with status changes, so a completion that came first is paid out here
+        consultation = await lock_consultation(session, consultation_id)
+        await session.execute(
+            update(Payments).where(Payments.consultation_id == consultation_id).values(payment_status="paid")
+        )
+        if consultation is not None and consultation.status == 'completed':
+            await announce_completion(session, consultation)
+    await session.commit()
+    return consultation_id
+
+
+async def cancel_booking(session: AsyncSession, saga_id: int, reason: str) -> Optional[BookingSaga]:
+    """Compensate a booking whose payment failed: drop the consultation and release the doctor.
+
+    Only a saga still waiting on payment is cancelled, so replays are no-ops.
+    """
+    saga = await session.scalar(
+        update(BookingSaga)
+        .where(BookingSaga.id == saga_id, BookingSaga.status == "pending_payment")
+        .values(status="cancelled", failure_reason=reason)
+        .returning(BookingSaga)
+    )
+    if saga is None:
+        await session.rollback()
+        return None
+    if saga.consultation_id is not None:
+        await delete_partial_consultation(session, saga.consultation_id)
+    add_outbox_event(session, DOCTOR_RELEASE, {"booking_id": saga.id, "psychologist_id": saga.psychologist_id})
+    await session.commit()
+    return saga
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, insert, text, update
+from sqlalchemy.exc import DataError, IntegrityError
+from dependencies.database import async_session
+from models.consultation import Chat, ChatAttachment
+
+logger = logging.getLogger("uvicorn.error")
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() == "true"
+CHAT_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_FLUSH_INTERVAL_MS", 5))
+CHAT_MAX_BATCH = int(os.getenv("CHAT_MAX_BATCH", 500))
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", 5000))
+CHAT_MAX_LAG_MS = float(os.getenv("CHAT_MAX_LAG_MS", 1000))
+CHAT_ID_PREFETCH = int(os.getenv("CHAT_ID_PREFETCH", 100))
+CHAT_FLUSH_RETRIES = 3
+_STOP = object()
+
+_attachments = ChatAttachment.__table__
+LINK_ATTACHMENT = (
+    update(_attachments)
+    .where(
+        _attachments.c.id == bindparam("b_id"),
+        _attachments.c.consultation_map_id == bindparam("b_consultation_id"),
+        _attachments.c.chat_id.is_(None),
+        _attachments.c.upload_status == 'success',
+    )
+    .values(chat_id=bindparam("b_chat_id"))
+)
+
+
+class IdBlock:
+    """Hands out ids reserved in blocks from a table's serial sequence."""
+
+    def __init__(self, table: str, block_size: int):
+        self.table = table
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._lock = asyncio.Lock()
+
+    async def take(self, count: int) -> List[int]:
+        async with self._lock:
+            if len(self._ids) < count:
+                await self._reserve(max(self.block_size, count - len(self._ids)))
+            return [self._ids.popleft() for _ in range(count)]
+
+    async def _reserve(self, count: int):
+        async with async_session() as session:
+            result = await session.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+                {"table": self.table, "count": count},
+            )
+            self._ids.extend(row[0] for row in result)
+
+
+class ChatWriter:
+    """Write-behind persistence for chat messages.
+
+    Ids come from prefetched sequence blocks so a message can be broadcast
+    before it is stored. Rows are queued and written in multi-row INSERTs,
+    at most every CHAT_FLUSH_INTERVAL_MS or CHAT_MAX_BATCH rows. Each
+    submit returns a future that resolves once the row is committed. If
+    the oldest unpersisted message is older than CHAT_MAX_LAG_MS, new
+    submits wait, so the write lag stays bounded.
+    """
+
+    def __init__(self):
+        self.enabled = CHAT_WRITE_BEHIND
+        self.max_lag = CHAT_MAX_LAG_MS / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=CHAT_MAX_PENDING)
+        self._pending: Deque[Tuple[float, asyncio.Future]] = deque()
+        self._chat_ids = IdBlock("chat", CHAT_ID_PREFETCH)
+        self._attachment_ids = IdBlock("chat_attachments", CHAT_ID_PREFETCH)
+        self._task: Optional[asyncio.Task] = None
+        self._batches = 0
+        self._rows = 0
+        self._failures = 0
+        self._last_flush_ms = 0.0
+
+    async def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+            logger.info("[chat-writer] write-behind persistence enabled")
+
+    async def stop(self):
+        """Let the writer flush its current batch and everything queued behind it, then exit."""
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(_STOP)
+        try:
+            await self._task
+        except Exception as e:
+            logger.error(f"[chat-writer] writer failed while stopping: {e}")
+        self._task = None
+        # Only messages submitted after the writer exited, or left by a crashed one, remain
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for _, persisted in self._pending:
+            if not persisted.done():
+                persisted.set_exception(RuntimeError("Chat writer stopped before the message was saved"))
+        self._pending.clear()
+
+    async def submit(
+        self,
+        message: Optional[str],
+        consultation_id: int,
+        sender_type: str,
+        attachments: List[Dict] = None,
+        message_type: str = 'text',
+    ) -> Tuple[Dict, asyncio.Future]:
+        await self._wait_for_lag()
+
+        direct_attachments = [a for a in (attachments or []) if a.get('attachment_id')]
+        stored_attachments = [
+            a for a in (attachments or []) if not a.get('attachment_id') and a.get('upload_status') == 'success'
+        ]
+        chat_id = (await self._chat_ids.take(1))[0]
+        attachment_ids = await self._attachment_ids.take(len(stored_attachments)) if stored_attachments else []
+        created_at = datetime.now(timezone.utc)
+
+        chat_row = {
+            "id": chat_id,
+            "message": message,
+            "sender": sender_type,
+            "consultation_map_id": consultation_id,
+            "message_type": message_type,
+            "has_attachments": bool(attachments),
+            "created_at": created_at,
+        }
+        attachment_rows = [
+            {
+                "id": attachment_id,
+                "chat_id": chat_id,
+                "filename": attachment_data['filename'],
+                "original_filename": attachment_data.get('original_filename', attachment_data.get('filename', 'unknown')),
+                "file_path": attachment_data.get('file_path', ''),
+                "file_url": attachment_data['file_url'],
+                "file_type": attachment_data['file_type'],
+                "file_size": attachment_data['file_size'],
+                "upload_status": attachment_data['upload_status'],
+            }
+            for attachment_id, attachment_data in zip(attachment_ids, stored_attachments)
+        ]
+        # Direct uploads already have a row, it only needs pointing at the message
+        link_rows = [
+            {"b_id": int(a['attachment_id']), "b_consultation_id": consultation_id, "b_chat_id": chat_id}
+            for a in direct_attachments
+        ]
+
+        persisted = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        await self._queue.put((chat_row, attachment_rows, link_rows, persisted))
+        self._pending.append((enqueued_at, persisted))
+        return {
+            "chat_id": chat_id,
+            "attachment_ids": attachment_ids + [row["b_id"] for row in link_rows],
+            "created_at": created_at.isoformat(),
+        }, persisted
+
+    def _prune(self):
+        while self._pending and self._pending[0][1].done():
+            self._pending.popleft()
+
+    async def _wait_for_lag(self):
+        self._prune()
+        while self._pending and time.monotonic() - self._pending[0][0] > self.max_lag:
+            await asyncio.wait({self._pending[0][1]})
+            self._prune()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + CHAT_FLUSH_INTERVAL_MS / 1000
+            while len(batch) < CHAT_MAX_BATCH:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+        # Drain whatever is still queued
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < CHAT_MAX_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        error = await self._write(batch)
+        if isinstance(error, (IntegrityError, DataError)) and len(batch) > 1:
+            # One bad row fails the whole INSERT, so only its own message should go down with it
+            logger.warning(f"[chat-writer] flush of {len(batch)} messages rejected, saving them one at a time: {error}")
+            outcomes = [(item, await self._write([item])) for item in batch]
+        else:
+            outcomes = [(item, error) for item in batch]
+
+        self._last_flush_ms = (time.perf_counter() - started) * 1000
+        saved = sum(1 for _, item_error in outcomes if item_error is None)
+        if saved:
+            self._batches += 1
+            self._rows += saved
+        for (chat_row, _, _, persisted), item_error in outcomes:
+            if item_error is not None:
+                self._failures += 1
+                logger.error(f"[chat-writer] dropped message {chat_row['id']}: {item_error}")
+            if persisted.done():
+                continue
+            if item_error is None:
+                persisted.set_result(chat_row["id"])
+            else:
+                persisted.set_exception(RuntimeError("Failed to save chat message"))
+        self._prune()
+
+    async def _write(self, batch) -> Optional[Exception]:
+        """Insert the batch in one transaction, retrying transient failures; returns the last error."""
+        chat_rows = [chat_row for chat_row, _, _, _ in batch]
+        attachment_rows = [row for _, rows, _, _ in batch for row in rows]
+        link_rows = [row for _, _, rows, _ in batch for row in rows]
+        error = None
+        for attempt in range(CHAT_FLUSH_RETRIES):
+            try:
+                async with async_session() as session:
+                    async with session.begin():
+                        await session.execute(insert(Chat), chat_rows)
+                        if attachment_rows:
+                            await session.execute(insert(ChatAttachment), attachment_rows)
+                        if link_rows:
+                            await session.execute(LINK_ATTACHMENT, link_rows)
+                return None
+            except (IntegrityError, DataError) as e:
+                # The same rows would be rejected again
+                return e
+            except Exception as e:
+                error = e
+                logger.warning(f"[chat-writer] flush of {len(chat_rows)} messages failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(0.05 * (2 ** attempt))
+        return error
+
+    def stats(self) -> Dict:
+        self._prune()
+        oldest = self._pending[0][0] if self._pending else None
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "batches": self._batches,
+            "rows": self._rows,
+            "avg_batch": round(self._rows / self._batches, 2) if self._batches else 0.0,
+            "failed_rows": self._failures,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+            "lag_ms": round((time.monotonic() - oldest) * 1000, 3) if oldest is not None else 0.0,
+        }
+
+
+chat_writer = ChatWriter()
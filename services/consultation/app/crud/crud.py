@@ -1,11 +1,15 @@
 from sqlalchemy.future import select
-from sqlalchemy import func,extract,desc, asc
+from sqlalchemy import func,desc, asc, Date, update, delete, exists, text, cast, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from schemas.consultation import CompliantSchemaa,CreateConsultationSchema,UpdateConsultationSchema,CreateFeedbackSchema,CreateNotificationSchema,UpdateComplaintSchema
-from models.consultation import Consultation,Payments,ConsultationMapping,Chat,Feedback,Notification,Complaint,ChatAttachment
-from datetime import datetime,time
+from models.consultation import (
+    Consultation,Payments,ConsultationMapping,Chat,Feedback,Notification,Complaint,ChatAttachment,PsychologistRating,
+    PsychologistMonthlyStats,PsychologistMonthlyPatient,BookingSaga
+)
+from datetime import datetime,time,date
 import calendar
 from typing import Optional,List,Dict
 from fastapi import HTTPException
@@ -13,59 +17,207 @@ from sqlalchemy import or_
 import logging
 import traceback
 from utils.time import utc_to_ist
+from utils.pagination import apply_keyset
+from crud.outbox import add_outbox_event_once
 
-logger = logging.getLogger("uvicorn.error")
+PLATFORM_FEE_RATE = 0.20
+CONSULTATION_COMPLETED = "consultation.completed"
 
 
-async def create_consultation(session: AsyncSession, data: CreateConsultationSchema,fees:int):
-    try:
-        async with session.begin():
-            # Create consultation
-            consultation = Consultation(
-                user_id=data.user_id,
-                psychologist_id=data.psychologist_id,
-                status="Pending",
-                duration="0",
-            )
-            session.add(consultation)
-            await session.flush()  # gets the consultation.id without committing
-
-            # Create payment linked to consultation
-            payment = Payments(
-                consultation_id=consultation.id,
-                psychologist_fee=fees,
-                payment_status="paid"
+def _year_bounds(year: int):
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def _month_of(created_at):
+    return cast(func.date_trunc('month', created_at), Date)
+
+
+async def _bump_monthly_stats(session: AsyncSession, psychologist_id: int, period, **deltas):
+    table = PsychologistMonthlyStats.__table__
+    stmt = pg_insert(PsychologistMonthlyStats).values(
+        psychologist_id=psychologist_id, period=period, **deltas
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.psychologist_id, table.c.period],
+        set_={column: table.c[column] + stmt.excluded[column] for column in deltas},
+    )
+    await session.execute(stmt)
+
+
+async def _record_booking(session: AsyncSession, consultation: Consultation, fees: int):
+    # Bucketed by now(), which is the same transaction timestamp created_at defaults to
+    period = _month_of(func.now())
+    fees = fees or 0
+    await _bump_monthly_stats(
+        session, consultation.psychologist_id, period,
+        booked_sessions=1, gross_fees=fees, platform_fees=fees * PLATFORM_FEE_RATE,
+    )
+    await session.execute(
+        pg_insert(PsychologistMonthlyPatient)
+        .values(psychologist_id=consultation.psychologist_id, period=period, user_id=consultation.user_id)
+        .on_conflict_do_nothing()
+    )
+
+
+async def announce_completion(session: AsyncSession, consultation: Consultation, fees: Optional[int] = None):
+    """Queue the doctor's payout and release for a completed consultation once it is paid.
+
+    A booking completed while its debit is still pending gets this from
+    confirm_booking instead, and one whose debit fails never pays out. The
+    event id is derived from the consultation, so a consultation that is
+    reopened and completed again is not paid out twice.
+    """
+    paid = await session.scalar(select(exists().where(
+        Payments.consultation_id == consultation.id, Payments.payment_status == 'paid',
+    )))
+    if not paid:
+        return
+    if fees is None:
+        fees = await session.scalar(
+            select(func.coalesce(func.sum(Payments.psychologist_fee), 0))
+            .where(Payments.consultation_id == consultation.id)
+        )
+    booking_id = await session.scalar(
+        select(BookingSaga.id).where(BookingSaga.consultation_id == consultation.id)
+    )
+    await add_outbox_event_once(session, f"completed-{consultation.id}", CONSULTATION_COMPLETED, {
+        "consultation_id": consultation.id,
+        "booking_id": booking_id,
+        "user_id": consultation.user_id,
+        "psychologist_id": consultation.psychologist_id,
+        "doctor_amount": round(fees * (1 - PLATFORM_FEE_RATE)),
+    })
+
+
+async def _record_status_change(session: AsyncSession, consultation: Consultation, old_status: Optional[str]):
+    was_completed = old_status == 'completed'
+    is_completed = consultation.status == 'completed'
+    if was_completed == is_completed:
+        return
+    delta = 1 if is_completed else -1
+    period = (
+        select(_month_of(Consultation.created_at))
+        .where(Consultation.id == consultation.id)
+        .scalar_subquery()
+    )
+    fees = await session.scalar(
+        select(func.coalesce(func.sum(Payments.psychologist_fee), 0))
+        .where(Payments.consultation_id == consultation.id)
+    )
+    await _bump_monthly_stats(
+        session, consultation.psychologist_id, period,
+        completed_sessions=delta, completed_fees=delta * fees,
+    )
+    if is_completed:
+        await announce_completion(session, consultation, fees)
+        stmt = pg_insert(PsychologistMonthlyPatient).values(
+            psychologist_id=consultation.psychologist_id, period=period,
+            user_id=consultation.user_id, completed=True,
+        )
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=['psychologist_id', 'period', 'user_id'],
+            set_={'completed': True},
+        ))
+    else:
+        # Only clear the flag if no other completed session remains in that month
+        await session.execute(
+            update(PsychologistMonthlyPatient)
+            .where(
+                PsychologistMonthlyPatient.psychologist_id == consultation.psychologist_id,
+                PsychologistMonthlyPatient.user_id == consultation.user_id,
+                PsychologistMonthlyPatient.period == period,
             )
-            session.add(payment)
-            await session.flush()
-
-            # Check if mapping already exists
-            result = await session.execute(
-                select(ConsultationMapping).where(
-                    ConsultationMapping.user_id == data.user_id,
-                    ConsultationMapping.psychologist_id == data.psychologist_id
-                )
+            .values(completed=exists().where(
+                Consultation.psychologist_id == consultation.psychologist_id,
+                Consultation.user_id == consultation.user_id,
+                Consultation.status == 'completed',
+                _month_of(Consultation.created_at) == period,
+            ))
+        )
+
+
+async def rebuild_dashboard_rollups(session: AsyncSession):
+    """Recompute both rollup tables from consultation/payments history.
+
+    The rollup tables are locked first, so bookings committed during the
+    rebuild block on their upsert and are applied on top of it.
+    """
+    async with session.begin():
+        await session.execute(text(
+            "LOCK TABLE psychologist_monthly_stats, psychologist_monthly_patient IN EXCLUSIVE MODE"
+        ))
+        await session.execute(text("DELETE FROM psychologist_monthly_stats"))
+        await session.execute(text("DELETE FROM psychologist_monthly_patient"))
+        await session.execute(text("""
+            INSERT INTO psychologist_monthly_stats (
+                psychologist_id, period, booked_sessions, gross_fees, platform_fees,
+                completed_sessions, completed_fees
             )
-            existing_mapping = result.scalars().first()
+            SELECT c.psychologist_id,
+                   date_trunc('month', c.created_at)::date,
+                   COUNT(*),
+                   COALESCE(SUM(p.fee), 0),
+                   COALESCE(SUM(p.fee), 0) * :rate,
+                   COUNT(*) FILTER (WHERE c.status = 'completed'),
+                   COALESCE(SUM(p.fee) FILTER (WHERE c.status = 'completed'), 0)
+            FROM consultation c
+            LEFT JOIN (
+                SELECT consultation_id, SUM(psychologist_fee) AS fee
+                FROM payments GROUP BY consultation_id
+            ) p ON p.consultation_id = c.id
+            WHERE c.psychologist_id IS NOT NULL AND c.created_at IS NOT NULL
+            GROUP BY c.psychologist_id, date_trunc('month', c.created_at)::date
+        """), {"rate": PLATFORM_FEE_RATE})
+        await session.execute(text("""
+            INSERT INTO psychologist_monthly_patient (psychologist_id, period, user_id, completed)
+            SELECT psychologist_id, date_trunc('month', created_at)::date, user_id,
+                   bool_or(status = 'completed')
+            FROM consultation
+            WHERE psychologist_id IS NOT NULL AND user_id IS NOT NULL AND created_at IS NOT NULL
+            GROUP BY psychologist_id, date_trunc('month', created_at)::date, user_id
+        """))
 
-            if not existing_mapping:
-                mapping = ConsultationMapping(
-                    user_id=data.user_id,
-                    psychologist_id=data.psychologist_id
-                )
-                session.add(mapping)
-                await session.flush()
+logger = logging.getLogger("uvicorn.error")
 
-        # Outside transaction, safe to refresh
-        await session.refresh(consultation)
-        await session.refresh(payment)
 
-        return consultation.id
-           
-    except SQLAlchemyError as e:
-        await session.rollback()
-        # Log error or raise appropriate exception
-        raise e
+async def add_booked_consultation(session: AsyncSession, data: CreateConsultationSchema, fees: int, payment_status: str = "paid") -> Consultation:
+    """Add a consultation with its payment, stats and chat mapping; the caller owns the transaction."""
+    consultation = Consultation(
+        user_id=data.user_id,
+        psychologist_id=data.psychologist_id,
+        status="Pending",
+        duration="0",
+    )
+    session.add(consultation)
+    await session.flush()  # gets the consultation.id without committing
+
+    # Create payment linked to consultation
+    payment = Payments(
+        consultation_id=consultation.id,
+        psychologist_fee=fees,
+        payment_status=payment_status
+    )
+    session.add(payment)
+    await session.flush()
+    await _record_booking(session, consultation, fees)
+
+    # Check if mapping already exists
+    result = await session.execute(
+        select(ConsultationMapping).where(
+            ConsultationMapping.user_id == data.user_id,
+            ConsultationMapping.psychologist_id == data.psychologist_id
+        )
+    )
+    existing_mapping = result.scalars().first()
+
+    if not existing_mapping:
+        mapping = ConsultationMapping(
+            user_id=data.user_id,
+            psychologist_id=data.psychologist_id
+        )
+        session.add(mapping)
+        await session.flush()
+    return consultation
     
     
 async def create_feedback(session: AsyncSession, data: CreateFeedbackSchema):
@@ -78,6 +230,26 @@ async def create_feedback(session: AsyncSession, data: CreateFeedbackSchema):
             rating=data.rating,
         )
         session.add(feedback)
+
+        psychologist_id = await session.scalar(
+            select(Consultation.psychologist_id).where(Consultation.id == data.consultation_id)
+        )
+        if psychologist_id is not None:
+            # Same transaction as the feedback row so the summary never drifts
+            stmt = pg_insert(PsychologistRating).values(
+                psychologist_id=psychologist_id,
+                rating_sum=data.rating,
+                rating_count=1,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[PsychologistRating.psychologist_id],
+                set_={
+                    "rating_sum": PsychologistRating.rating_sum + data.rating,
+                    "rating_count": PsychologistRating.rating_count + 1,
+                    "updated_at": func.now(),
+                },
+            )
+            await session.execute(stmt)
         await session.commit()        
 
     except SQLAlchemyError as e:
@@ -116,27 +288,40 @@ async def create_notification(session: AsyncSession, data: CreateNotificationSch
         raise e
     
     
+async def lock_consultation(session: AsyncSession, consultation_id: int) -> Optional[Consultation]:
+    # Status changes feed the rollups from the previous status, so concurrent ones must queue up
+    result = await session.execute(
+        select(Consultation)
+        .where(Consultation.id == consultation_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one_or_none()
+
 async def update_analysis_consultation(session: AsyncSession, data: UpdateConsultationSchema):
-    result = await session.execute(select(Consultation).where(Consultation.id == data.consultation_id))
-    consultation = result.scalar_one_or_none()
+    consultation = await lock_consultation(session, data.consultation_id)
+    old_status = consultation.status
     consultation.analysis = data.message
     consultation.duration = "0 min"
     consultation.status='completed'
+    await _record_status_change(session, consultation, old_status)
     await session.commit()
     
 async def update_consultation_status(session: AsyncSession, status:str,consultation_id:int):
-    result = await session.execute(select(Consultation).where(Consultation.id == consultation_id))
-    consultation = result.scalar_one_or_none()
+    consultation = await lock_consultation(session, consultation_id)
+    old_status = consultation.status
     consultation.status=status
+    await _record_status_change(session, consultation, old_status)
     await session.commit()
     
-async def save_recording_database(session: AsyncSession, video_url:str,consultation_id:int):
+async def save_recording_database(session: AsyncSession, video_url:str,consultation_id:int, manifest_url:str=None):
     result = await session.execute(select(Consultation).where(Consultation.id == consultation_id))
     consultation = result.scalar_one_or_none()
     consultation.video=video_url
+    consultation.video_manifest=manifest_url
     await session.commit()
     
-async def get_all_consultation(session: AsyncSession, start_date=None, end_date=None, skip: int = 0, limit: int = 10):
+async def get_all_consultation(session: AsyncSession, start_date=None, end_date=None, skip: int = 0, limit: int = 10, after=None, before=None, keyset: bool = False):
     query = select(Consultation).options(selectinload(Consultation.payments))
 
     
@@ -149,7 +334,10 @@ async def get_all_consultation(session: AsyncSession, start_date=None, end_date=
             Consultation.created_at <= end_datetime
         )
 
-    query = query.order_by(Consultation.created_at.desc()).limit(limit).offset(skip)
+    if keyset:
+        query = apply_keyset(query, Consultation.created_at, Consultation.id, limit, after, before)
+    else:
+        query = query.order_by(Consultation.created_at.desc()).limit(limit).offset(skip)
 
     result = await session.execute(query)
     return result.scalars().all()
@@ -183,14 +371,13 @@ async def get_all_mapping_for_chat_user(session: AsyncSession,user_id:int):
     )
     return result.scalars().all()
 
-async def consultation_for_user(session: AsyncSession, user_id: int, skip: int, limit: int):
-    result = await session.execute(
-        select(Consultation)
-        .where(Consultation.user_id == user_id)
-        .order_by(desc(Consultation.created_at))  
-        .offset(skip)
-        .limit(limit)
-    )
+async def consultation_for_user(session: AsyncSession, user_id: int, skip: int = 0, limit: int = 10, after=None, before=None, keyset: bool = False):
+    query = select(Consultation).where(Consultation.user_id == user_id)
+    if keyset:
+        query = apply_keyset(query, Consultation.created_at, Consultation.id, limit, after, before)
+    else:
+        query = query.order_by(desc(Consultation.created_at)).offset(skip).limit(limit)
+    result = await session.execute(query)
     return result.scalars().all()
 
 async def consultation_details_with_id(session: AsyncSession,  consultation_id: int):
@@ -201,9 +388,15 @@ async def consultation_details_with_id(session: AsyncSession,  consultation_id:
     )
     return result.scalar()
 
-async def consultation_for_doctor(session: AsyncSession, psychologist_id: int, skip: int, limit: int, ordering: Optional[str] = None):
+async def consultation_for_doctor(session: AsyncSession, psychologist_id: int, skip: int = 0, limit: int = 10, ordering: Optional[str] = None, after=None, before=None, keyset: bool = False):
     query = select(Consultation).where(Consultation.psychologist_id == psychologist_id)
     
+    # Keyset paging only supports the default newest-first ordering
+    if keyset:
+        query = apply_keyset(query, Consultation.created_at, Consultation.id, limit, after, before)
+        result = await session.execute(query)
+        return result.scalars().all()
+
     # Apply ordering if provided
     if ordering:
         field_name = ordering.lstrip('-')
@@ -235,21 +428,22 @@ async def consultation_for_doctor(session: AsyncSession, psychologist_id: int, s
     result = await session.execute(query)
     return result.scalars().all()
 
-async def get_notifications_crud(session: AsyncSession,  skip: int, limit: int):
-    result = await session.execute(
-        select(Notification)
-        .offset(skip)
-        .limit(limit)
-    )
+async def get_notifications_crud(session: AsyncSession,  skip: int = 0, limit: int = 10, after=None, before=None, keyset: bool = False):
+    query = select(Notification)
+    if keyset:
+        query = apply_keyset(query, Notification.created_at, Notification.id, limit, after, before)
+    else:
+        query = query.offset(skip).limit(limit)
+    result = await session.execute(query)
     return result.scalars().all()
 
-async def get_compliants_crud(session: AsyncSession,  skip: int, limit: int):
-    result = await session.execute(
-        select(Complaint)
-        .order_by(desc(Complaint.created_at))
-        .offset(skip)
-        .limit(limit)
-    )
+async def get_compliants_crud(session: AsyncSession,  skip: int = 0, limit: int = 10, after=None, before=None, keyset: bool = False):
+    query = select(Complaint)
+    if keyset:
+        query = apply_keyset(query, Complaint.created_at, Complaint.id, limit, after, before)
+    else:
+        query = query.order_by(desc(Complaint.created_at)).offset(skip).limit(limit)
+    result = await session.execute(query)
     return result.scalars().all()
 
 async def count_consultations(session: AsyncSession, user_id: int):
@@ -265,12 +459,16 @@ async def count_consultations_by_doctor_crud(session: AsyncSession, psychologist
     return result.scalar()
 
 async def get_psychologist_rating_crud(session: AsyncSession, psychologist_id: int):
+    summary = await session.get(PsychologistRating, psychologist_id)
+    if summary is None or not summary.rating_count:
+        return None
+    return summary.rating_sum / summary.rating_count
+
+async def get_psychologist_ratings_bulk_crud(session: AsyncSession, psychologist_ids: List[int]):
     result = await session.execute(
-        select(func.avg(Feedback.rating))
-        .join(Consultation, Feedback.consultation_id == Consultation.id)
-        .where(Consultation.psychologist_id == psychologist_id)
+        select(PsychologistRating).where(PsychologistRating.psychologist_id.in_(psychologist_ids))
     )
-    return result.scalar()  # Returns None if no ratings found
+    return result.scalars().all()
 
 async def get_feedbacks_crud(session: AsyncSession, psychologist_id: int):
     result = await session.execute(
@@ -282,134 +480,79 @@ async def get_feedbacks_crud(session: AsyncSession, psychologist_id: int):
 
 
 async def doctor_dashboard_details_crud(session: AsyncSession, psychologist_id: int, selectedYear: int):
-    # Total earnings from completed payments for the selected year
-    earnings_query = await session.execute(
-        select(func.coalesce(func.sum(Payments.psychologist_fee*0.80), 0))
-        .join(Consultation, Payments.consultation_id == Consultation.id)
-        .where(
-            Consultation.psychologist_id == psychologist_id,
-            Consultation.status == "completed",
-            extract('year', Payments.created_at) == selectedYear
-        )
-    )
-    total_earnings = earnings_query.scalar()
-
-    # Total sessions for the psychologist in the selected year
-    sessions_query = await session.execute(
-        select(func.count(Consultation.id))
-        .where(
-            Consultation.status == "completed",
-            Consultation.psychologist_id == psychologist_id,
-            extract('year', Consultation.created_at) == selectedYear
-        )
-    )
-    total_sessions = sessions_query.scalar()
-
-    # Total unique patients in the selected year
-    patients_query = await session.execute(
-        select(func.count(func.distinct(Consultation.user_id)))
+    start, end = _year_bounds(selectedYear)
+    patients = (
+        select(func.count(func.distinct(PsychologistMonthlyPatient.user_id)))
         .where(
-            Consultation.status == "completed",
-            Consultation.psychologist_id == psychologist_id,
-            extract('year', Consultation.created_at) == selectedYear
+            PsychologistMonthlyPatient.psychologist_id == psychologist_id,
+            PsychologistMonthlyPatient.completed.is_(True),
+            PsychologistMonthlyPatient.period >= start,
+            PsychologistMonthlyPatient.period < end,
         )
+        .scalar_subquery()
     )
-    total_patients = patients_query.scalar()
-
-    # Monthly earnings chart data in the selected year
-    chart_query = await session.execute(
+    result = await session.execute(
         select(
-            extract('month', Payments.created_at).label('month'),
-            func.sum(Payments.psychologist_fee).label('earnings')
+            PsychologistMonthlyStats.period,
+            PsychologistMonthlyStats.completed_sessions,
+            PsychologistMonthlyStats.completed_fees,
+            patients.label('patients'),
         )
-        .join(Consultation, Payments.consultation_id == Consultation.id)
         .where(
-            Consultation.psychologist_id == psychologist_id,
-            Consultation.status == "completed",
-            extract('year', Payments.created_at) == selectedYear
+            PsychologistMonthlyStats.psychologist_id == psychologist_id,
+            PsychologistMonthlyStats.period >= start,
+            PsychologistMonthlyStats.period < end,
         )
-        .group_by('month')
-        .order_by('month')
+        .order_by(PsychologistMonthlyStats.period)
     )
-    chart_data_raw = chart_query.all()
-
-    # Format chart data as month names
-    month_map = {i: calendar.month_abbr[i] for i in range(1, 13)}
-    chart_data = [
-        {
-            "month": month_map.get(int(month), "Unknown"),
-            "earnings": int(earning)
-        }
-        for month, earning in chart_data_raw
-    ]
+    rows = result.all()
 
+    completed_fees = sum(row.completed_fees for row in rows)
     return {
-        "totalEarnings": total_earnings,
-        "totalSessions": total_sessions,
-        "totalPatients": total_patients,
-        "chart_data": chart_data
+        "totalEarnings": completed_fees * (1 - PLATFORM_FEE_RATE),
+        "totalSessions": sum(row.completed_sessions for row in rows),
+        "totalPatients": rows[0].patients if rows else 0,
+        "chart_data": [
+            {"month": calendar.month_abbr[row.period.month], "earnings": int(row.completed_fees)}
+            for row in rows if row.completed_sessions
+        ]
     }
     
 async def admin_dashboard_details_crud(session: AsyncSession, year: int):
-    # Total earnings from completed payments in the given year
-    earnings_query = await session.execute(
-        select(func.coalesce(func.sum(Payments.psychologist_fee*0.20), 0))
+    start, end = _year_bounds(year)
+    patients = (
+        select(func.count(func.distinct(PsychologistMonthlyPatient.user_id)))
         .where(
-            Payments.payment_status == "paid",
-            extract('year', Payments.created_at) == year
+            PsychologistMonthlyPatient.period >= start,
+            PsychologistMonthlyPatient.period < end,
         )
+        .scalar_subquery()
     )
-    total_earnings = earnings_query.scalar()
-
-    # Total sessions for the psychologist in the given year
-    sessions_query = await session.execute(
-        select(func.count(Consultation.id))
-        .where(
-            extract('year', Consultation.created_at) == year
-        )
-    )
-    total_sessions = sessions_query.scalar()
-
-    # Total unique patients in the given year
-    patients_query = await session.execute(
-        select(func.count(func.distinct(Consultation.user_id)))
-        .where(
-            extract('year', Consultation.created_at) == year
-        )
-    )
-    total_patients = patients_query.scalar()
-
-    # Monthly earnings chart data in the given year
-    chart_query = await session.execute(
+    result = await session.execute(
         select(
-            extract('month', Payments.created_at).label('month'),
-            func.sum(Payments.psychologist_fee).label('earnings')
+            PsychologistMonthlyStats.period,
+            func.sum(PsychologistMonthlyStats.booked_sessions).label('sessions'),
+            func.sum(PsychologistMonthlyStats.gross_fees).label('gross_fees'),
+            func.sum(PsychologistMonthlyStats.platform_fees).label('platform_fees'),
+            patients.label('patients'),
         )
-        .join(Consultation, Payments.consultation_id == Consultation.id)
         .where(
-            Payments.payment_status == "paid",
-            extract('year', Payments.created_at) == year
+            PsychologistMonthlyStats.period >= start,
+            PsychologistMonthlyStats.period < end,
         )
-        .group_by('month')
-        .order_by('month')
+        .group_by(PsychologistMonthlyStats.period)
+        .order_by(PsychologistMonthlyStats.period)
     )
-    chart_data_raw = chart_query.all()
-
-    # Format chart data with month names
-    month_map = {i: calendar.month_abbr[i] for i in range(1, 13)}
-    chart_data = [
-        {
-            "month": month_map.get(int(month), "Unknown"),
-            "earnings": int(earning)
-        }
-        for month, earning in chart_data_raw
-    ]
+    rows = result.all()
 
     return {
-        "totalEarnings": total_earnings,
-        "totalSessions": total_sessions,
-        "totalPatients": total_patients,
-        "chart_data": chart_data
+        "totalEarnings": float(sum(row.platform_fees for row in rows)),
+        "totalSessions": int(sum(row.sessions for row in rows)),
+        "totalPatients": rows[0].patients if rows else 0,
+        "chart_data": [
+            {"month": calendar.month_abbr[row.period.month], "earnings": int(row.gross_fees)}
+            for row in rows if row.sessions
+        ]
     }
 
 
@@ -514,29 +657,58 @@ async def validate_both_owns_consultation(
 #         return False
 
         
-async def get_chat_messages_using_cons_id(session: AsyncSession, consultation_id: int):
+async def get_chat_messages_using_cons_id(
+    session: AsyncSession,
+    consultation_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+):
+    """Chat history in ascending order plus a has_more flag.
+
+    With no cursor and no limit the whole history is returned (legacy
+    behaviour). before_id pages backwards from a message, after_id returns
+    what arrived after it, and limit alone gives the latest messages.
+    """
     try:
-        count_query = select(func.count(Chat.id)).where(Chat.consultation_map_id == consultation_id)
-        count_result = await session.execute(count_query)
-        total_count = count_result.scalar()
-        consultation_exists = await session.execute(
-            select(ConsultationMapping).where(ConsultationMapping.id == consultation_id))
-        if not consultation_exists.scalar():
-            return []  
-       
-        result = await session.execute(
+        position = tuple_(Chat.created_at, Chat.id)
+        query = (
             select(Chat)
             .options(selectinload(Chat.attachments))
             .where(Chat.consultation_map_id == consultation_id)
-            .order_by(Chat.created_at.asc())
-            
         )
-        messages = result.scalars().all()
+        anchor_id = before_id or after_id
+        if anchor_id:
+            anchor = (await session.execute(
+                select(Chat.created_at, Chat.id)
+                .where(Chat.id == anchor_id, Chat.consultation_map_id == consultation_id)
+            )).first()
+            if anchor is None:
+                raise HTTPException(status_code=400, detail="Unknown message cursor")
+
+        if after_id:
+            query = query.where(position > tuple_(*anchor)).order_by(Chat.created_at.asc(), Chat.id.asc())
+        elif before_id or limit:
+            if before_id:
+                query = query.where(position < tuple_(*anchor))
+            query = query.order_by(Chat.created_at.desc(), Chat.id.desc())
+        else:
+            query = query.order_by(Chat.created_at.asc(), Chat.id.asc())
+        if limit:
+            query = query.limit(limit + 1)
+
+        result = await session.execute(query)
+        messages = list(result.scalars().all())
+        has_more = bool(limit) and len(messages) > limit
+        if limit:
+            messages = messages[:limit]
+        if not after_id and (before_id or limit):
+            messages.reverse()
         formatted_messages = []
         for msg in messages:
             attachments = []
             for att in msg.attachments:
-                if not att.file_url:  
+                if not att.file_url or att.upload_status == 'quarantined':
                     continue
                 attachments.append({
                     "id": att.id,
@@ -558,17 +730,18 @@ async def get_chat_messages_using_cons_id(session: AsyncSession, consultation_id
                 "consultation_id": consultation_id  
             })
 
-        return formatted_messages
+        return formatted_messages, has_more
        
-
+    except HTTPException:
+        raise
     except SQLAlchemyError as e:
-        print(f"Database error in get_chat_messages: {str(e)}", exc_info=True)
+        logger.error(f"Database error in get_chat_messages: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Database error occurred"
         )
     except Exception as e:
-        print(f"Unexpected error in get_chat_messages: {str(e)}", exc_info=True)
+        logger.error(f"Unexpected error in get_chat_messages: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="An unexpected error occurred"
@@ -604,12 +777,6 @@ async def verify_user_consultation(session: AsyncSession, consultation_id, curre
     )
     return result.scalars().first()
 
-async def get_doctor_fee_after_platform_fee(session: AsyncSession,consultation_id :int):
-    result = await session.execute(
-        select(func.coalesce(func.sum(Payments.psychologist_fee*0.80), 0))
-        .where(Payments.consultation_id==consultation_id)
-    )
-    return result.scalar()
 
 async def save_chat_message_with_attachments(
     session: AsyncSession,
@@ -620,9 +787,6 @@ async def save_chat_message_with_attachments(
     message_type: str = 'text'
 ) -> Dict:
     try:
-        if session.in_transaction():
-            await session.rollback()
-
         logger.debug(f"Inserting chat: consultation_id={consultation_id}, sender={sender_type}, message={message}")
         logger.debug(f"Attachments: {attachments}")
 
@@ -638,7 +802,12 @@ async def save_chat_message_with_attachments(
         attachment_ids = []
         if attachments:
             for attachment_data in attachments:
-                if attachment_data.get('upload_status') == 'success':
+                if attachment_data.get('attachment_id'):
+                    # Uploaded directly to storage, the row already exists
+                    linked = await link_direct_attachment(session, attachment_data['attachment_id'], consultation_id, chat.id)
+                    if linked:
+                        attachment_ids.append(linked)
+                elif attachment_data.get('upload_status') == 'success':
                     logger.debug(f"Processing attachment: {attachment_data}")
                     original_filename = attachment_data.get('original_filename', attachment_data.get('filename', 'unknown'))
                     file_path = attachment_data.get('file_path', '')
@@ -669,17 +838,116 @@ async def save_chat_message_with_attachments(
         logger.error("Error saving chat message:", traceback.format_exc())
         raise RuntimeError("Failed to save chat message")
 
-       
+
+async def link_direct_attachment(session: AsyncSession, attachment_id: int, consultation_id: int, chat_id: int) -> Optional[int]:
+    result = await session.execute(
+        update(ChatAttachment)
+        .where(
+            ChatAttachment.id == attachment_id,
+            ChatAttachment.consultation_map_id == consultation_id,
+            ChatAttachment.chat_id.is_(None),
+            ChatAttachment.upload_status == 'success',
+        )
+        .values(chat_id=chat_id)
+        .returning(ChatAttachment.id)
+    )
+    return result.scalar_one_or_none()
+
+async def create_unlinked_attachment(
+    session: AsyncSession,
+    consultation_id: int,
+    filename: str,
+    original_filename: str,
+    file_type: str,
+    file_size: int,
+    storage_key: Optional[str] = None,
+    file_url: str = '',
+    file_path: str = '',
+    upload_status: str = 'pending',
+) -> ChatAttachment:
+    attachment = ChatAttachment(
+        consultation_map_id=consultation_id,
+        filename=filename,
+        original_filename=original_filename,
+        file_path=file_path,
+        file_url=file_url,
+        file_type=file_type,
+        file_size=file_size,
+        storage_key=storage_key,
+        upload_status=upload_status,
+    )
+    session.add(attachment)
+    await session.commit()
+    await session.refresh(attachment)
+    return attachment
+
+async def get_direct_attachment(session: AsyncSession, attachment_id: int) -> Optional[ChatAttachment]:
+    result = await session.execute(
+        select(ChatAttachment).where(ChatAttachment.id == attachment_id, ChatAttachment.storage_key.is_not(None))
+    )
+    return result.scalar_one_or_none()
+
+async def complete_direct_attachment(session: AsyncSession, attachment: ChatAttachment, file_url: Optional[str], file_size: int, upload_status: str):
+    attachment.file_url = file_url or ''
+    attachment.file_size = file_size
+    attachment.upload_status = upload_status
+    await session.commit()
+    await session.refresh(attachment)
+    return attachment
+
+async def quarantine_attachment(session: AsyncSession, attachment_id: int) -> Optional[int]:
+    """Flag an attachment so it is no longer linked or served, returning its consultation."""
+    result = await session.execute(
+        update(ChatAttachment)
+        .where(ChatAttachment.id == attachment_id)
+        .values(upload_status='quarantined')
+        .returning(ChatAttachment.consultation_map_id, ChatAttachment.chat_id)
+    )
+    row = result.first()
+    await session.commit()
+    if row is None:
+        return None
+    if row.consultation_map_id is not None:
+        return row.consultation_map_id
+    chat = await session.execute(select(Chat.consultation_map_id).where(Chat.id == row.chat_id))
+    return chat.scalar_one_or_none()
+
 async def update_complaints_curd(session: AsyncSession, data :UpdateComplaintSchema,complaint_id:int):
     result = await session.execute(select(Complaint).where(Complaint.id == complaint_id))
     complaint = result.scalar_one_or_none()
     complaint.status=data.editingStatus
     await session.commit()
     
-async def delete_partial_consultation(session: AsyncSession,consultation_id:int):
-    result = await session.execute(
-        select(Complaint)
-        .join(Consultation)
-        .where(Consultation.user_id == consultation_id)
+async def delete_partial_consultation(session: AsyncSession,consultation_id:int) -> bool:
+    """Remove a booking that never went through and take it back out of the monthly stats; the caller commits."""
+    consultation = await session.get(Consultation, consultation_id)
+    if consultation is None:
+        return False
+    fees = await session.scalar(
+        select(func.coalesce(func.sum(Payments.psychologist_fee), 0))
+        .where(Payments.consultation_id == consultation_id)
+    )
+    period = await session.scalar(
+        select(_month_of(Consultation.created_at)).where(Consultation.id == consultation_id)
+    )
+    await _bump_monthly_stats(
+        session, consultation.psychologist_id, period,
+        booked_sessions=-1, gross_fees=-fees, platform_fees=-fees * PLATFORM_FEE_RATE,
+    )
+    # Payments, feedback and complaints go with it through ON DELETE CASCADE
+    await session.execute(delete(Consultation).where(Consultation.id == consultation_id))
+    # The patient stays counted for the month only if they booked this doctor again in it
+    await session.execute(
+        delete(PsychologistMonthlyPatient).where(
+            PsychologistMonthlyPatient.psychologist_id == consultation.psychologist_id,
+            PsychologistMonthlyPatient.user_id == consultation.user_id,
+            PsychologistMonthlyPatient.period == period,
+            ~exists().where(
+                Consultation.psychologist_id == consultation.psychologist_id,
+                Consultation.user_id == consultation.user_id,
+                _month_of(Consultation.created_at) == period,
+            ),
+        )
     )
-    return result.scalars().all()
\ No newline at end of file
+    session.expunge(consultation)
+    return True
\ No newline at end of file
@@ -0,0 +1,27 @@
+from typing import Dict
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.events import OutboxRelay, new_event_id
+from dependencies.database import async_session
+from models.consultation import OutboxEvent
+
+
+def add_outbox_event(session: AsyncSession, event_type: str, payload: Dict) -> str:
+    """Queue an event to be published once the surrounding transaction commits."""
+    event_id = new_event_id()
+    session.add(OutboxEvent(event_id=event_id, event_type=event_type, payload=payload))
+    return event_id
+
+
+async def add_outbox_event_once(session: AsyncSession, event_id: str, event_type: str, payload: Dict) -> bool:
+    """Like ``add_outbox_event`` with a caller-chosen id; returns False if that id was queued before."""
+    result = await session.execute(
+        pg_insert(OutboxEvent)
+        .values(event_id=event_id, event_type=event_type, payload=payload)
+        .on_conflict_do_nothing(index_elements=["event_id"])
+        .returning(OutboxEvent.id)
+    )
+    return result.first() is not None
+
+
+outbox_relay = OutboxRelay(async_session, OutboxEvent)
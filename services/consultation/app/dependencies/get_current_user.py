@@ -1,4 +1,4 @@
-from utils.jwt_handler import verify_token
+from core.token_cache import verify_claims, is_refresh_token
 from fastapi import WebSocket
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -18,7 +18,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     token = credentials.credentials
-    payload = verify_token(token)
+    payload = await verify_claims(token)
     if not payload:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -26,7 +26,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    if payload.get("type") == "refresh":
+    if is_refresh_token(payload):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Refresh tokens cannot be used for authorization",
@@ -59,8 +59,8 @@ async def get_current_user_ws(websocket: WebSocket):
             await websocket.close(code=1008)
             raise Exception("Missing or invalid token")
 
-        payload = verify_token(token)
-        if not payload or payload.get("type") == "refresh":
+        payload = await verify_claims(token)
+        if not payload or is_refresh_token(payload):
             await websocket.close(code=1008)
             raise Exception("Invalid or expired token")
 
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from core.events import EventConsumer
+from crud.booking import (
+    PAYMENT_FAILED, PAYMENT_SUCCEEDED, cancel_booking, claim_booking, confirm_booking, get_booking, place_booking,
+    reject_booking, release_failed_reservation, release_stale_reservations,
+)
+from crud.outbox import outbox_relay
+from dependencies.database import async_session
+from infra.external.user_service import reserve_doctor
+from models.consultation import BookingSaga
+from schemas.consultation import CreateConsultationSchema
+from signaling.rooms import broker, notification_channel
+
+logger = logging.getLogger("uvicorn.error")
+
+# Well past the user-service client timeout, so only crashed requests are swept
+BOOKING_RESERVING_TIMEOUT = float(os.getenv("BOOKING_RESERVING_TIMEOUT", 120))
+BOOKING_SWEEP_INTERVAL = float(os.getenv("BOOKING_SWEEP_INTERVAL", 60))
+BOOKING_SWEEP_BATCH = int(os.getenv("BOOKING_SWEEP_BATCH", 100))
+
+
+def booking_response(saga: BookingSaga) -> JSONResponse:
+    if saga.status in ("pending_payment", "confirmed"):
+        return JSONResponse(
+            content={
+                "status": "success",
+                "consultation_id": saga.consultation_id,
+                "booking_id": saga.id,
+                "booking_status": saga.status,
+            },
+            status_code=201,
+        )
+    if saga.status == "reserving":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This booking is already being processed")
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=saga.failure_reason or "Booking failed")
+
+
+async def book_consultation(data: CreateConsultationSchema, idempotency_key: str) -> JSONResponse:
+    """Booking saga, coordinated from consultation-service.
+
+    The only synchronous hop is user-service's reserve_doctor, which marks
+    the doctor busy and returns the fee in one conditional update. The
+    consultation, the saga row and the debit request are then committed
+    together; payment-service picks the debit up from the outbox and
+    answers with an event, and a failed debit is compensated from
+    ``handle_payment_failed``. Retries with the same key get the first
+    attempt's outcome back.
+    """
+    async with async_session() as session:
+        saga, created = await claim_booking(session, data, idempotency_key)
+        if not created:
+            return booking_response(saga)
+        # A rollback below expires the saga, and lazy loads don't work on an async session
+        saga_id = saga.id
+
+        try:
+            fee = await reserve_doctor(data.psychologist_id, saga_id)
+        except Exception as e:
+            logger.error(f"[booking] reserving doctor {data.psychologist_id} failed: {e}")
+            # The reservation may have gone through before the error, the release only applies if it did
+            await release_failed_reservation(session, saga_id, data.psychologist_id, "Doctor could not be reserved")
+            outbox_relay.notify()
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Booking is unavailable right now, try again")
+        if fee is None:
+            await reject_booking(session, saga_id, "Doctor is not available")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Doctor is not available")
+
+        try:
+            await place_booking(session, saga_id, data, fee)
+        except Exception as e:
+            logger.error(f"[booking] saving booking {saga_id} failed: {e}")
+            await session.rollback()
+            await release_failed_reservation(session, saga_id, data.psychologist_id, "Booking could not be saved")
+            outbox_relay.notify()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
+        saga = await get_booking(session, saga_id)
+    outbox_relay.notify()
+    return booking_response(saga)
+
+
+async def handle_payment_succeeded(event_id: str, payload: Dict):
+    async with async_session() as session:
+        await confirm_booking(session, payload["booking_id"])
+
+
+async def handle_payment_failed(event_id: str, payload: Dict):
+    async with async_session() as session:
+        saga = await cancel_booking(session, payload["booking_id"], payload.get("reason") or "Payment failed")
+    if saga is None:
+        return
+    outbox_relay.notify()
+    logger.info(f"[booking] booking {saga.id} cancelled: {saga.failure_reason}")
+    await broker.publish(notification_channel(saga.user_id), {
+        "type": "booking-cancelled",
+        "booking_id": saga.id,
+        "consultation_id": saga.consultation_id,
+        "reason": saga.failure_reason,
+    })
+
+
+booking_consumer = EventConsumer("consultation-service", {
+    PAYMENT_SUCCEEDED: handle_payment_succeeded,
+    PAYMENT_FAILED: handle_payment_failed,
+})
+
+
+class ReservationSweeper:
+    """Releases bookings stuck in "reserving" because their request died mid-saga.
+
+    Such a saga keeps answering retries of its key with 409 and may hold
+    the doctor reserved. Rejecting it queues a doctor release, which
+    user-service ignores if the reservation never happened.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._released = 0
+
+    async def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with async_session() as session:
+                    released = await release_stale_reservations(session, BOOKING_RESERVING_TIMEOUT, BOOKING_SWEEP_BATCH)
+                if released:
+                    self._released += released
+                    logger.warning(f"[booking] released {released} bookings stuck in reserving")
+                    outbox_relay.notify()
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[booking] sweeping stale reservations failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict:
+        return {"released": self._released}
+
+
+reservation_sweeper = ReservationSweeper(BOOKING_SWEEP_INTERVAL)
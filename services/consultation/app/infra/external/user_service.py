@@ -1,77 +1,42 @@
+import asyncio
 import httpx
+from typing import Dict, Iterable, List, Optional
+from core.http_client import user_service_client
+from core.profile_cache import profile_lru
 
-USER_SERVICE_URL = "http://user-service:8000"
+USER_BULK_BATCH = 500
 
-async def get_user_details(user_id: int) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{USER_SERVICE_URL}/get_user_details_by_id/{user_id}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f"User not found or error in user-service: {e}")
+async def _fetch_users_batch(ids: List[int]) -> Dict[int, dict]:
+    try:
+        response = await user_service_client.post("/get_users_details_by_ids", json={"ids": ids})
+        response.raise_for_status()
+        return {int(user_id): details for user_id, details in response.json().items()}
+    except httpx.RequestError as e:
+        print(f"HTTPX Request error: {e}")
+    except httpx.HTTPStatusError as e:
+        print(f"User not found or error in user-service: {e}")
     return {}
 
-async def fetch_fees_from_doctor(psychologist_id: int) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{USER_SERVICE_URL}/get_fees_of_doctor/{psychologist_id}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f"User not found or error in user-service: {e}")
-    return {}
-
-async def get_minimal_user_details(user_id: int) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{USER_SERVICE_URL}/get_user_details_by_id/{user_id}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f"User not found or error in user-service: {e}")
-    return {}
-
-async def get_doctor_details(psychologist_id: int) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{USER_SERVICE_URL}/get_doctor_details_by_id/{psychologist_id}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f"User not found or error in user-service: {e}")
-    return {}
+async def get_users_details_bulk(user_ids: Iterable[int]) -> Dict[int, dict]:
+    ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    if not ids:
+        return {}
+    profiles = profile_lru.get_many("bulk", ids)
+    missing = [user_id for user_id in ids if user_id not in profiles]
+    if not missing:
+        return profiles
+    # user-service caps a bulk lookup at USER_BULK_BATCH ids
+    batches = [missing[i:i + USER_BULK_BATCH] for i in range(0, len(missing), USER_BULK_BATCH)]
+    for fetched in await asyncio.gather(*(_fetch_users_batch(batch) for batch in batches)):
+        for user_id, details in fetched.items():
+            profiles[user_id] = details
+            profile_lru.set("bulk", user_id, details)
+    return profiles
 
-async def change_doctor_availability(data: dict,status) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.patch(f"{USER_SERVICE_URL}/update_psychologist_for_consultaion/{data['psychologist_id']}/{status}",json=data)
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-            return {"status": False, "error": str(e)}
-        except httpx.HTTPStatusError as e:
-            print(f"User not found or error in user-service: {e}")
-            return {"status": False, "error": str(e)}
-        
-async def check_doctor_availability(data: dict) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{USER_SERVICE_URL}/check_doctor_availability/{data['psychologist_id']}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-            return  False
-        except httpx.HTTPStatusError as e:
-            print(f"User not found or error in user-service: {e}")
-            return False
+async def reserve_doctor(psychologist_id: int, booking_id: int) -> Optional[int]:
+    """Mark the doctor busy for a booking and return their fee, or None if they were not available."""
+    response = await user_service_client.post(f"/reserve_doctor/{psychologist_id}", json={"booking_id": booking_id})
+    if response.status_code == 409:
+        return None
+    response.raise_for_status()
+    return response.json()["fees"]
@@ -0,0 +1,405 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+import aiofiles
+from fastapi import HTTPException, UploadFile, status
+from redis.exceptions import RedisError
+from core.redis import redis_client
+from crud.crud import save_recording_database
+from dependencies.database import async_session
+
+logger = logging.getLogger("uvicorn.error")
+
+RECORDINGS_DIR = "recordings"
+os.makedirs(RECORDINGS_DIR, exist_ok=True)
+
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+RECORDING_WORKERS = int(os.getenv("RECORDING_WORKERS", 2))
+FFMPEG_TIMEOUT = float(os.getenv("RECORDING_FFMPEG_TIMEOUT", 15 * 60))
+JOB_STATUS_TTL = int(os.getenv("RECORDING_JOB_TTL", 24 * 60 * 60))
+SESSION_TTL = int(os.getenv("RECORDING_SESSION_TTL", 24 * 60 * 60))
+JANITOR_INTERVAL = float(os.getenv("RECORDING_JANITOR_INTERVAL", 15 * 60))
+JOB_QUEUE = "recording:jobs"
+PROCESSING_QUEUE = "recording:jobs:processing"
+JANITOR_LOCK = "recording:janitor"
+HLS_DIR = "hls"
+HLS_ENABLED = os.getenv("RECORDING_HLS", "true").lower() == "true"
+HLS_SEGMENT_SECONDS = int(os.getenv("RECORDING_HLS_SEGMENT_SECONDS", 2))
+
+
+def job_key(job_id: str) -> str:
+    return f"recording:job:{job_id}"
+
+
+def session_key(session_id: str) -> str:
+    return f"recording:session:{session_id}"
+
+
+def chunks_key(session_id: str) -> str:
+    return f"recording:chunks:{session_id}"
+
+
+async def save_chunk(file: UploadFile, path: Path) -> int:
+    """Stream an uploaded chunk to disk in fixed-size blocks, returning bytes written."""
+    written = 0
+    async with aiofiles.open(path, "wb") as out:
+        while True:
+            block = await file.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            await out.write(block)
+            written += len(block)
+    return written
+
+
+class RecordingRegistry:
+    """Upload sessions and their chunks, kept in Redis so any worker can take the next chunk.
+
+    Each chunk is stored as ``chunk_<sequence>.webm`` under the session
+    directory and recorded in ``recording:chunks:<session>`` as
+    sequence -> {path, size}. Re-sending a sequence that is already stored
+    is a no-op, so clients can retry or resume after reading ``describe``.
+    Clients that send no sequence get the next one allocated for them.
+    """
+
+    async def store_chunk(self, session_id: str, session_dir: Path, file: UploadFile, sequence: Optional[int] = None) -> Dict:
+        meta_key, chunk_key = session_key(session_id), chunks_key(session_id)
+        try:
+            meta = await redis_client.hgetall(meta_key)
+            if meta.get("state") == "finalizing":
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Recording is already being finalized")
+            if sequence is None:
+                sequence = await redis_client.hincrby(meta_key, "next_sequence", 1) - 1
+            else:
+                existing = await redis_client.hget(chunk_key, str(sequence))
+                if existing:
+                    return {"sequence": sequence, "duplicate": True, **json.loads(existing)}
+        except RedisError as e:
+            logger.error(f"[recordings] registry unavailable: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Recording registry unavailable")
+
+        chunk_path = session_dir / f"chunk_{sequence:06d}.webm"
+        part_path = session_dir / f".{chunk_path.name}.{uuid.uuid4().hex}.part"
+        size = await save_chunk(file, part_path)
+        if size == 0:
+            part_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=400, detail="Empty file received")
+        await asyncio.to_thread(os.replace, part_path, chunk_path)
+
+        chunk = {"path": str(chunk_path), "size": size}
+        now = datetime.now().isoformat()
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(chunk_key, str(sequence), json.dumps(chunk))
+                pipe.hsetnx(meta_key, "created_at", now)
+                pipe.hset(meta_key, mapping={"session_dir": str(session_dir), "last_updated": now})
+                pipe.expire(chunk_key, SESSION_TTL)
+                pipe.expire(meta_key, SESSION_TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f"[recordings] failed to register chunk {sequence} of {session_id}: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Recording registry unavailable")
+        return {"sequence": sequence, "duplicate": False, **chunk}
+
+    async def describe(self, session_id: str) -> Dict:
+        meta = await redis_client.hgetall(session_key(session_id))
+        stored = await redis_client.hgetall(chunks_key(session_id))
+        sequences = sorted(int(sequence) for sequence in stored)
+        expected = sequences[-1] + 1 if sequences else 0
+        return {
+            "sessionId": session_id,
+            "state": meta.get("state", "uploading" if meta else "unknown"),
+            "receivedSequences": sequences,
+            "missingSequences": sorted(set(range(expected)) - set(sequences)),
+            "nextSequence": expected,
+            "receivedBytes": sum(json.loads(chunk)["size"] for chunk in stored.values()),
+            "jobId": meta.get("job_id"),
+            "lastUpdated": meta.get("last_updated"),
+        }
+
+    async def finalize(self, session_id: str, total_chunks: Optional[int] = None) -> Dict:
+        """Check the session is complete and mark it finalizing, returning its ordered chunks."""
+        try:
+            described = await self.describe(session_id)
+            if described["state"] == "finalizing":
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Recording is already being finalized")
+            sequences = described["receivedSequences"]
+            if not sequences:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No chunks uploaded for this recording")
+            missing = described["missingSequences"]
+            if total_chunks is not None:
+                missing = sorted(set(missing) | (set(range(total_chunks)) - set(sequences)))
+            if missing:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail={"message": "Recording has missing chunks", "missingSequences": missing},
+                )
+            if not await redis_client.hsetnx(session_key(session_id), "state", "finalizing"):
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Recording is already being finalized")
+            stored = await redis_client.hgetall(chunks_key(session_id))
+            meta = await redis_client.hgetall(session_key(session_id))
+        except RedisError as e:
+            logger.error(f"[recordings] registry unavailable: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Recording registry unavailable")
+        return {
+            "chunks": [json.loads(stored[str(sequence)])["path"] for sequence in sequences],
+            "session_dir": meta["session_dir"],
+        }
+
+    async def attach_job(self, session_id: str, job_id: str):
+        await redis_client.hset(session_key(session_id), "job_id", job_id)
+
+    async def reopen(self, session_id: str):
+        """Let the client send isFinal again after a failed job; the stored chunks are kept."""
+        await redis_client.hdel(session_key(session_id), "state")
+
+    async def forget(self, session_id: str):
+        await redis_client.delete(session_key(session_id), chunks_key(session_id))
+
+
+recording_registry = RecordingRegistry()
+
+
+class RecordingJobs:
+    """Background concat of recording chunks.
+
+    The upload handler only queues a job once the final chunk lands. Jobs
+    go through a Redis list and are moved to a processing list while a
+    worker runs ffmpeg as a child process, saves the result on the
+    consultation and records the outcome under ``recording:job:<id>``.
+    Besides the single .webm, each recording gets an HLS rendition (short
+    fMP4 segments plus an index.m3u8) under ``hls/<name>/`` so players can
+    start after the first segment and only fetch what is watched.
+    A periodic janitor requeues jobs that stalled with a dead worker and
+    removes session directories nobody has touched for SESSION_TTL.
+    """
+
+    def __init__(self, workers: int = RECORDING_WORKERS):
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._janitor: Optional[asyncio.Task] = None
+        self._local: Dict[str, Dict] = {}
+        self._completed = 0
+        self._failed = 0
+        self._last_duration_ms = 0.0
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._janitor = asyncio.create_task(self._janitor_loop())
+
+    async def stop(self):
+        # Interrupted jobs stay on the processing list and the janitor requeues them
+        tasks = self._tasks + ([self._janitor] if self._janitor else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._janitor = None
+
+    async def submit(self, session_id: str, chunks: List[str], session_dir: str, consultation_id: int) -> str:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "session_id": session_id,
+            "chunks": chunks,
+            "session_dir": session_dir,
+            "consultation_id": consultation_id,
+        }
+        await self._set_status(job_id, status="queued", consultation_id=consultation_id, chunks=len(chunks))
+        await redis_client.lpush(JOB_QUEUE, json.dumps(job))
+        await recording_registry.attach_job(session_id, job_id)
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[Dict]:
+        try:
+            raw = await redis_client.get(job_key(job_id))
+            if raw:
+                return json.loads(raw)
+        except RedisError as e:
+            logger.warning(f"[recordings] failed to read job {job_id}: {e}")
+        return self._local.get(job_id)
+
+    async def _set_status(self, job_id: str, **fields):
+        state = dict(self._local.get(job_id, {"job_id": job_id}))
+        state.update(fields, updated_at=datetime.now().isoformat())
+        self._local[job_id] = state
+        if len(self._local) > 1000:
+            self._local.pop(next(iter(self._local)))
+        try:
+            await redis_client.set(job_key(job_id), json.dumps(state), ex=JOB_STATUS_TTL)
+        except RedisError as e:
+            logger.warning(f"[recordings] failed to store job {job_id} status: {e}")
+
+    async def _worker(self):
+        while True:
+            try:
+                raw = await redis_client.blmove(JOB_QUEUE, PROCESSING_QUEUE, 5, src="RIGHT", dest="LEFT")
+            except RedisError as e:
+                logger.warning(f"[recordings] job queue unavailable: {e}")
+                await asyncio.sleep(1)
+                continue
+            if raw is None:
+                continue
+            job = json.loads(raw)
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"[recordings] job {job['job_id']} failed: {e}")
+                await self._set_status(job["job_id"], status="failed", error=str(e))
+                try:
+                    await recording_registry.reopen(job["session_id"])
+                except RedisError as e:
+                    logger.warning(f"[recordings] failed to reopen session {job['session_id']}: {e}")
+            try:
+                await redis_client.lrem(PROCESSING_QUEUE, 1, raw)
+            except RedisError as e:
+                logger.warning(f"[recordings] failed to clear job {job['job_id']} from processing: {e}")
+
+    async def _process(self, job: Dict):
+        job_id = job["job_id"]
+        started = time.perf_counter()
+        await self._set_status(job_id, status="processing")
+
+        session_dir = Path(job["session_dir"])
+        recordings_dir = session_dir.parent
+        final_filename = f"recording_{job['session_id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.webm"
+        final_path = recordings_dir / final_filename
+
+        concat_file = session_dir / "concat.txt"
+        async with aiofiles.open(concat_file, "w") as f:
+            await f.write("".join(f"file '{chunk}'\n" for chunk in job["chunks"]))
+
+        await self._concat(concat_file, final_path)
+        manifest_url = None
+        if HLS_ENABLED:
+            # Heartbeat, so the janitor can tell a long encode from a dead worker
+            await self._set_status(job_id, status="processing")
+            manifest_url = await self._package_hls(final_path)
+
+        final_url = f"/recordings/{final_filename}"
+        async with async_session() as session:
+            await save_recording_database(session, final_url, job["consultation_id"], manifest_url)
+
+        # Chunks are only dropped once the recording is saved, so a retried job can start over
+        await asyncio.to_thread(shutil.rmtree, session_dir, True)
+        await recording_registry.forget(job["session_id"])
+
+        file_size = (await asyncio.to_thread(final_path.stat)).st_size
+        self._completed += 1
+        self._last_duration_ms = (time.perf_counter() - started) * 1000
+        await self._set_status(job_id, status="completed", finalUrl=final_url, manifestUrl=manifest_url, fileSize=file_size)
+        logger.info(f"[recordings] job {job_id} combined {len(job['chunks'])} chunks into {final_filename}")
+
+    async def _concat(self, concat_file: Path, final_path: Path):
+        await self._ffmpeg(
+            "-f", "concat", "-safe", "0", "-i", str(concat_file), "-c", "copy", "-y", str(final_path),
+            output=final_path,
+        )
+
+    async def _package_hls(self, final_path: Path) -> Optional[str]:
+        """Build the HLS rendition; a failure here still leaves the .webm usable."""
+        rendition = final_path.stem
+        output_dir = Path(RECORDINGS_DIR).absolute() / HLS_DIR / rendition
+        manifest = output_dir / "index.m3u8"
+        await asyncio.to_thread(output_dir.mkdir, parents=True, exist_ok=True)
+        # Browser recordings are VP8/VP9 + Opus, HLS players want H.264 + AAC.
+        # A keyframe on every segment boundary keeps each segment independently decodable.
+        try:
+            await self._ffmpeg(
+                "-i", str(final_path),
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+                "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})", "-sc_threshold", "0",
+                "-c:a", "aac", "-b:a", "96k",
+                "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+                "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+                "-hls_segment_filename", str(output_dir / "segment_%05d.m4s"),
+                "-y", str(manifest),
+                output=manifest,
+            )
+        except (asyncio.TimeoutError, RuntimeError) as e:
+            logger.warning(f"[recordings] HLS packaging failed for {final_path.name}: {e}")
+            await asyncio.to_thread(shutil.rmtree, output_dir, True)
+            return None
+        return f"/recordings/{HLS_DIR}/{rendition}/index.m3u8"
+
+    async def _ffmpeg(self, *args: str, output: Path):
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=FFMPEG_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0 or not output.exists():
+            tail = stderr.decode(errors="replace")[-500:] if stderr else ""
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}: {tail}")
+
+    async def _janitor_loop(self):
+        while True:
+            await asyncio.sleep(JANITOR_INTERVAL)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[recordings] janitor run failed: {e}")
+
+    async def sweep(self):
+        # One worker per interval does the sweep
+        if not await redis_client.set(JANITOR_LOCK, "1", nx=True, ex=max(1, int(JANITOR_INTERVAL))):
+            return
+        await self._requeue_stalled()
+
+        root = Path(RECORDINGS_DIR)
+        session_dirs = await asyncio.to_thread(
+            lambda: [path for path in root.iterdir() if path.is_dir() and path.name != HLS_DIR]
+        )
+        now = time.time()
+        for session_dir in session_dirs:
+            if await redis_client.exists(session_key(session_dir.name)):
+                continue
+            modified = (await asyncio.to_thread(session_dir.stat)).st_mtime
+            if now - modified < SESSION_TTL:
+                continue
+            logger.info(f"[recordings] removing abandoned session directory {session_dir.name}")
+            await asyncio.to_thread(shutil.rmtree, session_dir, True)
+
+    async def _requeue_stalled(self):
+        # A live job runs at most two ffmpeg steps (concat, then HLS), each bounded by FFMPEG_TIMEOUT
+        stalled_after = 2 * FFMPEG_TIMEOUT + JANITOR_INTERVAL
+        for raw in await redis_client.lrange(PROCESSING_QUEUE, 0, -1):
+            job = json.loads(raw)
+            state = await self.status(job["job_id"])
+            updated = datetime.fromisoformat(state["updated_at"]) if state else None
+            if updated is not None and (datetime.now() - updated).total_seconds() < stalled_after:
+                continue
+            if await redis_client.lrem(PROCESSING_QUEUE, 1, raw):
+                logger.warning(f"[recordings] requeueing stalled job {job['job_id']}")
+                await self._set_status(job["job_id"], status="queued")
+                await redis_client.rpush(JOB_QUEUE, raw)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": len(self._tasks),
+            "completed": self._completed,
+            "failed": self._failed,
+            "last_duration_ms": round(self._last_duration_ms, 3),
+        }
+
+
+recording_jobs = RecordingJobs()
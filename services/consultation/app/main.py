@@ -1,10 +1,46 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from core import cloudinary_config
-from api import consultation
-app = FastAPI()
+from core.http_client import start_http_clients, close_http_clients
+from core.profile_cache import start_profile_listener, stop_profile_listener
+from core.token_cache import start_revocation_listener, stop_revocation_listener
+from signaling.rooms import broker
+from crud.chat_writer import chat_writer
+from infra.recordings import recording_jobs
+from infra.booking import booking_consumer, reservation_sweeper
+from crud.outbox import outbox_relay
+from utils.file_scan import scan_queue
+from api import consultation, metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_http_clients()
+    await start_profile_listener()
+    await start_revocation_listener()
+    await broker.start()
+    await chat_writer.start()
+    await recording_jobs.start()
+    await outbox_relay.start()
+    await booking_consumer.start()
+    await reservation_sweeper.start()
+    yield
+    await reservation_sweeper.stop()
+    await booking_consumer.stop()
+    await outbox_relay.stop()
+    await scan_queue.stop()
+    await recording_jobs.stop()
+    await chat_writer.stop()
+    await broker.stop()
+    await stop_revocation_listener()
+    await stop_profile_listener()
+    await close_http_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(consultation.router)
+app.include_router(metrics.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,4 +53,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
\ No newline at end of file
+    expose_headers=["X-Has-More"],
+)
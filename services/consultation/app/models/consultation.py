@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, ForeignKey
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Text, BigInteger, Boolean, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, String, Text, BigInteger, Boolean, ForeignKey, TIMESTAMP, Date, Numeric, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 Base = declarative_base()
 
@@ -16,11 +17,19 @@ class Consultation(Base):
     status = Column(String(20))
     duration= Column(String)
     video = Column(Text, nullable=True)
+    video_manifest = Column(Text, nullable=True)
     
     payments = relationship("Payments", back_populates="consultation", uselist=False)
     feedback = relationship('Feedback',back_populates='consultation',uselist=False)
     complaints = relationship("Complaint", back_populates="consultation", cascade="all, delete-orphan")
 
+    # Keyset pagination indexes, newest-first over (created_at, id)
+    __table_args__ = (
+        Index('ix_consultation_created_at_id', 'created_at', 'id'),
+        Index('ix_consultation_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        Index('ix_consultation_psychologist_id_created_at_id', 'psychologist_id', 'created_at', 'id'),
+    )
+
 
 class Feedback(Base):
     __tablename__='feedback'
@@ -34,6 +43,39 @@ class Feedback(Base):
     
     consultation = relationship('Consultation',back_populates='feedback',uselist=False)
 
+
+class PsychologistRating(Base):
+    __tablename__ = 'psychologist_rating'
+
+    # Running totals maintained by create_feedback, avg is derived on read
+    psychologist_id = Column(Integer, primary_key=True)
+    rating_sum = Column(BigInteger, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class PsychologistMonthlyStats(Base):
+    __tablename__ = 'psychologist_monthly_stats'
+
+    # One row per psychologist per calendar month (period is the first day of the month)
+    psychologist_id = Column(Integer, primary_key=True)
+    period = Column(Date, primary_key=True, index=True)
+    booked_sessions = Column(Integer, nullable=False, default=0)
+    gross_fees = Column(BigInteger, nullable=False, default=0)
+    platform_fees = Column(Numeric(14, 2), nullable=False, default=0)
+    completed_sessions = Column(Integer, nullable=False, default=0)
+    completed_fees = Column(BigInteger, nullable=False, default=0)
+
+
+class PsychologistMonthlyPatient(Base):
+    __tablename__ = 'psychologist_monthly_patient'
+
+    # Membership rows so distinct patient counts over any range stay exact
+    psychologist_id = Column(Integer, primary_key=True)
+    period = Column(Date, primary_key=True, index=True)
+    user_id = Column(Integer, primary_key=True)
+    completed = Column(Boolean, nullable=False, default=False)
+
 class Payments(Base):
     __tablename__ = "payments"
 
@@ -73,12 +115,20 @@ class Chat(Base):
     consultation_mapping = relationship("ConsultationMapping", back_populates="chat_messages")
     attachments = relationship("ChatAttachment", back_populates="chat_message", cascade="all, delete-orphan")
 
+    # Chat history is paged per conversation over (created_at, id)
+    __table_args__ = (
+        Index('ix_chat_consultation_map_id_created_at_id', 'consultation_map_id', 'created_at', 'id'),
+    )
+
 
 class ChatAttachment(Base):
     __tablename__ = 'chat_attachments'
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    chat_id = Column(Integer, ForeignKey('chat.id', ondelete="CASCADE"))
+    chat_id = Column(Integer, ForeignKey('chat.id', ondelete="CASCADE"), nullable=True)
+    # Set for direct uploads, which exist before the message they are attached to
+    consultation_map_id = Column(Integer, ForeignKey('consultation_mapping.id', ondelete="CASCADE"), nullable=True, index=True)
+    storage_key = Column(Text, nullable=True)
     
     # File information
     filename = Column(Text, nullable=False)
@@ -90,7 +140,7 @@ class ChatAttachment(Base):
     
     # Upload information
     uploaded_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
-    upload_status = Column(Text, default='success')  # 'success', 'failed', 'processing'
+    upload_status = Column(Text, default='success')  # 'success', 'failed', 'processing', 'pending'
     
     chat_message = relationship("Chat", back_populates="attachments")
     
@@ -102,6 +152,10 @@ class Notification(Base):
     title = Column(Text, nullable=False)
     message = Column(Text, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_notifications_created_at_id', 'created_at', 'id'),
+    )
     
 class Complaint(Base):  # corrected spelling if it's meant to be "complaint"
     __tablename__ = 'complaint'
@@ -113,4 +167,44 @@ class Complaint(Base):  # corrected spelling if it's meant to be "complaint"
     description = Column(Text)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     status = Column(String(20))
-    consultation = relationship("Consultation", back_populates="complaints")
\ No newline at end of file
+    consultation = relationship("Consultation", back_populates="complaints")
+
+    __table_args__ = (
+        Index('ix_complaint_created_at_id', 'created_at', 'id'),
+    )
+
+
+class BookingSaga(Base):
+    __tablename__ = 'booking_saga'
+
+    # reserving -> pending_payment -> confirmed, or rejected / cancelled on the way
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    idempotency_key = Column(String(100), nullable=False)
+    user_id = Column(Integer, nullable=False)
+    psychologist_id = Column(Integer, nullable=False)
+    consultation_id = Column(Integer, nullable=True)
+    fee = Column(Integer, nullable=True)
+    status = Column(String(20), nullable=False)
+    failure_reason = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'idempotency_key', name='uq_booking_saga_user_id_idempotency_key'),
+    )
+
+
+class OutboxEvent(Base):
+    __tablename__ = 'outbox_event'
+
+    # Written in the same transaction as the change it announces, published by the relay
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    event_id = Column(String(32), nullable=False, unique=True)
+    event_type = Column(String(100), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    published_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_outbox_event_unpublished', 'id', postgresql_where=published_at.is_(None)),
+    )
@@ -1,6 +1,6 @@
 # Pydantic schemas
 
-from pydantic import BaseModel, EmailStr , ConfigDict
+from pydantic import BaseModel, EmailStr , ConfigDict, Field
 from typing import Optional,List
 from datetime import date, datetime
 
@@ -47,6 +47,16 @@ class FeedbackCreationSchema(BaseModel):
     message: str
     
     
+class PsychologistIdsSchema(BaseModel):
+    ids: List[int] = Field(..., max_length=500)
+
+
+class ChatUploadSignSchema(BaseModel):
+    consultation_id: int
+    filename: str
+    content_type: str
+    size: int = Field(gt=0)
+
 class CreateNotificationSchema(BaseModel):
     title: str
     message: str
@@ -167,6 +177,7 @@ class ConsultationResponseUser(BaseModel):
     duration :Optional[str]
     user: Optional[DoctorNameWithProfileImageConsultations]
     video : Optional[str]
+    video_manifest : Optional[str] = None
     
     model_config = {
         "from_attributes": True
@@ -180,6 +191,7 @@ class ConsultationResponseUserCompliant(BaseModel):
     status :Optional[str]
     duration :Optional[str]
     video : Optional[str]
+    video_manifest : Optional[str] = None
     user: Optional[UserNameWithProfileImage]
     doctor: Optional[DoctorNameWithProfileImageConsultations]
     
@@ -210,25 +222,25 @@ class CompliantSchemaa(BaseModel):
     }
     
 class PaginatedConsultationResponse(BaseModel):
-    count: int
+    count: Optional[int]
     next: Optional[str]
     previous: Optional[str]
     results: List[ConsultationResponseUser]
     
 class AdminPaginatedConsultationResponse(BaseModel):
-    count: int
+    count: Optional[int]
     next: Optional[str]
     previous: Optional[str]
     results: List[ConsultationResponse]
     
 class PaginatedNotificationResponse(BaseModel):
-    count: int
+    count: Optional[int]
     next: Optional[str]
     previous: Optional[str]
     results: List[NotificationResponse] 
     
 class CompliantPaginatedResponse(BaseModel):
-    count: int
+    count: Optional[int]
     next: Optional[str]
     previous: Optional[str]
     results: List[CompliantSchema] 
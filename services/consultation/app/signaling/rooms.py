@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional
+from redis.exceptions import RedisError
+from core.redis import redis_client
+from signaling.websocket import Connection, delivery_stats
+
+logger = logging.getLogger("uvicorn.error")
+
+PRESENCE_TTL = int(os.getenv("ROOM_PRESENCE_TTL", 6 * 60 * 60))
+CONTROL_CHANNEL = "ws:control"
+
+
+def chat_room_channel(consultation_id: int) -> str:
+    return f"ws:chat:{consultation_id}"
+
+
+def signaling_channel(user_id: Any) -> str:
+    return f"ws:signaling:{user_id}"
+
+
+def notification_channel(user_id: Any) -> str:
+    return f"ws:notifications:{user_id}"
+
+
+class RoomBroker:
+    """Fans WebSocket traffic out across workers through Redis pub/sub.
+
+    Every worker keeps only its own sockets. Messages are always published
+    to Redis and each worker's listener delivers them to the sockets it
+    holds, so participants on different workers see the same stream in the
+    same order. A worker subscribes to a channel while it has at least one
+    local member on it. Local delivery only enqueues onto each
+    connection's outbound queue, so one slow socket never holds up the
+    listener or any other room.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._local: Dict[str, Dict[Any, Connection]] = {}
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribe_lock = asyncio.Lock()
+
+    async def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def local_members(self, channel: str) -> Dict[Any, Connection]:
+        return dict(self._local.get(channel, {}))
+
+    async def join(self, channel: str, member_id: Any, connection: Connection) -> Optional[Connection]:
+        """Register a local connection, returning the connection it replaced, if any."""
+        members = self._local.setdefault(channel, {})
+        replaced = members.get(member_id)
+        members[member_id] = connection
+        if len(members) == 1 and replaced is None:
+            await self._subscribe(channel)
+        return replaced if replaced is not connection else None
+
+    async def leave(self, channel: str, member_id: Any, connection: Connection) -> bool:
+        """Drop a local connection unless it was already replaced by a newer one."""
+        members = self._local.get(channel)
+        if not members or members.get(member_id) is not connection:
+            return False
+        del members[member_id]
+        if not members:
+            self._local.pop(channel, None)
+            await self._unsubscribe(channel)
+        return True
+
+    async def publish(self, channel: str, payload: dict, exclude: Any = None) -> int:
+        """Publish to every worker holding the channel; returns how many workers got it."""
+        published_at = time.time()
+        envelope = json.dumps(
+            {"origin": self.worker_id, "exclude": exclude, "ts": published_at, "payload": payload}, default=str
+        )
+        try:
+            return await redis_client.publish(channel, envelope)
+        except RedisError as e:
+            # Without Redis we can still serve the sockets this worker owns
+            logger.warning(f"[rooms] publish to {channel} failed, delivering locally: {e}")
+            delivered = self.deliver_local(channel, payload, exclude, published_at)
+            return 1 if delivered else 0
+
+    def deliver_local(self, channel: str, payload: dict, exclude: Any = None, published_at: Optional[float] = None) -> int:
+        # Snapshot the members and enqueue, nothing here waits on a socket
+        delivered = 0
+        for member_id, connection in list(self._local.get(channel, {}).items()):
+            if exclude is not None and member_id == exclude:
+                continue
+            if connection.send(payload, channel, published_at):
+                delivered += 1
+        return delivered
+
+    def delivery_stats(self) -> Dict[str, Dict[str, Any]]:
+        return delivery_stats.snapshot()
+
+    async def set_presence(self, channel: str, member_id: Any, value: str):
+        key = f"presence:{channel}"
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, str(member_id), value)
+                pipe.expire(key, PRESENCE_TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"[rooms] failed to record presence on {channel}: {e}")
+
+    async def clear_presence(self, channel: str, member_id: Any):
+        try:
+            await redis_client.hdel(f"presence:{channel}", str(member_id))
+        except RedisError as e:
+            logger.warning(f"[rooms] failed to clear presence on {channel}: {e}")
+
+    async def presence(self, channel: str) -> Dict[str, str]:
+        try:
+            return await redis_client.hgetall(f"presence:{channel}")
+        except RedisError as e:
+            logger.warning(f"[rooms] failed to read presence on {channel}: {e}")
+            return {str(member_id): "" for member_id in self._local.get(channel, {})}
+
+    async def _subscribe(self, channel: str):
+        async with self._subscribe_lock:
+            if self._pubsub is not None:
+                try:
+                    await self._pubsub.subscribe(channel)
+                except RedisError as e:
+                    logger.warning(f"[rooms] subscribe to {channel} failed: {e}")
+
+    async def _unsubscribe(self, channel: str):
+        async with self._subscribe_lock:
+            if self._pubsub is not None and channel not in self._local:
+                try:
+                    await self._pubsub.unsubscribe(channel)
+                except RedisError as e:
+                    logger.warning(f"[rooms] unsubscribe from {channel} failed: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._subscribe_lock:
+                    self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                    # Resubscribe to whatever local sockets are still waiting on
+                    await self._pubsub.subscribe(CONTROL_CHANNEL, *self._local.keys())
+                while True:
+                    message = await self._pubsub.get_message(timeout=1.0)
+                    if message is None or message.get("type") != "message":
+                        continue
+                    try:
+                        envelope = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    self.deliver_local(message["channel"], envelope["payload"], envelope.get("exclude"), envelope.get("ts"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[rooms] listener dropped, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                if self._pubsub is not None:
+                    try:
+                        await self._pubsub.aclose()
+                    except Exception:
+                        pass
+                    self._pubsub = None
+
+
+broker = RoomBroker()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+from fastapi import WebSocket
+
+logger = logging.getLogger("uvicorn.error")
+
+OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", 256))
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 10))
+LATENCY_SAMPLES = 500
+MAX_TRACKED_CHANNELS = 2000
+
+
+class DeliveryStats:
+    """Rolling publish-to-socket latency per channel."""
+
+    def __init__(self):
+        self._samples: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._dropped: Dict[str, int] = {}
+
+    def record(self, channel: str, seconds: float):
+        samples = self._samples.get(channel)
+        if samples is None:
+            samples = self._samples[channel] = deque(maxlen=LATENCY_SAMPLES)
+            while len(self._samples) > MAX_TRACKED_CHANNELS:
+                stale, _ = self._samples.popitem(last=False)
+                self._dropped.pop(stale, None)
+        else:
+            self._samples.move_to_end(channel)
+        samples.append(seconds)
+
+    def record_drop(self, channel: str):
+        self._dropped[channel] = self._dropped.get(channel, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for channel, samples in self._samples.items():
+            ordered = sorted(samples)
+            stats[channel] = {
+                "samples": len(ordered),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+                "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+                "dropped_connections": self._dropped.get(channel, 0),
+            }
+        return stats
+
+
+delivery_stats = DeliveryStats()
+
+
+class Connection:
+    """A WebSocket with a bounded outbound queue drained by its own writer task.
+
+    ``send`` never waits on the network: it enqueues and returns. If the
+    client cannot keep up and the queue fills, the connection is closed
+    rather than letting it hold back anyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, label: str, max_queue: int = OUTBOUND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.label = label
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self) -> "Connection":
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+        return self
+
+    def send(self, payload: dict, channel: Optional[str] = None, published_at: Optional[float] = None) -> bool:
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait((payload, channel, published_at or time.time()))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"[ws] {self.label} outbound queue full, dropping slow connection")
+            if channel:
+                delivery_stats.record_drop(channel)
+            asyncio.create_task(self.close(code=1013, reason="Client too slow"))
+            return False
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            if self.websocket.client_state.name != "DISCONNECTED":
+                await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _write_loop(self):
+        try:
+            while True:
+                payload, channel, published_at = await self._queue.get()
+                await asyncio.wait_for(self.websocket.send_json(payload), timeout=SEND_TIMEOUT)
+                if channel:
+                    delivery_stats.record(channel, max(0.0, time.time() - published_at))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info(f"[ws] {self.label} writer stopped: {e}")
+            await self.close(code=1011, reason="Send failed")
@@ -0,0 +1,80 @@
+import mimetypes
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import FileResponse
+
+FILE_ACCEL_REDIRECT = os.getenv("FILE_ACCEL_REDIRECT", "false").lower() == "true"
+FILE_CACHE_CONTROL = os.getenv("FILE_CACHE_CONTROL", "private, max-age=86400")
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    # Same "<mtime>-<size>" hex form nginx uses, so validators survive the X-Accel hand-off
+    return f'"{int(stat_result.st_mtime):x}-{stat_result.st_size:x}"'
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def serve_file(
+    request: Request,
+    path: Path,
+    *,
+    accel_location: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    not_found: str = "File not found",
+) -> Response:
+    """Serve a stored file with validators, conditional GETs and byte ranges.
+
+    FileResponse answers Range / If-Range requests with 206s. With
+    FILE_ACCEL_REDIRECT on, the body is left to nginx through an internal
+    ``accel_location`` instead, once the route has done its own checks.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found)
+
+    etag = file_etag(stat_result)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": FILE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if FILE_ACCEL_REDIRECT:
+        headers["X-Accel-Redirect"] = f"{accel_location.rstrip('/')}/{quote(path.name)}"
+        if filename:
+            headers["Content-Disposition"] = f"inline; filename*=utf-8''{quote(filename)}"
+        return Response(media_type=media_type, headers=headers)
+
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        content_disposition_type="inline",
+        stat_result=stat_result,
+        headers=headers,
+    )
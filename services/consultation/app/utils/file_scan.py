@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import os
+import struct
+from typing import AsyncIterator, Dict, Optional, Set
+
+logger = logging.getLogger("uvicorn.error")
+
+SNIFF_BYTES = 4096
+SCANNER_BACKEND = os.getenv("SCANNER_BACKEND", "clamd").lower()
+CLAMD_HOST = os.getenv("CLAMD_HOST", "clamav")
+CLAMD_PORT = int(os.getenv("CLAMD_PORT", 3310))
+CLAMD_TIMEOUT = float(os.getenv("CLAMD_TIMEOUT", 30))
+# clamd's StreamMaxLength defaults to 25 MB per INSTREAM chunk stream; send it in small pieces
+CLAMD_CHUNK_SIZE = 64 * 1024
+
+EICAR = b"X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Container format from the leading magic number, or "text" / None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head.startswith(b"RIFF") and len(head) >= 12:
+        return {b"WEBP": "webp", b"AVI ": "avi", b"WAVE": "wav"}.get(head[8:12])
+    if head.startswith(b"BM"):
+        return "bmp"
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head.startswith(b"Rar!\x1a\x07"):
+        return "rar"
+    if head.startswith(b"7z\xbc\xaf\x27\x1c"):
+        return "7z"
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        return "ole"
+    if head.startswith(b"{\\rtf"):
+        return "rtf"
+    if head[4:8] == b"ftyp":
+        return "ftyp"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "ebml"
+    if head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "asf"
+    if head.startswith(b"FLV"):
+        return "flv"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith(b"ID3"):
+        return "id3"
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0:
+        return "adts"
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "mpeg_audio"
+    if head.startswith((b"MZ", b"\x7fELF", b"#!")):
+        return "executable"
+    if head and b"\x00" not in head:
+        # The block may end halfway through a multi-byte character
+        sample = head[:-3] if len(head) > 3 else head
+        try:
+            sample.decode("utf-8")
+            return "text"
+        except UnicodeDecodeError:
+            return None
+    return None
+
+
+EXTENSION_FORMATS = {
+    "jpg": {"jpeg"}, "jpeg": {"jpeg"}, "png": {"png"}, "gif": {"gif"}, "webp": {"webp"}, "bmp": {"bmp"},
+    "mp4": {"ftyp"}, "mov": {"ftyp"}, "m4a": {"ftyp"}, "avi": {"avi"}, "wmv": {"asf"}, "flv": {"flv"},
+    "webm": {"ebml"}, "mp3": {"id3", "mpeg_audio"}, "wav": {"wav"}, "ogg": {"ogg"}, "aac": {"adts", "id3"},
+    "pdf": {"pdf"}, "doc": {"ole"}, "docx": {"zip"}, "odt": {"zip"}, "rtf": {"rtf"}, "txt": {"text"},
+    "zip": {"zip"}, "rar": {"rar"}, "7z": {"7z"},
+}
+
+
+def content_matches(head: bytes, extension: str) -> bool:
+    detected = sniff_format(head)
+    expected = EXTENSION_FORMATS.get(extension.lower())
+    if expected is None:
+        return detected != "executable"
+    return detected in expected
+
+
+class ScanError(Exception):
+    pass
+
+
+class Scanner:
+    """Streams a file through a malware scanner. ``scan`` returns the signature found, or None."""
+
+    async def scan(self, blocks: AsyncIterator[bytes]) -> Optional[str]:
+        raise NotImplementedError
+
+
+class ClamdScanner(Scanner):
+    """clamd INSTREAM over TCP: length-prefixed chunks, a zero-length terminator, one reply line."""
+
+    def __init__(self, host: str = CLAMD_HOST, port: int = CLAMD_PORT, timeout: float = CLAMD_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    async def scan(self, blocks: AsyncIterator[bytes]) -> Optional[str]:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ScanError(f"clamd unreachable: {e}")
+        try:
+            writer.write(b"zINSTREAM\0")
+            async for block in blocks:
+                for start in range(0, len(block), CLAMD_CHUNK_SIZE):
+                    piece = block[start:start + CLAMD_CHUNK_SIZE]
+                    writer.write(struct.pack("!L", len(piece)) + piece)
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+            writer.write(struct.pack("!L", 0))
+            await asyncio.wait_for(writer.drain(), self.timeout)
+            reply = await asyncio.wait_for(reader.readuntil(b"\0"), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            raise ScanError(f"clamd scan failed: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+        result = reply.rstrip(b"\0").decode(errors="replace")
+        if result.endswith(" OK"):
+            return None
+        if result.endswith(" FOUND"):
+            return result.split(": ", 1)[-1][: -len(" FOUND")]
+        raise ScanError(result)
+
+
+class FakeScanner(Scanner):
+    """Flags the EICAR test string, for development and tests without clamd."""
+
+    async def scan(self, blocks: AsyncIterator[bytes]) -> Optional[str]:
+        tail = b""
+        async for block in blocks:
+            window = tail + block
+            if EICAR in window:
+                return "Eicar-Test-Signature"
+            tail = window[-len(EICAR):]
+        return None
+
+
+def get_scanner() -> Optional[Scanner]:
+    if SCANNER_BACKEND == "fake":
+        return FakeScanner()
+    if SCANNER_BACKEND in ("none", "off", "false"):
+        return None
+    return ClamdScanner()
+
+
+class ScanQueue:
+    """Runs scans as background tasks, at most SCAN_CONCURRENCY at a time.
+
+    Uploads never wait on it. ``on_verdict`` is called with the attachment
+    id and the reason once a file is flagged.
+    """
+
+    def __init__(self, scanner: Optional[Scanner], concurrency: int = int(os.getenv("SCAN_CONCURRENCY", 4))):
+        self.scanner = scanner
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._scanned = 0
+        self._flagged = 0
+        self._errors = 0
+
+    def submit(self, attachment_id: int, blocks, on_verdict, extension: Optional[str] = None) -> bool:
+        """Scan ``blocks()`` in the background; with ``extension`` the first block is also sniffed."""
+        if self.scanner is None:
+            return False
+        task = asyncio.create_task(self._run(attachment_id, blocks, on_verdict, extension))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _sniffed(self, blocks: AsyncIterator[bytes], extension: str, verdict: Dict) -> AsyncIterator[bytes]:
+        first = True
+        async for block in blocks:
+            if first and not content_matches(block[:SNIFF_BYTES], extension):
+                verdict["mismatch"] = True
+            first = False
+            yield block
+
+    async def _run(self, attachment_id: int, blocks, on_verdict, extension: Optional[str]):
+        async with self._semaphore:
+            verdict = {}
+            stream = blocks() if extension is None else self._sniffed(blocks(), extension, verdict)
+            try:
+                signature = await self.scanner.scan(stream)
+            except Exception as e:
+                self._errors += 1
+                logger.warning(f"[scan] attachment {attachment_id} could not be scanned: {e}")
+                return
+            if not signature and verdict.get("mismatch"):
+                signature = "Content does not match file type"
+            self._scanned += 1
+            if signature:
+                self._flagged += 1
+                logger.warning(f"[scan] attachment {attachment_id} flagged: {signature}")
+                try:
+                    await on_verdict(attachment_id, signature)
+                except Exception as e:
+                    logger.error(f"[scan] failed to quarantine attachment {attachment_id}: {e}")
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": type(self.scanner).__name__ if self.scanner else None,
+            "in_flight": len(self._tasks),
+            "scanned": self._scanned,
+            "flagged": self._flagged,
+            "errors": self._errors,
+        }
+
+
+scan_queue = ScanQueue(get_scanner())
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, List, Optional, Tuple
+import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
+import cloudinary.uploader
+import cloudinary.utils
+from fastapi import UploadFile
+from core.http_client import media_client
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary").lower()
+STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", 8))
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "uploads/media")
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "/media")
+READ_BLOCK_SIZE = 1024 * 1024
+# Cloudinary's chunked upload needs chunks of at least 5 MB
+UPLOAD_CHUNK_SIZE = max(5 * 1024 * 1024, int(os.getenv("STORAGE_UPLOAD_CHUNK_SIZE", 6 * 1024 * 1024)))
+# Cloudinary refuses signed requests whose timestamp is more than an hour old
+SIGNED_UPLOAD_TTL = min(3600, int(os.getenv("STORAGE_SIGNED_UPLOAD_TTL", 3600)))
+
+# Uploads get their own bounded pool instead of competing with everything else in the default one
+_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+
+
+def _file_size(fileobj: BinaryIO) -> int:
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+class Storage:
+    """Where uploaded media ends up. ``upload`` returns the public URL."""
+
+    async def upload(self, file: UploadFile, folder: str, public_id: Optional[str] = None) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor, partial(self._upload, file.file, file.filename or "", folder, public_id)
+        )
+
+    async def upload_many(self, uploads: Iterable[Tuple[UploadFile, str]]) -> List[str]:
+        """Upload (file, folder) pairs concurrently, in the order given."""
+        return list(await asyncio.gather(*(self.upload(file, folder) for file, folder in uploads)))
+
+    def sign_upload(self, key: str, content_type: str) -> Dict:
+        """Parameters that let a client upload straight to storage under ``key``."""
+        raise NotImplementedError
+
+    async def stat(self, key: str, content_type: str) -> Optional[Dict]:
+        """{url, size} of a stored object, or None if nothing was uploaded there."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(self._stat, key, content_type))
+
+    async def stream(self, url: str) -> AsyncIterator[bytes]:
+        """Read a stored object back in blocks."""
+        async with media_client.client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for block in response.aiter_bytes(READ_BLOCK_SIZE):
+                yield block
+
+    def _upload(self, fileobj: BinaryIO, filename: str, folder: str, public_id: Optional[str]) -> str:
+        raise NotImplementedError
+
+    def _stat(self, key: str, content_type: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+
+def _resource_type(content_type: str) -> str:
+    if content_type.startswith("image/"):
+        return "image"
+    if content_type.startswith(("video/", "audio/")):
+        return "video"
+    return "raw"
+
+
+class CloudinaryStorage(Storage):
+    def sign_upload(self, key: str, content_type: str) -> Dict:
+        config = cloudinary.config()
+        timestamp = int(time.time())
+        params = {"public_id": key, "timestamp": timestamp}
+        signature = cloudinary.utils.api_sign_request(params, config.api_secret)
+        return {
+            "upload_url": f"https://api.cloudinary.com/v1_1/{config.cloud_name}/{_resource_type(content_type)}/upload",
+            "fields": {**params, "api_key": config.api_key, "signature": signature},
+            "expires_at": timestamp + SIGNED_UPLOAD_TTL,
+        }
+
+    def _stat(self, key: str, content_type: str) -> Optional[Dict]:
+        try:
+            resource = cloudinary.api.resource(key, resource_type=_resource_type(content_type))
+        except cloudinary.exceptions.NotFound:
+            return None
+        return {"url": resource["secure_url"], "size": resource["bytes"]}
+
+    def _upload(self, fileobj: BinaryIO, filename: str, folder: str, public_id: Optional[str]) -> str:
+        resource_type = "raw" if filename.lower().endswith(".pdf") else "auto"
+        options = dict(folder=folder, public_id=public_id, resource_type=resource_type, overwrite=True)
+        if _file_size(fileobj) > UPLOAD_CHUNK_SIZE:
+            # Sent in UPLOAD_CHUNK_SIZE pieces rather than as one request body
+            result = cloudinary.uploader.upload_large(fileobj, chunk_size=UPLOAD_CHUNK_SIZE, **options)
+        else:
+            result = cloudinary.uploader.upload(fileobj, **options)
+        return result["secure_url"]
+
+
+class LocalStorage(Storage):
+    """Writes to STORAGE_LOCAL_ROOT, for development and tests without Cloudinary."""
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT, public_url: str = STORAGE_PUBLIC_URL):
+        self.root = Path(root)
+        self.public_url = public_url.rstrip("/")
+
+    def _upload(self, fileobj: BinaryIO, filename: str, folder: str, public_id: Optional[str]) -> str:
+        suffix = Path(filename).suffix.lower()
+        name = f"{public_id or uuid.uuid4().hex}{suffix}"
+        target = self.root / folder / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fileobj.seek(0)
+        with open(target, "wb") as out:
+            shutil.copyfileobj(fileobj, out, UPLOAD_CHUNK_SIZE)
+        return f"{self.public_url}/{folder}/{name}"
+
+    async def stream(self, url: str) -> AsyncIterator[bytes]:
+        path = self.root / url[len(self.public_url):].lstrip("/")
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as fileobj:
+            while True:
+                block = await loop.run_in_executor(_executor, fileobj.read, READ_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+
+    def _stat(self, key: str, content_type: str) -> Optional[Dict]:
+        matches = list((self.root / key).parent.glob(f"{Path(key).name}*"))
+        if not matches:
+            return None
+        return {"url": f"{self.public_url}/{matches[0].relative_to(self.root).as_posix()}", "size": matches[0].stat().st_size}
+
+
+def get_storage() -> Storage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    return CloudinaryStorage()
+
+
+storage = get_storage()
@@ -0,0 +1,28 @@
+"""adding wallet transaction keyset index
+
+Revision ID: 7b2f94c0d8e1
+Revises: 20a90259f2a2
+Create Date: 2026-10-18 11:53:40.118302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2f94c0d8e1'
+down_revision: Union[str, None] = '20a90259f2a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_wallet_transaction_wallet_id_created_at_id', 'wallet_transaction', ['wallet_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_wallet_transaction_wallet_id_created_at_id', table_name='wallet_transaction')
@@ -0,0 +1,30 @@
+"""adding wallet transaction idempotency key
+
+Revision ID: c7e1a5d92f60
+Revises: 9a4c2e6f1b83
+Create Date: 2026-10-18 16:41:09.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e1a5d92f60'
+down_revision: Union[str, None] = '9a4c2e6f1b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('wallet_transaction', sa.Column('idempotency_key', sa.String(length=100), nullable=True))
+    op.create_index('uq_wallet_transaction_idempotency_key', 'wallet_transaction', ['idempotency_key'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_wallet_transaction_idempotency_key', table_name='wallet_transaction')
+    op.drop_column('wallet_transaction', 'idempotency_key')
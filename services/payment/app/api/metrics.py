@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from core.db_engine import db_pool_stats
+from core.token_cache import token_cache
+from crud.outbox import outbox_relay
+from infra.booking_events import booking_consumer
+from infra.reconciliation import wallet_reconciler
+from dependencies.database import engine
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "db_pool": db_pool_stats(engine),
+        "auth_tokens": token_cache.stats(),
+        "outbox": outbox_relay.stats(),
+        "events": booking_consumer.stats(),
+        "wallet_reconciliation": wallet_reconciler.stats(),
+    }
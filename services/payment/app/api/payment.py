@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status,Query
+from fastapi import APIRouter, Depends, HTTPException, status,Query,Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.concurrency import run_in_threadpool
-from typing import List
+from typing import List, Optional
 from sqlalchemy import select,update
+from sqlalchemy.exc import IntegrityError
 from dependencies.database import get_session
 import crud.crud as crud
 from schemas.payment import RazorpayOrder,WalletWithTransactionsOut,WalletBalanceOut,UserConsultationMoney,WalletWithTransactionsPagination
@@ -15,6 +16,7 @@ from crud.crud import money_to_wallet,get_wallet_balance_by_id,money_from_wallet
 import os
 from dotenv import load_dotenv
 from dependencies.get_current_user import get_current_user
+from utils.pagination import paginate
 load_dotenv()
 
 
@@ -55,6 +57,10 @@ async def get_wallet_details_with_transactions(
     user_id: int,
     page: int = Query(1, ge=1),
     limit: int = Query(10, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    cursor: bool = Query(False),
+    include_count: bool = Query(True),
     current_user: str = Depends(get_current_user),
     session: AsyncSession = Depends(get_session)
 ):
@@ -65,28 +71,27 @@ async def get_wallet_details_with_transactions(
         wallet = await crud.get_wallet_balance_by_id(session, user_id)
         if not wallet:
             raise HTTPException(status_code=404, detail="Wallet not found")
-        # Count transactions for this wallet
-        total = await crud.count_wallet_transactions(session, wallet.id)
-        offset = (page - 1) * limit
         # Get paginated transactions for this wallet
-        transactions = await crud.get_wallet_transactions_paginated(
-            session, wallet.id, skip=offset, limit=limit
+        page_data = await paginate(
+            lambda **page_args: crud.get_wallet_transactions_paginated(session, wallet.id, **page_args),
+            lambda: crud.count_wallet_transactions(session, wallet.id),
+            base_url=f"/get_wallet_details_with_transactions/{user_id}",
+            count_key=f"wallet_transaction:{wallet.id}",
+            page=page, limit=limit, after=after, before=before,
+            cursor=cursor, include_count=include_count,
         )
         # Build response
         wallet_with_transactions = WalletWithTransactionsOut(
             id=wallet.id,
             user_id=wallet.user_id,
             balance=wallet.balance,
-            wallet_transactions=transactions
+            wallet_transactions=page_data["results"]
         )
-        # Build pagination URLs (convert None to empty string for validation)
-        base_url = f"/get_wallet_details_with_transactions/{user_id}"
-        next_url = f"{base_url}?page={page + 1}&limit={limit}" if offset + limit < total else ""
-        prev_url = f"{base_url}?page={page - 1}&limit={limit}" if page > 1 else ""
+        # Pagination URLs are empty strings rather than null for validation
         response= {
-            "count": total,
-            "next": next_url,
-            "previous": prev_url,
+            "count": page_data["count"],
+            "next": page_data["next"] or "",
+            "previous": page_data["previous"] or "",
             "results": [wallet_with_transactions]  
         }
         return response
@@ -131,48 +136,46 @@ async def add_money_to_wallet_from_razorpay(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You are not authorized to add money to another user's wallet"
             )
-        await money_to_wallet(session, rzrpay_schema.user_id, rzrpay_schema.totalAmount)
+        # The payment id makes a replayed success callback a no-op
+        key = f"razorpay-{rzrpay_schema.razorpay_payment_id}" if rzrpay_schema.razorpay_payment_id else None
+        await money_to_wallet(session, rzrpay_schema.user_id, rzrpay_schema.totalAmount, key)
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
             content={"status": "success"},
         )
     except HTTPException:
         raise
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This payment is already being processed")
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Internal server error: {str(e)}"
         )
-# inter service calls--------------
 
-@router.post("/add_money_to_wallet")
-async def add_money_to_wallet(
-    rzrpay_schema: RazorpayOrder,
-    session: AsyncSession = Depends(get_session)
-):
-    try:
-        await money_to_wallet(session, rzrpay_schema.user_id, rzrpay_schema.totalAmount)
-        return JSONResponse(
-            status_code=status.HTTP_201_CREATED,
-            content={"status": "success"},
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Internal server error: {str(e)}"
-        )
-        
 @router.post("/fetch_money_from_wallet")
 async def fetch_money_from_wallet(
-    fetch_money_schema: UserConsultationMoney,session: AsyncSession = Depends(get_session)):
+    fetch_money_schema: UserConsultationMoney,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=64),
+    session: AsyncSession = Depends(get_session),
+    current_user: str = Depends(get_current_user)
+):
     try:
-        await money_from_wallet(session, fetch_money_schema.user_id, fetch_money_schema.psychologist_fee)
+        if fetch_money_schema.user_id != int(current_user["user_id"]):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You are not authorized to withdraw from another user's wallet"
+            )
+        key = f"withdraw-{fetch_money_schema.user_id}-{idempotency_key}" if idempotency_key else None
+        await money_from_wallet(session, fetch_money_schema.user_id, fetch_money_schema.psychologist_fee, key)
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
             content={"status": "success"},
         )
     except HTTPException:
         raise
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This withdrawal is already being processed")
     except Exception as e:
         raise HTTPException(    
             status_code=500, detail=f"Internal server error: {str(e)}"
         )
-    
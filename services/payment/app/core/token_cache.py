@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from redis.exceptions import RedisError
+from core.redis import redis_client
+from utils.jwt_handler import SECRET_KEY, ALGORITHM
+
+logger = logging.getLogger("uvicorn.error")
+
+# PyJWT is used when installed, python-jose otherwise
+PYJWT_AVAILABLE = importlib.util.find_spec("jwt") is not None
+if PYJWT_AVAILABLE:
+    import jwt as pyjwt
+else:
+    from jose import jwt as jose_jwt, JWTError
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+# Upper bound on how long a verified token is trusted without asking Redis again
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+AUTH_REVOCATION_CHANNEL = "auth:revoke"
+
+
+def _decode(token: str) -> Optional[Dict]:
+    if PYJWT_AVAILABLE:
+        try:
+            return pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except pyjwt.PyJWTError:
+            return None
+    try:
+        return jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+
+def is_refresh_token(claims: Dict) -> bool:
+    return bool(claims.get("refresh")) or claims.get("type") == "refresh"
+
+
+class TokenCache:
+    """In-process LRU of verified tokens, keyed by their SHA-256 digest.
+
+    A hit skips signature verification and the Redis revocation lookup.
+    Entries live until the token's ``exp`` or AUTH_TOKEN_CACHE_TTL,
+    whichever is sooner, and are dropped early when a revocation for
+    their ``jti`` or subject is published.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def get(self, digest: bytes) -> Optional[Dict]:
+        entry = self._entries.get(digest)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, digest: bytes, claims: Dict):
+        expires_at = time.time() + self.ttl
+        if isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, claims["exp"])
+        self._entries[digest] = (expires_at, claims)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def evict(self, revocation: str):
+        """Drop entries matching ``jti:<id>`` or ``sub:<user id>``."""
+        field, _, value = revocation.partition(":")
+        if field not in ("jti", "sub") or not value:
+            return
+        for digest in [d for d, (_, claims) in self._entries.items() if str(claims.get(field)) == value]:
+            del self._entries[digest]
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "pyjwt" if PYJWT_AVAILABLE else "python-jose",
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+        }
+
+
+token_cache = TokenCache(AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL)
+
+
+async def is_revoked(claims: Dict) -> bool:
+    """Checks the token's ``jti`` and the subject's logout-everywhere cutoff in Redis."""
+    keys = [f"auth:revoked:jti:{claims.get('jti')}", f"auth:revoked:sub:{claims.get('sub')}"]
+    try:
+        jti_revoked, revoked_before = await redis_client.mget(keys)
+    except RedisError as e:
+        # Fail open: tokens are short-lived and the signature was still checked
+        logger.warning(f"[auth] revocation check unavailable: {e}")
+        return False
+    if claims.get("jti") and jti_revoked:
+        return True
+    return bool(revoked_before) and float(claims.get("iat") or 0) <= float(revoked_before)
+
+
+async def verify_claims(token: str) -> Optional[Dict]:
+    """Claims of a valid, unrevoked token, or None."""
+    digest = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(digest)
+    if claims is not None:
+        return claims
+    claims = _decode(token)
+    if claims is None or await is_revoked(claims):
+        token_cache.rejected += 1
+        return None
+    token_cache.set(digest, claims)
+    return claims
+
+
+_listener: Optional[asyncio.Task] = None
+
+
+async def _listen_for_revocations():
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(AUTH_REVOCATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    token_cache.evict(str(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # A revocation may have been published while we were disconnected
+            logger.warning(f"[auth] revocation listener dropped: {e}")
+            token_cache._entries.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+async def start_revocation_listener():
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.create_task(_listen_for_revocations())
+
+
+async def stop_revocation_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
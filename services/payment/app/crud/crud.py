@@ -1,11 +1,13 @@
 from sqlalchemy.future import select
-from sqlalchemy import func
+from sqlalchemy import func, exists, text
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from schemas.payment import *
 from sqlalchemy.orm import joinedload,selectinload
 from sqlalchemy.exc import SQLAlchemyError
 from models.payment import Wallet,WalletTransaction
 from fastapi import HTTPException, status
+from utils.pagination import apply_keyset
 
 async def get_wallet_details_with_transactions_by_id(session: AsyncSession, user_id: int,skip, limit):
     result = await session.execute(
@@ -19,73 +21,117 @@ async def get_wallet_transactions_paginated(
     session: AsyncSession, 
     wallet_id: int,
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    after=None,
+    before=None,
+    keyset: bool = False
 ):
-    result = await session.execute(
-        select(WalletTransaction)
-        .where(WalletTransaction.wallet_id == wallet_id)
-        .offset(skip)
-        .limit(limit)
-    )
+    query = select(WalletTransaction).where(WalletTransaction.wallet_id == wallet_id)
+    if keyset:
+        query = apply_keyset(query, WalletTransaction.created_at, WalletTransaction.id, limit, after, before)
+    else:
+        query = query.offset(skip).limit(limit)
+    result = await session.execute(query)
     return result.scalars().all()
 
 
 async def count_wallet_transactions(session: AsyncSession, wallet_id: int):
     result = await session.execute(
         select(func.count(WalletTransaction.id))
-        .join(WalletTransaction.wallet)
-        .where(Wallet.id == wallet_id)
+        .where(WalletTransaction.wallet_id == wallet_id)
     )
     return result.scalar()
 
-async def money_to_wallet(session: AsyncSession, user_id: int, amount: float):
-    # Fetch the wallet for the user
-    result = await session.execute(select(Wallet).where(Wallet.user_id == user_id))
-    wallet = result.scalar_one_or_none()
-
-    # If wallet doesn't exist, create it
-    if not wallet:
-        wallet = Wallet(user_id=user_id, balance=0)
-        session.add(wallet)
-        await session.flush()  # To get wallet.id before using it
-
-    # Update balance
-    wallet.balance += amount
+# Both statements change the balance and append its ledger row in one round trip; the
+# wallet row stays locked only until the caller's commit right after.
+_CREDIT = text("""
+    WITH credited AS (
+        INSERT INTO wallet (user_id, balance, created_at)
+        SELECT :user_id, CAST(:amount AS integer), now()
+        WHERE NOT EXISTS (SELECT 1 FROM wallet_transaction WHERE idempotency_key = CAST(:key AS varchar))
+        ON CONFLICT (user_id) DO UPDATE SET balance = COALESCE(wallet.balance, 0) + EXCLUDED.balance
+        RETURNING id, balance
+    )
+    INSERT INTO wallet_transaction (wallet_id, transaction_amount, idempotency_key, created_at)
+    SELECT id, CAST(:amount AS integer), CAST(:key AS varchar), now() FROM credited
+    RETURNING (SELECT balance FROM credited)
+""")
 
-    # Create wallet transaction
-    wallet_trans = WalletTransaction(
-        wallet_id=wallet.id,
-        transaction_amount=amount,
+_DEBIT = text("""
+    WITH debited AS (
+        UPDATE wallet SET balance = balance - CAST(:amount AS integer)
+        WHERE user_id = :user_id AND balance >= CAST(:amount AS integer)
+          AND NOT EXISTS (SELECT 1 FROM wallet_transaction WHERE idempotency_key = CAST(:key AS varchar))
+        RETURNING id, balance
     )
-    session.add(wallet_trans)
+    INSERT INTO wallet_transaction (wallet_id, transaction_amount, idempotency_key, created_at)
+    SELECT id, -CAST(:amount AS integer), CAST(:key AS varchar), now() FROM debited
+    RETURNING (SELECT balance FROM debited)
+""")
 
-    # Commit both changes
-    await session.commit()
-    
-async def money_from_wallet(session: AsyncSession, user_id: int, amount: float):
-    # Fetch the wallet for the user
-    result = await session.execute(select(Wallet).where(Wallet.user_id == user_id))
-    wallet = result.scalar_one_or_none()
-    # Check for sufficient balance
-    if wallet.balance < amount:
+
+def _whole_amount(amount) -> int:
+    if amount is None or amount <= 0 or amount != int(amount):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Insufficient wallet balance."
+            detail="Amount must be a positive whole number."
         )
+    return int(amount)
 
-    # Update balance
-    wallet.balance -= amount
 
-    # Create wallet transaction
-    wallet_trans = WalletTransaction(
-        wallet_id=wallet.id,
-        transaction_amount=-amount,
-    )
-    session.add(wallet_trans)
+async def _current_balance(session: AsyncSession, user_id: int) -> int:
+    return await session.scalar(select(Wallet.balance).where(Wallet.user_id == user_id)) or 0
 
-    # Commit both changes
+
+async def money_to_wallet(session: AsyncSession, user_id: int, amount: float, idempotency_key: Optional[str] = None) -> int:
+    """Credit the wallet, creating it if needed, and return the new balance.
+
+    A key that already has a ledger row is not applied again. Two requests
+    racing with the same key fail on its unique index rather than both
+    applying, and the caller sees an IntegrityError.
+    """
+    amount = _whole_amount(amount)
+    balance = await session.scalar(_CREDIT, {"user_id": user_id, "amount": amount, "key": idempotency_key})
+    if balance is None:
+        balance = await _current_balance(session, user_id)
+    await session.commit()
+    return balance
+
+
+async def money_from_wallet(session: AsyncSession, user_id: int, amount: float, idempotency_key: Optional[str] = None) -> int:
+    """Debit the wallet if it holds enough, and return the new balance. Keys behave as in ``money_to_wallet``."""
+    amount = _whole_amount(amount)
+    balance = await session.scalar(_DEBIT, {"user_id": user_id, "amount": amount, "key": idempotency_key})
+    if balance is None:
+        if idempotency_key is None or not await session.scalar(
+            select(exists().where(WalletTransaction.idempotency_key == idempotency_key))
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Insufficient wallet balance."
+            )
+        balance = await _current_balance(session, user_id)
     await session.commit()
-    
+    return balance
+
+
+async def find_ledger_drift(session: AsyncSession, limit: int = 100):
+    """Wallets whose balance differs from the sum of their transactions."""
+    ledger = (
+        select(WalletTransaction.wallet_id, func.sum(WalletTransaction.transaction_amount).label("total"))
+        .group_by(WalletTransaction.wallet_id)
+        .subquery()
+    )
+    expected = func.coalesce(ledger.c.total, 0)
+    result = await session.execute(
+        select(Wallet.id, Wallet.user_id, Wallet.balance, expected.label("ledger_balance"))
+        .outerjoin(ledger, ledger.c.wallet_id == Wallet.id)
+        .where(func.coalesce(Wallet.balance, 0) != expected)
+        .order_by(Wallet.id)
+        .limit(limit)
+    )
+    return result.all()
+
 async def get_wallet_balance_by_id(session: AsyncSession, user_id: int):
     result = await session.execute(
         select(Wallet).where(Wallet.user_id == user_id)
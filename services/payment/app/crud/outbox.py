@@ -0,0 +1,15 @@
+from typing import Dict, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.events import OutboxRelay, new_event_id
+from dependencies.database import async_session
+from models.payment import OutboxEvent
+
+
+def add_outbox_event(session: AsyncSession, event_type: str, payload: Dict, event_id: Optional[str] = None) -> str:
+    """Queue an event to be published once the surrounding transaction commits."""
+    event_id = event_id or new_event_id()
+    session.add(OutboxEvent(event_id=event_id, event_type=event_type, payload=payload))
+    return event_id
+
+
+outbox_relay = OutboxRelay(async_session, OutboxEvent)
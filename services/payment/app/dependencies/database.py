@@ -1,12 +1,13 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
+from core.db_engine import make_engine
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv('PAYMENT_DATABASE_URL')
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = make_engine(DATABASE_URL)
 
 async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
@@ -0,0 +1,64 @@
+import logging
+from typing import Dict
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from core.events import EventConsumer
+from crud.crud import money_from_wallet, money_to_wallet
+from crud.outbox import add_outbox_event, outbox_relay
+from dependencies.database import async_session
+from models.payment import ProcessedEvent
+
+logger = logging.getLogger("uvicorn.error")
+
+PAYMENT_REQUESTED = "booking.payment_requested"
+PAYMENT_SUCCEEDED = "booking.payment_succeeded"
+PAYMENT_FAILED = "booking.payment_failed"
+CONSULTATION_COMPLETED = "consultation.completed"
+
+
+async def debit_for_booking(event_id: str, payload: Dict):
+    """Debit the wallet once per request; the processed marker and the reply commit with the debit."""
+    async with async_session() as session:
+        if await session.get(ProcessedEvent, event_id) is not None:
+            return
+        session.add(ProcessedEvent(event_id=event_id, event_type=PAYMENT_REQUESTED, outcome="succeeded"))
+        add_outbox_event(session, PAYMENT_SUCCEEDED, {"booking_id": payload["booking_id"]}, f"{event_id}-succeeded")
+        try:
+            await money_from_wallet(session, payload["user_id"], payload["amount"], f"booking-{payload['booking_id']}")
+        except HTTPException as e:
+            await session.rollback()
+            logger.info(f"[booking] debit for booking {payload['booking_id']} failed: {e.detail}")
+            session.add(ProcessedEvent(event_id=event_id, event_type=PAYMENT_REQUESTED, outcome="failed", detail=e.detail))
+            add_outbox_event(
+                session, PAYMENT_FAILED, {"booking_id": payload["booking_id"], "reason": e.detail}, f"{event_id}-failed"
+            )
+            await session.commit()
+        except IntegrityError:
+            # Another consumer got to the same delivery first, its reply is already queued
+            await session.rollback()
+            return
+    outbox_relay.notify()
+
+
+async def credit_doctor(event_id: str, payload: Dict):
+    """Pay the doctor's share of a completed consultation into their wallet, once."""
+    if not payload.get("doctor_amount"):
+        return
+    async with async_session() as session:
+        if await session.get(ProcessedEvent, event_id) is not None:
+            return
+        session.add(ProcessedEvent(event_id=event_id, event_type=CONSULTATION_COMPLETED, outcome="succeeded"))
+        try:
+            await money_to_wallet(
+                session, payload["psychologist_id"], payload["doctor_amount"], f"payout-{payload['consultation_id']}"
+            )
+        except IntegrityError:
+            await session.rollback()
+            if await session.get(ProcessedEvent, event_id) is None:
+                raise
+
+
+booking_consumer = EventConsumer("payment-service", {
+    PAYMENT_REQUESTED: debit_for_booking,
+    CONSULTATION_COMPLETED: credit_doctor,
+})
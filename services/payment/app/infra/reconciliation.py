@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+from sqlalchemy import func, select
+from crud.crud import find_ledger_drift
+from dependencies.database import async_session
+
+logger = logging.getLogger("uvicorn.error")
+
+WALLET_RECONCILE_INTERVAL = float(os.getenv("WALLET_RECONCILE_INTERVAL", 3600))
+WALLET_RECONCILE_LIMIT = int(os.getenv("WALLET_RECONCILE_LIMIT", 100))
+# Any constant works, it only has to be the same in every worker
+WALLET_RECONCILE_LOCK = 7315002
+
+
+class WalletReconciler:
+    """Periodically checks every wallet balance against its transaction ledger.
+
+    Balances and ledger rows are written by the same statement, so any
+    drift points at a write that bypassed ``crud`` or at data from before
+    that was the case. Drift is reported, not repaired: the ledger is the
+    record, and fixing a balance is left to whoever looks at the report.
+    One worker runs each pass, the others skip it on the advisory lock.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._runs = 0
+        self._skipped = 0
+        self._last_run_at: Optional[float] = None
+        self._last_drift = []
+
+    async def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def reconcile(self) -> Optional[list]:
+        """One pass; None if another worker holds the lock."""
+        async with async_session() as session:
+            async with session.begin():
+                if not await session.scalar(select(func.pg_try_advisory_xact_lock(WALLET_RECONCILE_LOCK))):
+                    self._skipped += 1
+                    return None
+                drift = await find_ledger_drift(session, WALLET_RECONCILE_LIMIT)
+        self._runs += 1
+        self._last_run_at = time.time()
+        self._last_drift = [
+            {"wallet_id": row.id, "user_id": row.user_id, "balance": row.balance, "ledger_balance": int(row.ledger_balance)}
+            for row in drift
+        ]
+        for entry in self._last_drift:
+            logger.warning(
+                f"[wallet] wallet {entry['wallet_id']} of user {entry['user_id']} holds {entry['balance']}, "
+                f"its ledger sums to {entry['ledger_balance']}"
+            )
+        return self._last_drift
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[wallet] reconciliation failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict:
+        return {
+            "runs": self._runs,
+            "skipped": self._skipped,
+            "last_run_at": self._last_run_at,
+            "drifted_wallets": len(self._last_drift),
+        }
+
+
+wallet_reconciler = WalletReconciler(WALLET_RECONCILE_INTERVAL)
@@ -1,9 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api import payment
+from api import payment, metrics
+from core.token_cache import start_revocation_listener, stop_revocation_listener
+from crud.outbox import outbox_relay
+from infra.booking_events import booking_consumer
+from infra.reconciliation import wallet_reconciler
 from fastapi.middleware.cors import CORSMiddleware
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_revocation_listener()
+    await outbox_relay.start()
+    await booking_consumer.start()
+    await wallet_reconciler.start()
+    yield
+    await wallet_reconciler.stop()
+    await booking_consumer.stop()
+    await outbox_relay.stop()
+    await stop_revocation_listener()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(payment.router)
+app.include_router(metrics.router)
 
 
 app.add_middleware(
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, ForeignKey,TIMESTAMP,func
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey,TIMESTAMP,func,Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -19,7 +20,40 @@ class WalletTransaction(Base):
     id = Column(Integer, primary_key=True, index=True)
     wallet_id = Column(Integer, ForeignKey("wallet.id"), nullable=False)
     transaction_amount = Column(Integer)
+    # Set by callers that may retry; a key is applied to the ledger at most once
+    idempotency_key = Column(String(100), nullable=True)
     created_at = Column(TIMESTAMP(timezone=True),default=func.now(),server_default=func.now(),nullable=False)
     wallet = relationship("Wallet", back_populates="wallet_transactions")
 
+    # Keyset pagination over a wallet's history, newest-first
+    __table_args__ = (
+        Index('ix_wallet_transaction_wallet_id_created_at_id', 'wallet_id', 'created_at', 'id'),
+        Index('uq_wallet_transaction_idempotency_key', 'idempotency_key', unique=True),
+    )
 
+
+class ProcessedEvent(Base):
+    __tablename__ = "processed_event"
+
+    # One row per consumed event, written in the same transaction as its effect
+    event_id = Column(String(64), primary_key=True)
+    event_type = Column(String(100), nullable=False)
+    outcome = Column(String(20), nullable=False)
+    detail = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True),default=func.now(),server_default=func.now(),nullable=False)
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_event"
+
+    # Written in the same transaction as the change it announces, published by the relay
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    event_id = Column(String(64), nullable=False, unique=True)
+    event_type = Column(String(100), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True),default=func.now(),server_default=func.now(),nullable=False)
+    published_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_outbox_event_unpublished', 'id', postgresql_where=published_at.is_(None)),
+    )
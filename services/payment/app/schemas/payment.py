@@ -8,6 +8,7 @@ from typing import List
 class RazorpayOrder(BaseModel):
     user_id: int
     totalAmount: float
+    razorpay_payment_id: Optional[str] = Field(None, max_length=64)
     
 class UserConsultationMoney(BaseModel):
     user_id:int
@@ -34,7 +35,7 @@ class WalletWithTransactionsOut(BaseModel):
     }
     
 class WalletWithTransactionsPagination(BaseModel):
-    count: int
+    count: Optional[int]
     next: str
     previous: str
     results: List[WalletWithTransactionsOut] = []
@@ -0,0 +1,127 @@
+import base64
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+COUNT_CACHE_TTL = float(os.getenv("PAGINATION_COUNT_CACHE_TTL", 30))
+
+Cursor = Tuple[datetime, int]
+
+_count_cache: Dict[str, Tuple[float, int]] = {}
+
+
+def encode_cursor(row) -> str:
+    payload = json.dumps([row.created_at.isoformat(), row.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Cursor]:
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+def apply_keyset(query, created_col, id_col, limit: int, after: Optional[Cursor] = None, before: Optional[Cursor] = None):
+    """Newest-first keyset page over (created_at, id), fetching one extra row to detect more."""
+    if before:
+        return (
+            query.where(tuple_(created_col, id_col) > tuple_(*before))
+            .order_by(created_col.asc(), id_col.asc())
+            .limit(limit + 1)
+        )
+    if after:
+        query = query.where(tuple_(created_col, id_col) < tuple_(*after))
+    return query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1)
+
+
+def keyset_page(rows, limit: int, after: Optional[Cursor] = None, before: Optional[Cursor] = None):
+    """Trim the extra row and work out the (rows, next_token, previous_token) triple."""
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+        next_token = encode_cursor(rows[-1]) if rows else None
+        prev_token = encode_cursor(rows[0]) if rows and has_more else None
+        return rows, next_token, prev_token
+    next_token = encode_cursor(rows[-1]) if rows and has_more else None
+    prev_token = encode_cursor(rows[0]) if rows and after else None
+    return rows, next_token, prev_token
+
+
+def page_url(base: str, **params) -> str:
+    query = urlencode({key: value for key, value in params.items() if value is not None})
+    return f"{base}?{query}" if query else base
+
+
+async def cached_count(key: str, loader: Callable[[], Awaitable[int]]) -> int:
+    # Totals only need to be roughly right while paging, recount at most every COUNT_CACHE_TTL
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = await loader()
+    _count_cache[key] = (now + COUNT_CACHE_TTL, total)
+    if len(_count_cache) > 10000:
+        for stale in [k for k, (expires, _) in _count_cache.items() if expires <= now]:
+            _count_cache.pop(stale, None)
+    return total
+
+
+async def paginate(
+    fetch: Callable[..., Awaitable[Any]],
+    count: Callable[[], Awaitable[int]],
+    *,
+    base_url: str,
+    count_key: str,
+    page: int,
+    limit: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    cursor: bool = False,
+    include_count: bool = True,
+    params: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Build a {count, next, previous, results} page in offset or cursor mode.
+
+    Offset mode (the default) keeps the page/limit URLs. Passing ``cursor``,
+    ``after`` or ``before`` switches to keyset paging over (created_at, id),
+    where the total comes from a short-lived cache. With ``include_count``
+    off no COUNT(*) runs at all and ``count`` is null.
+    """
+    params = dict(params or {})
+    if not include_count:
+        params["include_count"] = "false"
+    after_cursor, before_cursor = decode_cursor(after), decode_cursor(before)
+
+    if cursor or after_cursor or before_cursor:
+        rows = await fetch(limit=limit, after=after_cursor, before=before_cursor, keyset=True)
+        results, next_token, prev_token = keyset_page(rows, limit, after_cursor, before_cursor)
+        total = await cached_count(count_key, count) if include_count else None
+        next_url = page_url(base_url, after=next_token, limit=limit, **params) if next_token else None
+        prev_url = page_url(base_url, before=prev_token, limit=limit, **params) if prev_token else None
+    else:
+        offset = (page - 1) * limit
+        if include_count:
+            total = await count()
+            results = await fetch(skip=offset, limit=limit)
+            has_more = offset + limit < total
+        else:
+            total = None
+            rows = list(await fetch(skip=offset, limit=limit + 1))
+            has_more = len(rows) > limit
+            results = rows[:limit]
+        next_url = page_url(base_url, page=page + 1, limit=limit, **params) if has_more else None
+        prev_url = page_url(base_url, page=page - 1, limit=limit, **params) if page > 1 else None
+
+    return {"count": total, "next": next_url, "previous": prev_url, "results": list(results)}
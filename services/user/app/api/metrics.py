@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from core.http_client import http_pool_stats
+from core.db_engine import db_pool_stats
+from dependencies.database import engine
+from utility.security import password_hasher
+from utility.google_auth import google_verifier
+from core.token_cache import token_cache
+from infra.booking_events import booking_consumer
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "http_pools": http_pool_stats(),
+        "db_pool": db_pool_stats(engine),
+        "password_hashing": password_hasher.stats(),
+        "google_certs": google_verifier.key_set.stats(),
+        "auth_tokens": token_cache.stats(),
+        "events": booking_consumer.stats(),
+    }
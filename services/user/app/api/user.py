@@ -1,28 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, status,Form, File,UploadFile,BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.concurrency import run_in_threadpool
-from typing import Optional
-from dependencies.database import get_session
+from typing import Optional, Dict
+from dependencies.database import get_session, async_session
 import crud.crud as crud
 import schemas.users as users
 from utility.email_utils import send_otp_email
-from utility.security import verify_password
-from utility.cloudinary_utils import upload_to_cloudinary
+from utility.security import verify_and_update_password
+from utility.storage import storage
 from core.redis import redis_client
+from redis.exceptions import RedisError
+from infra.booking_events import remember_reservation
+from core.profile_cache import cached_profile, cached_profiles_bulk
 from utility.otp_generator import otp_generate
 from fastapi.responses import JSONResponse
-from utility.jwt_handler import create_access_token,create_refresh_token,verify_token
+from utility.jwt_handler import create_access_token,create_refresh_token
+from core.token_cache import verify_claims, is_refresh_token, revoke_token
 from fastapi.logger import logger
 from datetime import date 
 from dependencies.get_current_user import get_current_user
-from infra.external.consultation_service import get_psycholgist_rating
-from asyncio import gather
+from infra.external.consultation_service import get_psychologist_ratings_bulk
 import logging
 from fastapi import Request
 import os
 from fastapi import Query
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+from utility.google_auth import google_verifier
 from config.config import Settings 
 
 settings = Settings()
@@ -45,6 +46,8 @@ async def create_user(
         await redis_client.set(f"otp:{user.email_address}", otp, ex=300)
         send_otp_email.delay(user.email_address, otp)
         return new_user
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something Went Wrong")
@@ -80,11 +83,7 @@ async def google_login(
     if not credential:
         raise HTTPException(status_code=400, detail="No credential provided")
     try:
-        id_info = id_token.verify_oauth2_token(
-            credential,
-            google_requests.Request(),
-            settings.google_client_id
-        )
+        id_info = await google_verifier.verify(credential)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid Google token")
     email = id_info.get("email")
@@ -154,7 +153,17 @@ async def verify_email_otp(otp_schema:users.OtpVerification,session: AsyncSessio
 @router.post('/login')
 async def login(    login_schema: users.LoginSchema, session: AsyncSession = Depends(get_session)):
     user_details = await crud.get_user_by_email(session, login_schema.email)
-    if user_details and verify_password(login_schema.password, user_details.password):
+    verified, new_hash = (
+        await verify_and_update_password(login_schema.password, user_details.password)
+        if user_details else (False, None)
+    )
+    if verified:
+        if new_hash:
+            # Stored hash was made at a different BCRYPT_ROUNDS, migrate it while we have the password
+            try:
+                await crud.update_password_hash(session, user_details.id, new_hash)
+            except Exception as e:
+                logger.warning(f"Failed to rehash password for user {user_details.id}: {e}")
         
         access_token = create_access_token(user_id=str(user_details.id),role=user_details.role)
         refresh_token = create_refresh_token(user_id=str(user_details.id))
@@ -242,19 +251,10 @@ async def view_psychologist(
         if not data:
             raise HTTPException(status_code=404, detail="No psychologists found")
 
-        rating_tasks = [get_psycholgist_rating(p.user_id) for p in data]
-        ratings = await gather(*rating_tasks, return_exceptions=True)
-
-        processed_ratings = []
-        for rating in ratings:
-            if isinstance(rating, Exception):
-                logger.warning("Failed to fetch rating: %s", str(rating))
-                processed_ratings.append(0.0)
-            else:
-                processed_ratings.append(rating if rating is not None else 0.0)
+        ratings = await get_psychologist_ratings_bulk(p.user_id for p in data)
 
         enriched_ratings = []
-        for i, p in enumerate(data):
+        for p in data:
             try:
                 profile_out = users.PsychologistProfileOut(
                     id=p.id,
@@ -267,7 +267,7 @@ async def view_psychologist(
                     about_me =p.about_me,
                     qualification =p.qualification,
                     user=p.user,
-                    rating=processed_ratings[i]
+                    rating=ratings.get(p.user_id) or 0.0
                 )
                 enriched_ratings.append(profile_out)
             except Exception as e:
@@ -306,18 +306,26 @@ async def update_availability(
     except:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="")  
     
-@router.patch('/update_psychologist_for_consultaion/{user_id}/{is_available}')
-async def update_availability_interservice(
-    user_id:int,
-    is_available:bool,
+@router.post('/reserve_doctor/{psychologist_id}')
+async def reserve_doctor(
+    psychologist_id: int,
+    data: users.DoctorReservation,
     session: AsyncSession = Depends(get_session)
     ):
-    try :
-        data= await crud.psychologist_availability_update(session,user_id,is_available)
-        return JSONResponse(content={"status": data}, status_code=200)
-    except:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="")  
-    
+    fees = await crud.reserve_psychologist(session, psychologist_id)
+    if fees is None:
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Doctor is not available")
+    # The doctor only goes offline once the marker that lets the booking release them is written
+    try:
+        await remember_reservation(psychologist_id, data.booking_id)
+    except RedisError as e:
+        await session.rollback()
+        logger.error(f"Could not record reservation of doctor {psychologist_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Reservation is unavailable right now")
+    await session.commit()
+    return {"fees": fees}
+
 @router.patch('/update_psychologist_documents/{user_id}')
 async def update_psychologist_documents(
     user_id:int,
@@ -329,25 +337,13 @@ async def update_psychologist_documents(
     ):
     try:
         if experience_certificate:
-            edu_url = await run_in_threadpool(
-                upload_to_cloudinary, 
-                experience_certificate, 
-                "doctor_verification/education"
-                )
+            edu_url = await storage.upload(experience_certificate, "doctor_verification/education")
             await crud.update_psychologist_documents_crud(session,user_id,edu_url,'edu_url')
         elif identification_doc:
-            id_url = await run_in_threadpool(
-                upload_to_cloudinary, 
-                identification_doc, 
-                "doctor_verification/id"
-                )
+            id_url = await storage.upload(identification_doc, "doctor_verification/id")
             await crud.update_psychologist_documents_crud(session,user_id,id_url,'id_url')
         elif education_certificate:
-            exp_url = await run_in_threadpool(
-                upload_to_cloudinary, 
-                education_certificate, 
-                "doctor_verification/experience"
-                )
+            exp_url = await storage.upload(education_certificate, "doctor_verification/experience")
             await crud.update_psychologist_documents_crud(session,user_id,exp_url,'exp_url')
     except Exception as e :
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,detail='unable to upload image')
@@ -369,12 +365,29 @@ async def get_user_details(user_id: int,current_user: str = Depends(get_current_
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/get_user_details_by_id/{user_id}", response_model=users.UserNameWithProfileImage)
-async def get_user_details_by_id(user_id: int, session: AsyncSession = Depends(get_session)):
-    data = await crud.get_user_by_id_for_profile(session,user_id)
+async def get_user_details_by_id(user_id: int):
+    async def load_user():
+        async with async_session() as session:
+            user = await crud.get_user_by_id_for_profile(session, user_id)
+        return users.UserNameWithProfileImage.model_validate(user).model_dump() if user else None
+
+    data = await cached_profile("user", user_id, load_user)
     if not data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return data
 
+@router.post("/get_users_details_by_ids", response_model=Dict[int, users.UserBulkProfile])
+async def get_users_details_by_ids(data: users.BulkUserIds):
+    async def load_profiles(user_ids):
+        async with async_session() as session:
+            profiles = await crud.get_users_by_ids_for_profile(session, user_ids)
+        return {
+            profile.id: users.UserBulkProfile.model_validate(profile).model_dump()
+            for profile in profiles
+        }
+
+    return await cached_profiles_bulk(data.ids, load_profiles)
+
 @router.get("/check_doctor_availability/{psychologist_id}")
 async def get_user_details_by_id(psychologist_id: int, session: AsyncSession = Depends(get_session)):
     data = await crud.check_doctor_availability(session,psychologist_id)
@@ -383,8 +396,13 @@ async def get_user_details_by_id(psychologist_id: int, session: AsyncSession = D
     return data
 
 @router.get("/get_doctor_details_by_id/{psychologist_id}", response_model=users.DoctorNameWithProfileImage)
-async def get_doctor_details_by_id(psychologist_id: int, session: AsyncSession = Depends(get_session)):
-    data = await crud.get_doctor_by_id_for_profile(session,psychologist_id)
+async def get_doctor_details_by_id(psychologist_id: int):
+    async def load_doctor():
+        async with async_session() as session:
+            doctor = await crud.get_doctor_by_id_for_profile(session, psychologist_id)
+        return users.DoctorNameWithProfileImage.model_validate(doctor).model_dump() if doctor else None
+
+    data = await cached_profile("doctor", psychologist_id, load_doctor)
     if not data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return data
@@ -472,24 +490,16 @@ async def doctor_verification(
             )
     try:
         try:
-            id_url = await run_in_threadpool(
-                upload_to_cloudinary, 
-                id, 
-                "doctor_verification/id")
-            edu_url = await run_in_threadpool(
-                upload_to_cloudinary, 
-                educationalCertificate, 
-                "doctor_verification/education"
-                )
-            exp_url = await run_in_threadpool(
-                upload_to_cloudinary, 
-                experienceCertificate, 
-                "doctor_verification/experience"
-                )
+            # All three documents go up at once
+            id_url, edu_url, exp_url = await storage.upload_many([
+                (id, "doctor_verification/id"),
+                (educationalCertificate, "doctor_verification/education"),
+                (experienceCertificate, "doctor_verification/experience"),
+            ])
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_502_BAD_GATEWAY,
-                detail=f"Cloudinary upload failed: {str(e)}"
+                detail=f"Media upload failed: {str(e)}"
             )
         try:
             await crud.doctor_profile_creation(
@@ -532,26 +542,18 @@ async def doctor_verification_update(
         edu_url = None
         exp_url = None
         try:
-            if id and id.filename:  
-                id_url = await run_in_threadpool(upload_to_cloudinary, id, "doctor_verification/id")
-            
-            if educationalCertificate and educationalCertificate.filename:
-                edu_url = await run_in_threadpool(
-                    upload_to_cloudinary, 
-                    educationalCertificate, 
-                    "doctor_verification/education"
-                    )
-            
-            if experienceCertificate and experienceCertificate.filename:
-                exp_url = await run_in_threadpool(
-                    upload_to_cloudinary, 
-                    experienceCertificate, 
-                    "doctor_verification/experience"
-                    )
+            documents = {
+                "id": (id, "doctor_verification/id"),
+                "edu": (educationalCertificate, "doctor_verification/education"),
+                "exp": (experienceCertificate, "doctor_verification/experience"),
+            }
+            provided = {key: doc for key, doc in documents.items() if doc[0] and doc[0].filename}
+            urls = dict(zip(provided, await storage.upload_many(provided.values())))
+            id_url, edu_url, exp_url = urls.get("id"), urls.get("edu"), urls.get("exp")
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_502_BAD_GATEWAY,
-                detail=f"Cloudinary upload failed: {str(e)}"
+                detail=f"Media upload failed: {str(e)}"
             )
         try:
             await crud.doctor_profile_update(
@@ -694,7 +696,7 @@ async def toggle_user_status(
         if user_id != int(userId):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
 
-        profile_url = await run_in_threadpool(upload_to_cloudinary, profile_image, "profile_images/id")
+        profile_url = await storage.upload(profile_image, "profile_images/id")
         data= await crud.update_user_profile_image(session,user_id,profile_url)
         return JSONResponse(content={"status": data}, status_code=200)
     except HTTPException:
@@ -717,7 +719,7 @@ async def toggle_user_status(
         if user_id != int(userId):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="User is not authorized")
         
-        profile_url = await run_in_threadpool(upload_to_cloudinary, profile_image, "profile_images/id")
+        profile_url = await storage.upload(profile_image, "profile_images/id")
         data= await crud.update_user_psychologist_image(session,user_id,profile_url)
         return JSONResponse(content={"status": data}, status_code=200)
     except HTTPException:
@@ -774,8 +776,8 @@ async def refresh_token(request: Request,session:AsyncSession= Depends(get_sessi
             detail="Refresh token missing in cookies",
         )
 
-    payload = verify_token(refresh_token)
-    if not payload:
+    payload = await verify_claims(refresh_token)
+    if not payload or not is_refresh_token(payload):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid refresh token",
@@ -794,6 +796,20 @@ async def refresh_token(request: Request,session:AsyncSession= Depends(get_sessi
         "token_type": "bearer"
     }
 
+@router.post("/logout")
+async def logout(request: Request):
+    tokens = [request.cookies.get("refresh_token")]
+    auth_header = request.headers.get("authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        tokens.append(auth_header.split(" ", 1)[1])
+    for token in filter(None, tokens):
+        claims = await verify_claims(token)
+        if claims:
+            await revoke_token(claims)
+    response = JSONResponse(content={"status": "logged out"})
+    response.delete_cookie(key="refresh_token", httponly=True, secure=True, samesite="strict")
+    return response
+
 @router.get("/get_fees_of_doctor/{psychologist_id}")
 async def get_fees_of_doctor(psychologist_id:int ,session: AsyncSession = Depends(get_session)):
     try:
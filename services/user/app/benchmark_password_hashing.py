@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import time
+from fastapi import HTTPException
+from utility.security import BCRYPT_ROUNDS, pwd_context, verify_password, password_hasher
+
+# Compares login-style password checks done inline on the event loop with the
+# pooled verify_password, under the same number of concurrent logins. Besides
+# throughput it reports the longest stall seen by a 10 ms ticker, which is how
+# long every other request on the worker would have been stuck.
+
+
+async def ticker(stop: asyncio.Event, stalls: list):
+    interval = 0.01
+    expected = time.perf_counter() + interval
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        stalls.append(max(0.0, now - expected))
+        expected = now + interval
+
+
+async def run(mode: str, password: str, hashed: str, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    rejected = 0
+
+    async def login():
+        nonlocal rejected
+        async with semaphore:
+            if mode == "inline":
+                assert pwd_context.verify(password, hashed)
+                return
+            try:
+                assert await verify_password(password, hashed)
+            except HTTPException:
+                rejected += 1
+
+    stop, stalls = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, stalls))
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    stalls.sort()
+    line = f"{mode:>6}: {(logins - rejected) / elapsed:8.1f} logins/s"
+    if stalls:
+        line += f"  loop stall p50 {stalls[len(stalls) // 2] * 1000:7.1f} ms  max {stalls[-1] * 1000:7.1f} ms"
+    if rejected:
+        line += f"  rejected {rejected}"
+    print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Login password-check throughput, inline vs pooled")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = pwd_context.hash(password)
+    print(f"bcrypt rounds={BCRYPT_ROUNDS}, pool={password_hasher.workers} workers, max pending={password_hasher.max_pending}")
+    await run("inline", password, hashed, args.logins, args.concurrency)
+    await run("pooled", password, hashed, args.logins, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+from redis.exceptions import RedisError, ResponseError
+from sqlalchemy import func, select
+from core.redis import redis_client
+
+logger = logging.getLogger("uvicorn.error")
+
+EVENT_STREAM_PREFIX = "events:"
+EVENT_DEAD_LETTER_STREAM = "events:dead"
+EVENT_STREAM_MAXLEN = int(os.getenv("EVENT_STREAM_MAXLEN", 100000))
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", 50))
+EVENT_BLOCK_MS = int(os.getenv("EVENT_BLOCK_MS", 5000))
+# A delivery not acked for this long is handed to another consumer
+EVENT_CLAIM_IDLE_MS = int(os.getenv("EVENT_CLAIM_IDLE_MS", 30000))
+EVENT_MAX_DELIVERIES = int(os.getenv("EVENT_MAX_DELIVERIES", 10))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1.0))
+
+Handler = Callable[[str, Dict], Awaitable[None]]
+
+
+def stream_name(event_type: str) -> str:
+    return f"{EVENT_STREAM_PREFIX}{event_type}"
+
+
+def new_event_id() -> str:
+    return uuid.uuid4().hex
+
+
+async def publish_event(event_type: str, payload: Dict, event_id: Optional[str] = None) -> str:
+    """Append an event to its Redis stream, bypassing the outbox."""
+    event_id = event_id or new_event_id()
+    await redis_client.xadd(
+        stream_name(event_type),
+        {"id": event_id, "type": event_type, "payload": json.dumps(payload, default=str)},
+        maxlen=EVENT_STREAM_MAXLEN,
+        approximate=True,
+    )
+    return event_id
+
+
+class OutboxRelay:
+    """Publishes rows of an outbox table to Redis streams.
+
+    Rows are written in the same transaction as the state change they
+    describe, so an event exists exactly when its change committed. Each
+    worker polls for unpublished rows with SKIP LOCKED; ``notify`` wakes
+    the relay right after a commit instead of waiting for the next poll.
+    A crash between XADD and marking the row published means the event is
+    sent again, so consumers must tolerate duplicates.
+    """
+
+    def __init__(self, session_factory, model):
+        self.session_factory = session_factory
+        self.model = model
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._published = 0
+        self._errors = 0
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _drain(self) -> int:
+        model = self.model
+        async with self.session_factory() as session:
+            async with session.begin():
+                rows = (await session.execute(
+                    select(model)
+                    .where(model.published_at.is_(None))
+                    .order_by(model.id)
+                    .limit(EVENT_BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )).scalars().all()
+                for row in rows:
+                    await publish_event(row.event_type, row.payload, row.event_id)
+                    row.published_at = func.now()
+        self._published += len(rows)
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            try:
+                if await self._drain() == EVENT_BATCH_SIZE:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._errors += 1
+                logger.warning(f"[outbox] relay failed, retrying: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict:
+        return {"published": self._published, "errors": self._errors}
+
+
+class EventConsumer:
+    """Consumes event streams through a Redis consumer group.
+
+    An event is acked only after its handler returns, so a crash or an
+    exception leaves it pending; pending events idle for longer than
+    EVENT_CLAIM_IDLE_MS are claimed again, and after EVENT_MAX_DELIVERIES
+    attempts moved to ``events:dead``. Delivery is at-least-once, handlers
+    must be idempotent.
+    """
+
+    def __init__(self, group: str, handlers: Dict[str, Handler]):
+        self.group = group
+        self.handlers = handlers
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._streams = {stream_name(event_type): event_type for event_type in handlers}
+        self._task: Optional[asyncio.Task] = None
+        self._handled = 0
+        self._failed = 0
+        self._dead = 0
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _ensure_groups(self):
+        for stream in self._streams:
+            try:
+                await redis_client.xgroup_create(stream, self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def _handle(self, stream: str, message_id: str, fields: Dict):
+        try:
+            await self.handlers[self._streams[stream]](fields["id"], json.loads(fields["payload"]))
+        except Exception as e:
+            self._failed += 1
+            logger.error(f"[events] {self.group} failed on {stream} {message_id}: {e}")
+            return
+        await redis_client.xack(stream, self.group, message_id)
+        self._handled += 1
+
+    async def _reclaim(self):
+        for stream in self._streams:
+            pending = await redis_client.xpending_range(
+                stream, self.group, "-", "+", EVENT_BATCH_SIZE, idle=EVENT_CLAIM_IDLE_MS
+            )
+            retry = []
+            for entry in pending:
+                if entry["times_delivered"] < EVENT_MAX_DELIVERIES:
+                    retry.append(entry["message_id"])
+                    continue
+                for message_id, fields in await redis_client.xrange(stream, entry["message_id"], entry["message_id"]):
+                    await redis_client.xadd(
+                        EVENT_DEAD_LETTER_STREAM, {**fields, "stream": stream, "group": self.group},
+                        maxlen=EVENT_STREAM_MAXLEN, approximate=True,
+                    )
+                await redis_client.xack(stream, self.group, entry["message_id"])
+                self._dead += 1
+                logger.error(f"[events] {self.group} gave up on {stream} {entry['message_id']}")
+            if retry:
+                for message_id, fields in await redis_client.xclaim(stream, self.group, self.consumer, EVENT_CLAIM_IDLE_MS, retry):
+                    if fields:
+                        await self._handle(stream, message_id, fields)
+
+    async def _run(self):
+        groups_ready = False
+        while True:
+            try:
+                if not groups_ready:
+                    await self._ensure_groups()
+                    groups_ready = True
+                await self._reclaim()
+                response = await redis_client.xreadgroup(
+                    self.group, self.consumer, {stream: ">" for stream in self._streams},
+                    count=EVENT_BATCH_SIZE, block=EVENT_BLOCK_MS,
+                )
+                for stream, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._handle(stream, message_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                logger.warning(f"[events] {self.group} consumer lost redis, retrying: {e}")
+                groups_ready = False
+                await asyncio.sleep(1)
+
+    def stats(self) -> Dict:
+        return {
+            "group": self.group,
+            "streams": list(self._streams),
+            "handled": self._handled,
+            "failed": self._failed,
+            "dead_lettered": self._dead,
+        }
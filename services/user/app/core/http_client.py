@@ -0,0 +1,144 @@
+import httpx
+import os
+import time
+import logging
+import importlib.util
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+# h2 is optional, httpx refuses http2=True without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamClient:
+    """Long-lived, pooled httpx client for one upstream service.
+
+    Limits and timeouts are read from ``<PREFIX>_*`` environment variables so
+    each upstream can be tuned independently.
+    """
+
+    def __init__(self, name: str, env_prefix: str, default_url: str):
+        self.name = name
+        self.base_url = os.getenv(f"{env_prefix}_URL", default_url)
+        self.max_connections = int(os.getenv(f"{env_prefix}_MAX_CONNECTIONS", 100))
+        self.max_keepalive = int(os.getenv(f"{env_prefix}_MAX_KEEPALIVE", 20))
+        self.keepalive_expiry = float(os.getenv(f"{env_prefix}_KEEPALIVE_EXPIRY", 30))
+        self.timeout = float(os.getenv(f"{env_prefix}_TIMEOUT", 10))
+        self.connect_timeout = float(os.getenv(f"{env_prefix}_CONNECT_TIMEOUT", 3))
+        self.pool_timeout = float(os.getenv(f"{env_prefix}_POOL_TIMEOUT", 5))
+        self.http2 = HTTP2_AVAILABLE and os.getenv(f"{env_prefix}_HTTP2", "true").lower() == "true"
+        self._client: Optional[httpx.AsyncClient] = None
+        self._in_flight = 0
+        self._requests = 0
+        self._errors = 0
+        self._wait_times = deque(maxlen=1000)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so scripts and workers that never run the app lifespan still work
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(
+                    self.timeout, connect=self.connect_timeout, pool=self.pool_timeout
+                ),
+            )
+        return self._client
+
+    async def start(self):
+        self.client
+        logger.info(f"[http] {self.name} pool ready ({self.base_url}, http2={self.http2})")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        acquired = {}
+
+        # httpcore trace hook: the first send event marks the moment a pooled
+        # connection was handed to us, so the gap is the pool wait (+ connect)
+        async def trace(event_name, info):
+            if "acquired" not in acquired and event_name.endswith("send_request_headers.started"):
+                acquired["acquired"] = time.perf_counter()
+
+        extensions = kwargs.pop("extensions", {}) or {}
+        extensions.setdefault("trace", trace)
+        self._in_flight += 1
+        self._requests += 1
+        try:
+            return await self.client.request(method, url, extensions=extensions, **kwargs)
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            if "acquired" in acquired:
+                self._wait_times.append(acquired["acquired"] - started)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PATCH", url, **kwargs)
+
+    def stats(self) -> Dict:
+        in_use = idle = 0
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        for connection in getattr(pool, "connections", []):
+            if connection.is_idle():
+                idle += 1
+            else:
+                in_use += 1
+        waits = sorted(self._wait_times)
+        return {
+            "base_url": self.base_url,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "connections_in_use": in_use,
+            "connections_idle": idle,
+            "requests_in_flight": self._in_flight,
+            "requests_total": self._requests,
+            "errors_total": self._errors,
+            "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+            "wait_ms_p99": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else 0.0,
+        }
+
+
+consultation_service_client = UpstreamClient(
+    "consultation-service", "CONSULTATION_SERVICE", "http://consultation-service:8001"
+)
+
+google_certs_client = UpstreamClient(
+    "google-certs", "GOOGLE_CERTS", "https://www.googleapis.com"
+)
+
+UPSTREAMS = [consultation_service_client, google_certs_client]
+
+
+async def start_http_clients():
+    for upstream in UPSTREAMS:
+        await upstream.start()
+
+
+async def close_http_clients():
+    for upstream in UPSTREAMS:
+        await upstream.close()
+
+
+def http_pool_stats() -> Dict:
+    return {upstream.name: upstream.stats() for upstream in UPSTREAMS}
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from redis.exceptions import RedisError
+from core.redis import redis_client
+
+logger = logging.getLogger("uvicorn.error")
+
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", 300))
+PROFILE_LOCK_TTL = 5
+PROFILE_LOCK_WAIT = 2.0
+PROFILE_INVALIDATION_CHANNEL = "profile:invalidate"
+PROFILE_KINDS = ("user", "doctor", "bulk")
+
+# Only write the loaded value if no invalidation happened while we were loading
+_SET_IF_GENERATION = """
+local current = redis.call('GET', KEYS[2]) or '0'
+if current == ARGV[1] then
+    return redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return nil
+"""
+
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def _key(kind: str, user_id: int) -> str:
+    return f"profile:{kind}:{user_id}"
+
+
+def _generation_key(user_id: int) -> str:
+    return f"profile:gen:{user_id}"
+
+
+async def _store(kind: str, user_id: int, generation: str, value: dict):
+    await redis_client.eval(
+        _SET_IF_GENERATION, 2, _key(kind, user_id), _generation_key(user_id),
+        generation, json.dumps(value, default=str), PROFILE_CACHE_TTL,
+    )
+
+
+async def _load_with_lock(kind: str, user_id: int, loader: Callable[[], Awaitable[Optional[dict]]]):
+    key = _key(kind, user_id)
+    lock_key = f"{key}:lock"
+    lock_token = str(uuid.uuid4())
+    if await redis_client.set(lock_key, lock_token, ex=PROFILE_LOCK_TTL, nx=True):
+        try:
+            generation = await redis_client.get(_generation_key(user_id)) or "0"
+            value = await loader()
+            if value is not None:
+                await _store(kind, user_id, generation, value)
+            return value
+        finally:
+            if await redis_client.get(lock_key) == lock_token:
+                await redis_client.delete(lock_key)
+
+    # Another worker is already loading this profile, wait for its result
+    waited = 0.0
+    while waited < PROFILE_LOCK_WAIT:
+        await asyncio.sleep(0.05)
+        waited += 0.05
+        cached = await redis_client.get(key)
+        if cached is not None:
+            return json.loads(cached)
+    return await loader()
+
+
+async def cached_profile(kind: str, user_id: int, loader: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+    """Read-through lookup with single-flight loading, in-process and across workers."""
+    key = _key(kind, user_id)
+    try:
+        cached = await redis_client.get(key)
+    except RedisError as e:
+        logger.warning(f"[profile-cache] redis unavailable, reading through: {e}")
+        return await loader()
+    if cached is not None:
+        return json.loads(cached)
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_with_lock(kind, user_id, loader))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        return await asyncio.shield(task)
+    except RedisError as e:
+        logger.warning(f"[profile-cache] redis error while loading {key}: {e}")
+        return await loader()
+
+
+async def cached_profiles_bulk(
+    user_ids: Iterable[int],
+    loader: Callable[[List[int]], Awaitable[Dict[int, dict]]],
+) -> Dict[int, dict]:
+    ids = list(dict.fromkeys(user_ids))
+    if not ids:
+        return {}
+    try:
+        cached = await redis_client.mget([_key("bulk", user_id) for user_id in ids])
+        generations = await redis_client.mget([_generation_key(user_id) for user_id in ids])
+    except RedisError as e:
+        logger.warning(f"[profile-cache] redis unavailable, reading through: {e}")
+        return await loader(ids)
+
+    profiles = {user_id: json.loads(value) for user_id, value in zip(ids, cached) if value is not None}
+    missing = [user_id for user_id in ids if user_id not in profiles]
+    if missing:
+        loaded = await loader(missing)
+        profiles.update(loaded)
+        generation_by_id = dict(zip(ids, generations))
+        try:
+            await asyncio.gather(*(
+                _store("bulk", user_id, generation_by_id.get(user_id) or "0", value)
+                for user_id, value in loaded.items()
+            ))
+        except RedisError as e:
+            logger.warning(f"[profile-cache] failed to populate bulk profiles: {e}")
+    return profiles
+
+
+async def invalidate_profile(user_id: int):
+    """Drop every cached shape of a profile and tell other services to do the same."""
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(_generation_key(user_id))
+            pipe.expire(_generation_key(user_id), 86400)
+            pipe.delete(*[_key(kind, user_id) for kind in PROFILE_KINDS])
+            pipe.publish(PROFILE_INVALIDATION_CHANNEL, str(user_id))
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"[profile-cache] failed to invalidate profile {user_id}: {e}")
@@ -9,6 +9,9 @@ from fastapi import HTTPException
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from datetime import date 
 from sqlalchemy.sql import or_
+from typing import List
+from core.profile_cache import invalidate_profile
+from core.token_cache import revoke_subject
 
 
 async def get_user_by_email(session: AsyncSession, email: str):
@@ -60,6 +63,21 @@ async def get_doctor_by_id_for_profile(session: AsyncSession, psychologist_id: i
         await session.rollback()
    
 
+async def get_users_by_ids_for_profile(session: AsyncSession, user_ids: List[int]):
+    try:
+        result = await session.execute(
+        select(User)
+        .outerjoin(User.user_profile)
+        .outerjoin(User.psychologist_profile)
+        .options(contains_eager(User.user_profile), contains_eager(User.psychologist_profile))
+        .where(User.id.in_(user_ids))
+        )
+        return result.unique().scalars().all()
+    except Exception :
+        await session.rollback()
+        return []
+   
+
 async def check_doctor_availability(session: AsyncSession, psychologist_id: int):
     try:
         result = await session.execute(
@@ -100,7 +118,7 @@ async def create_user(session: AsyncSession, user: UserCreate):
             name=user.name,
             email_address=user.email_address,
             mobile_number=user.mobile_number,
-            password=hash_password(user.password),
+            password=await hash_password(user.password),
             role=user.role
         )
         session.add(db_user)
@@ -140,7 +158,7 @@ async def create_google_user(session: AsyncSession, name: str, email: str, profi
             name=name,
             email_address=email,
             mobile_number=None,
-            password=hash_password(str(password)),
+            password=await hash_password(str(password)),
             role='patient',
             is_active=True,
             is_verified=True,
@@ -196,8 +214,12 @@ async def update_user_status_email(session: AsyncSession,email:str):
     
 async def toggle_user_status_by_id(session: AsyncSession,user_id:int):
     try:
-        await session.execute( update(User).where(User.id == user_id).values(is_active=~User.is_active))
+        result = await session.execute( update(User).where(User.id == user_id).values(is_active=~User.is_active).returning(User.is_active))
+        is_active = result.scalar_one_or_none()
         await session.commit()
+        await invalidate_profile(user_id)
+        if is_active is False:
+            await revoke_subject(user_id)
     except Exception :
         await session.rollback()
     
@@ -206,6 +228,7 @@ async def update_user_profile_image(session: AsyncSession,user_id:int,profile_ur
     try:
         await session.execute( update(UserProfile).where(UserProfile.user_id == user_id).values(profile_image=profile_url))
         await session.commit()
+        await invalidate_profile(user_id)
     except Exception :
         await session.rollback()
     
@@ -214,6 +237,7 @@ async def update_user_psychologist_image(session: AsyncSession,user_id:int,profi
     try:
         await session.execute( update(PsychologistProfile).where(PsychologistProfile.user_id == user_id).values(profile_image=profile_url))
         await session.commit()
+        await invalidate_profile(user_id)
     except Exception :
         await session.rollback()
     
@@ -243,6 +267,22 @@ async def psychologist_availability_update(session: AsyncSession,user_id:int,isA
         await session.rollback()
         return False
         
+async def reserve_psychologist(session: AsyncSession, user_id: int):
+    """Take an available doctor off the list in one statement; returns their fee, or None if they were not available.
+
+    Left uncommitted so the caller can record the reservation before it takes effect.
+    """
+    result = await session.execute(
+        update(PsychologistProfile)
+        .where(PsychologistProfile.user_id == user_id, PsychologistProfile.is_available.is_(True))
+        .values(is_available=False)
+        .returning(PsychologistProfile.fees)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    return row.fees or 0
+
 async def update_psychologist_documents_crud(session: AsyncSession,user_id:int,url:str,doc_type):
     try:
         if doc_type=='edu_url': 
@@ -256,9 +296,14 @@ async def update_psychologist_documents_crud(session: AsyncSession,user_id:int,u
     except SQLAlchemyError as e:
         await session.rollback()
     
+async def update_password_hash(session: AsyncSession, user_id: int, password_hash: str):
+    await session.execute(update(User).where(User.id == user_id).values(password=password_hash))
+    await session.commit()
+
 async def update_user_password(session: AsyncSession,email:str,password :str):
+    password_hash = await hash_password(password)
     try:
-        await session.execute( update(User).where(User.email_address == email).values(password=hash_password(password)))
+        await session.execute( update(User).where(User.email_address == email).values(password=password_hash))
         await session.commit()
     except Exception :
         await session.rollback()
@@ -330,6 +375,7 @@ async def update_user_and_profile(
             session.add(new_profile)
 
         await session.commit()
+        await invalidate_profile(user_id)
         return user
     except Exception :
         await session.rollback()
@@ -366,6 +412,7 @@ async def update_psychologist_and_profile(
             profile.fees = update_data.fees
         
         await session.commit()
+        await invalidate_profile(user_id)
         return user
     except Exception :
         await session.rollback()
@@ -402,6 +449,7 @@ async def doctor_profile_creation(
         session.add(verification)
         await session.commit()
         await session.refresh(verification)
+        await invalidate_profile(user_id)
         return verification
 
     except SQLAlchemyError as e:
@@ -449,6 +497,7 @@ async def doctor_profile_update(
                 
         await session.flush()
         await session.commit()
+        await invalidate_profile(user_id)
         return profile
 
     except SQLAlchemyError as e:
@@ -0,0 +1,51 @@
+import logging
+import os
+from typing import Dict
+from core.events import EventConsumer
+from core.redis import redis_client
+from dependencies.database import async_session
+import crud.crud as crud
+
+logger = logging.getLogger("uvicorn.error")
+
+DOCTOR_RELEASE = "booking.doctor_release"
+CONSULTATION_COMPLETED = "consultation.completed"
+DOCTOR_RESERVATION_TTL = int(os.getenv("DOCTOR_RESERVATION_TTL", 86400))
+
+_DELETE_IF_EQUAL = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def reservation_key(psychologist_id: int) -> str:
+    return f"doctor:reservation:{psychologist_id}"
+
+
+async def remember_reservation(psychologist_id: int, booking_id: int):
+    await redis_client.set(reservation_key(psychologist_id), str(booking_id), ex=DOCTOR_RESERVATION_TTL)
+
+
+async def release_doctor(event_id: str, payload: Dict):
+    """Make the doctor available again, but only if the reservation is still the one being released.
+
+    A release for a reservation that never happened, or one that a later
+    booking has replaced, is ignored, which also makes redeliveries safe.
+    """
+    key = reservation_key(payload["psychologist_id"])
+    booking_id = str(payload["booking_id"])
+    if await redis_client.get(key) != booking_id:
+        return
+    async with async_session() as session:
+        if not await crud.psychologist_availability_update(session, payload["psychologist_id"], True):
+            raise RuntimeError(f"could not release doctor {payload['psychologist_id']}")
+    await redis_client.eval(_DELETE_IF_EQUAL, 1, key, booking_id)
+    logger.info(f"[booking] released doctor {payload['psychologist_id']} from booking {booking_id}")
+
+
+booking_consumer = EventConsumer("user-service", {
+    DOCTOR_RELEASE: release_doctor,
+    CONSULTATION_COMPLETED: release_doctor,
+})
@@ -1,14 +1,17 @@
 import httpx
-CONSULTATION_SERVICE_URL = "http://consultation-service:8001"
+from typing import Dict, Iterable
+from core.http_client import consultation_service_client
 
-async def get_psycholgist_rating(psychologist_id: int) -> dict:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{CONSULTATION_SERVICE_URL}/get_psycholgist_rating/{psychologist_id}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            print(f"HTTPX Request error: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f" error in payment-service: {e}")
-    return {}       
\ No newline at end of file
+async def get_psychologist_ratings_bulk(psychologist_ids: Iterable[int]) -> Dict[int, float]:
+    ids = sorted({int(psychologist_id) for psychologist_id in psychologist_ids})
+    if not ids:
+        return {}
+    try:
+        response = await consultation_service_client.post("/get_psychologist_ratings", json={"ids": ids})
+        response.raise_for_status()
+        return {int(psychologist_id): rating for psychologist_id, rating in response.json().items()}
+    except httpx.RequestError as e:
+        print(f"HTTPX Request error: {e}")
+    except httpx.HTTPStatusError as e:
+        print(f" error in consultation-service: {e}")
+    return {}
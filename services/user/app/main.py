@@ -1,11 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api import user
+from api import user, metrics
 from core import cloudinary_config
+from core.http_client import start_http_clients, close_http_clients
+from utility.google_auth import google_verifier
+from core.token_cache import start_revocation_listener, stop_revocation_listener
+from infra.booking_events import booking_consumer
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_http_clients()
+    await google_verifier.key_set.start()
+    await start_revocation_listener()
+    await booking_consumer.start()
+    yield
+    await booking_consumer.stop()
+    await stop_revocation_listener()
+    await google_verifier.key_set.stop()
+    await close_http_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(user.router)
+app.include_router(metrics.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,4 +37,4 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
\ No newline at end of file
+)
@@ -117,6 +117,9 @@ class ForgetPasswordOTPSchema(BaseModel):
     
 class AvailabilityUpdate(BaseModel):
     is_available: bool
+
+class DoctorReservation(BaseModel):
+    booking_id: int
         
 class PsychologistProfileOut(BaseModel):
     id: int
@@ -258,3 +261,16 @@ class DoctorNameWithProfileImage(BaseModel):
     model_config = {
         "from_attributes": True
     }
+
+class BulkUserIds(BaseModel):
+    ids: List[int] = Field(..., max_length=500)
+
+class UserBulkProfile(BaseModel):
+    id: int
+    name: str
+    user_profile: Optional[UserProfileImage] = None
+    psychologist_profile: Optional[DoctorProfileDetails] = None
+
+    model_config = {
+        "from_attributes": True
+    }
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, Optional
+from fastapi import HTTPException, status
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
+from core.http_client import google_certs_client
+from config.config import Settings
+
+settings = Settings()
+logger = logging.getLogger("uvicorn.error")
+
+GOOGLE_CERTS_PATH = os.getenv("GOOGLE_CERTS_PATH", "/oauth2/v3/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+# Used when the response carries no max-age
+GOOGLE_CERTS_DEFAULT_MAX_AGE = int(os.getenv("GOOGLE_CERTS_DEFAULT_MAX_AGE", 3600))
+# Refresh in the background this long before the cached set expires
+GOOGLE_CERTS_REFRESH_AHEAD = int(os.getenv("GOOGLE_CERTS_REFRESH_AHEAD", 300))
+# Floor between refetches, so tokens with unknown key ids can't hammer Google
+GOOGLE_CERTS_MIN_REFETCH = int(os.getenv("GOOGLE_CERTS_MIN_REFETCH", 30))
+GOOGLE_TOKEN_LEEWAY = int(os.getenv("GOOGLE_TOKEN_LEEWAY", 10))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def _max_age(cache_control: Optional[str]) -> int:
+    match = _MAX_AGE.search(cache_control or "")
+    return int(match.group(1)) if match else GOOGLE_CERTS_DEFAULT_MAX_AGE
+
+
+class GoogleKeySet:
+    """Google's ID token signing keys, cached for as long as Cache-Control allows.
+
+    Shortly before the cached set expires a refresh is started in the
+    background and requests keep using the current keys; only an empty or
+    expired set makes a request wait, and concurrent waiters share one
+    fetch. Passing ``keys`` pins a fixed JWK list and disables fetching,
+    which is what tests use.
+    """
+
+    def __init__(self, keys: Optional[Iterable[Dict]] = None):
+        self._static = keys is not None
+        self._keys: Dict[str, Key] = {}
+        self._expires_at = float("inf") if self._static else 0.0
+        self._fetched_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._fetches = 0
+        self._errors = 0
+        if keys is not None:
+            self._load(keys)
+
+    def _load(self, keys: Iterable[Dict]):
+        loaded = {}
+        for key in keys:
+            if key.get("kty") != "RSA" or "kid" not in key:
+                continue
+            loaded[key["kid"]] = jwk.construct(key, key.get("alg", "RS256"))
+        self._keys = loaded
+
+    async def _fetch(self):
+        self._fetches += 1
+        self._fetched_at = time.monotonic()
+        try:
+            response = await google_certs_client.get(GOOGLE_CERTS_PATH)
+            response.raise_for_status()
+            self._load(response.json()["keys"])
+        except Exception as e:
+            self._errors += 1
+            if not self._keys:
+                logger.error(f"[google-certs] could not fetch signing keys: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Google sign-in is temporarily unavailable",
+                )
+            # Keep serving the keys we have and try again shortly
+            logger.warning(f"[google-certs] refresh failed, keeping {len(self._keys)} cached keys: {e}")
+            self._expires_at = time.monotonic() + GOOGLE_CERTS_MIN_REFETCH
+            return
+        self._expires_at = time.monotonic() + _max_age(response.headers.get("cache-control"))
+
+    def _refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return self._refresh_task
+
+    async def start(self):
+        if self._static:
+            return
+        try:
+            await self._refresh()
+        except HTTPException:
+            pass
+
+    async def stop(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+
+    async def get(self, kid: str) -> Optional[Key]:
+        if self._static:
+            return self._keys.get(kid)
+        now = time.monotonic()
+        if not self._keys or now >= self._expires_at:
+            await asyncio.shield(self._refresh())
+        elif now >= self._expires_at - GOOGLE_CERTS_REFRESH_AHEAD:
+            self._refresh()
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._fetched_at >= GOOGLE_CERTS_MIN_REFETCH:
+            # Google rotated keys before our copy expired
+            await asyncio.shield(self._refresh())
+            key = self._keys.get(kid)
+        return key
+
+    def stats(self) -> Dict:
+        return {
+            "keys": len(self._keys),
+            "expires_in": None if self._static else round(max(0.0, self._expires_at - time.monotonic()), 1),
+            "fetches": self._fetches,
+            "errors": self._errors,
+        }
+
+
+class GoogleTokenVerifier:
+    """Checks Google ID tokens locally against the cached key set.
+
+    Mirrors ``google.oauth2.id_token.verify_oauth2_token``: RS256 signature,
+    audience, Google issuer and expiry, raising ValueError when any fails.
+    """
+
+    def __init__(self, client_id: str, key_set: GoogleKeySet):
+        self.client_id = client_id
+        self.key_set = key_set
+
+    async def verify(self, credential: str) -> Dict:
+        try:
+            header = jwt.get_unverified_header(credential)
+        except JWTError as e:
+            raise ValueError(f"Malformed token: {e}")
+        key = await self.key_set.get(header.get("kid", ""))
+        if key is None:
+            raise ValueError("Token signed with an unknown key")
+        try:
+            return jwt.decode(
+                credential,
+                key,
+                algorithms=["RS256"],
+                audience=self.client_id,
+                issuer=GOOGLE_ISSUERS,
+                options={"leeway": GOOGLE_TOKEN_LEEWAY, "verify_at_hash": False},
+            )
+        except JWTError as e:
+            raise ValueError(str(e))
+
+
+google_verifier = GoogleTokenVerifier(settings.google_client_id, GoogleKeySet())
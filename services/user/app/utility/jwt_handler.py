@@ -1,3 +1,4 @@
+import uuid
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any
 from fastapi import HTTPException, status
@@ -19,15 +20,15 @@ def create_access_token(user_id: str, role: Optional[str] = None, extra_claims:
     if extra_claims:
         to_encode.update(extra_claims)
 
-    expire = datetime.now(tz=timezone.utc) + timedelta(minutes=ACCESS_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    now = datetime.now(tz=timezone.utc)
+    to_encode.update({"exp": now + timedelta(minutes=ACCESS_EXPIRE_MINUTES), "iat": now, "jti": uuid.uuid4().hex})
 
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def create_refresh_token(user_id: str) -> str:
     to_encode = {"sub": user_id, "refresh": True}
-    expire = datetime.now(tz=timezone.utc) + timedelta(days=REFRESH_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
+    now = datetime.now(tz=timezone.utc)
+    to_encode.update({"exp": now + timedelta(days=REFRESH_EXPIRE_DAYS), "iat": now, "jti": uuid.uuid4().hex})
 
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -1,9 +1,86 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+PASSWORD_HASH_WAIT = float(os.getenv("PASSWORD_HASH_WAIT", 5))
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# min == max == default, so any hash at another cost reports needs_update and gets rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool instead of the event loop.
+
+    bcrypt releases the GIL, so PASSWORD_HASH_WORKERS threads hash in
+    parallel. At most PASSWORD_HASH_MAX_PENDING calls may be running or
+    queued; beyond that a caller waits up to PASSWORD_HASH_WAIT seconds
+    for a slot and then gets a 503, rather than piling up behind the pool.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(max_pending)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._calls = 0
+        self._rejected = 0
+        self._total_ms = 0.0
+
+    async def run(self, func, *args):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=PASSWORD_HASH_WAIT)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            self._calls += 1
+            self._total_ms += (time.perf_counter() - started) * 1000
+            self._slots.release()
+
+    def stats(self) -> Dict:
+        return {
+            "rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "calls": self._calls,
+            "rejected": self._rejected,
+            "avg_ms": round(self._total_ms / self._calls, 3) if self._calls else 0.0,
+        }
+
+
+password_hasher = PasswordHasher()
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify, and return a fresh hash when the stored one was made with a different cost."""
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
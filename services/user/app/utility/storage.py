@@ -0,0 +1,83 @@
+import asyncio
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+import cloudinary.uploader
+from fastapi import UploadFile
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary").lower()
+STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", 8))
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "uploads/media")
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "/media")
+# Cloudinary's chunked upload needs chunks of at least 5 MB
+UPLOAD_CHUNK_SIZE = max(5 * 1024 * 1024, int(os.getenv("STORAGE_UPLOAD_CHUNK_SIZE", 6 * 1024 * 1024)))
+
+# Uploads get their own bounded pool instead of competing with everything else in the default one
+_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+
+
+def _file_size(fileobj: BinaryIO) -> int:
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+class Storage:
+    """Where uploaded media ends up. ``upload`` returns the public URL."""
+
+    async def upload(self, file: UploadFile, folder: str, public_id: Optional[str] = None) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor, partial(self._upload, file.file, file.filename or "", folder, public_id)
+        )
+
+    async def upload_many(self, uploads: Iterable[Tuple[UploadFile, str]]) -> List[str]:
+        """Upload (file, folder) pairs concurrently, in the order given."""
+        return list(await asyncio.gather(*(self.upload(file, folder) for file, folder in uploads)))
+
+    def _upload(self, fileobj: BinaryIO, filename: str, folder: str, public_id: Optional[str]) -> str:
+        raise NotImplementedError
+
+
+class CloudinaryStorage(Storage):
+    def _upload(self, fileobj: BinaryIO, filename: str, folder: str, public_id: Optional[str]) -> str:
+        resource_type = "raw" if filename.lower().endswith(".pdf") else "auto"
+        options = dict(folder=folder, public_id=public_id, resource_type=resource_type, overwrite=True)
+        if _file_size(fileobj) > UPLOAD_CHUNK_SIZE:
+            # Sent in UPLOAD_CHUNK_SIZE pieces rather than as one request body
+            result = cloudinary.uploader.upload_large(fileobj, chunk_size=UPLOAD_CHUNK_SIZE, **options)
+        else:
+            result = cloudinary.uploader.upload(fileobj, **options)
+        return result["secure_url"]
+
+
+class LocalStorage(Storage):
+    """Writes to STORAGE_LOCAL_ROOT, for development and tests without Cloudinary."""
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT, public_url: str = STORAGE_PUBLIC_URL):
+        self.root = Path(root)
+        self.public_url = public_url.rstrip("/")
+
+    def _upload(self, fileobj: BinaryIO, filename: str, folder: str, public_id: Optional[str]) -> str:
+        suffix = Path(filename).suffix.lower()
+        name = f"{public_id or uuid.uuid4().hex}{suffix}"
+        target = self.root / folder / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fileobj.seek(0)
+        with open(target, "wb") as out:
+            shutil.copyfileobj(fileobj, out, UPLOAD_CHUNK_SIZE)
+        return f"{self.public_url}/{folder}/{name}"
+
+
+def get_storage() -> Storage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    return CloudinaryStorage()
+
+
+storage = get_storage()